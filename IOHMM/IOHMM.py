@@ -26,22 +26,39 @@ from __future__ import division
 from __future__ import absolute_import
 from builtins import range
 from builtins import object
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy, deepcopy
 import logging
+import multiprocessing
 import os
+import time
 import warnings
 
 
 import numpy as np
+from threadpoolctl import threadpool_limits
 
 
-from .forward_backward import forward_backward
+from .forward_backward import (Workspace, forward_backward_batch, forward_backward_scaled_batch,
+                               forward_backward_beam, _empty, _log_state_to_dense,
+                               _mask_known_pairs)
 from .linear_models import (GLM, OLS, DiscreteMNL, CrossEntropyMNL)
+from .parallel import EStepPool
+from .sampling import sample_states_batch
+from .transition_structure import TransitionStructure, forward_backward_sparse_batch
+from .viterbi import viterbi_batch
 
 
 warnings.simplefilter("ignore")
 np.random.seed(0)
 EPS = np.finfo(float).eps
+# number of sequences that go through the forward backward algorithm together
+E_STEP_BATCH_SIZE = 256
+# the map from the engine name to the batched forward backward algorithm
+FORWARD_BACKWARD_ENGINES = {
+    'log': forward_backward_batch,
+    'scaled': forward_backward_scaled_batch,
+}
 
 
 class LinearModelLoader(object):
@@ -56,6 +73,97 @@ class LinearModelLoader(object):
     CrossEntropyMNL = CrossEntropyMNL
 
 
+def _split_batches(lengths):
+    """
+    Split the sequences into batches of similar lengths.
+    Parameters
+    ----------
+    lengths: array of shape (n_seqs, ), the length of each sequence
+    Returns
+    -------
+    batches: list of arrays of the indices of the sequences in each batch,
+             each with at most E_STEP_BATCH_SIZE sequences.
+    """
+    order = np.argsort(lengths, kind='stable')
+    return np.array_split(order, -(-lengths.shape[0] // E_STEP_BATCH_SIZE))
+
+
+def _split_rows(stacked, offsets):
+    """
+    Split a stacked array into the views of the rows of each sequence.
+    Parameters
+    ----------
+    stacked: array of shape (offsets[-1], ...), the concatenation of all sequences.
+    offsets: array of shape (n_seqs + 1, ),
+             sequence i is the rows offsets[i]:offsets[i + 1] of stacked.
+    Returns
+    -------
+    views: list of arrays of shape (offsets[i + 1] - offsets[i], ...), views of stacked.
+    """
+    return [stacked[offsets[i]:offsets[i + 1]] for i in range(offsets.shape[0] - 1)]
+
+
+def _log_state_from_states(states):
+    """
+    Convert the ground truth hidden states of a sequence given to set_data
+    into the log_state taken by the forward backward algorithm.
+    Parameters
+    ----------
+    states: dictionary of (timestamp -> array of shape (num_states, )),
+            or an array of the known states, see forward_backward.
+    Returns
+    -------
+    log_state: dictionary of (timestamp -> array of shape (num_states, )) of log probabilities,
+               or the array of the known states.
+    """
+    if isinstance(states, dict):
+        return {k: np.log(states[k]) for k in states}
+    return np.asarray(states)
+
+
+def _pad_sequences(log_probs, log_state_dicts, num_states, workspace=None, dtype=np.float64):
+    """
+    Pad the log probabilities and the known states of a batch of sequences.
+    Parameters
+    ----------
+    log_probs: list of (log_prob_initial, log_prob_transition, log_Ey) of each sequence,
+               log_prob_transition is of shape (t-1, num_states, num_states),
+               or (t-1, nnz) with a transition structure.
+    log_state_dicts: list of log_state of each sequence,
+                     dictionary of (timestamp -> array of shape (num_states, ))
+                     or an array of the known states, see forward_backward.
+    num_states: the number of hidden states
+    workspace: Workspace or None, if given the padded arrays are views of its buffers.
+    dtype: the floating point type of the padded arrays
+    Returns
+    -------
+    (log_prob_initial, log_prob_transition, log_Ey, lengths, log_states, known_states)
+    in the shapes taken by forward_backward_batch.
+    """
+    lengths = np.array([log_Ey.shape[0] for _, _, log_Ey in log_probs])
+    n_batch, t_max = lengths.shape[0], lengths.max()
+    log_prob_initial = _empty(workspace, 'log_prob_initial', (n_batch, num_states), dtype)
+    log_prob_transition = _empty(workspace, 'log_prob_transition',
+                                 (n_batch, t_max - 1) + log_probs[0][1].shape[1:], dtype)
+    log_Ey = _empty(workspace, 'log_Ey', (n_batch, t_max, num_states), dtype)
+    log_states = _empty(workspace, 'log_states', (n_batch, t_max, num_states), dtype)
+    known_states = _empty(workspace, 'known_states', (n_batch, t_max), dtype=bool)
+    known_states[:] = False
+    for b, (log_probs_b, log_state) in enumerate(zip(log_probs, log_state_dicts)):
+        log_prob_initial[b] = log_probs_b[0]
+        log_prob_transition[b, :lengths[b] - 1] = log_probs_b[1]
+        log_prob_transition[b, lengths[b] - 1:] = 0
+        log_Ey[b, :lengths[b]] = log_probs_b[2]
+        log_Ey[b, lengths[b]:] = 0
+        if isinstance(log_state, dict) and not log_state:
+            continue
+        log_states[b, :lengths[b]], known_states[b, :lengths[b]] = _log_state_to_dense(
+            log_state, lengths[b], num_states)
+    if not known_states.any():
+        log_states, known_states = None, None
+    return log_prob_initial, log_prob_transition, log_Ey, lengths, log_states, known_states
+
+
 class BaseIOHMM(object):
     """
     Base class for IOHMM models. Should not be directly called.
@@ -71,6 +179,12 @@ class BaseIOHMM(object):
         """
         self.num_states = num_states
         self.trained = False
+        self.engine = 'log'
+        self.dtype = np.dtype(np.float64)
+        self.transition_structure = None
+        self.beam_width = None
+        self.beam_threshold = None
+        self.joint_transition = False
 
     def set_models(self, model_emissions,
                    model_initial=CrossEntropyMNL(),
@@ -112,6 +226,7 @@ class BaseIOHMM(object):
             self.model_initial = model_initial
             self.model_transition = [deepcopy(model_initial) for _ in range(self.num_states)]
             self.model_emissions = [deepcopy(model_emissions) for _ in range(self.num_states)]
+        self._set_models_dtype()
 
     def set_inputs(self, covariates_initial, covariates_transition, covariates_emissions):
         """
@@ -150,6 +265,162 @@ class BaseIOHMM(object):
         self.responses_emissions = responses_emissions
         self.num_emissions = len(responses_emissions)
 
+    def set_engine(self, engine='log'):
+        """
+        Set the engine of the forward backward algorithm used in the E step
+        Parameters
+        ----------
+        engine: one of
+                'log': calculations at the log level (default), the most robust.
+                'scaled': calculations with probabilities normalized at each timestamp,
+                          faster since it uses matrix products instead of logsumexp.
+        """
+        if engine not in FORWARD_BACKWARD_ENGINES:
+            raise ValueError('Unknown forward backward engine: {}.'.format(engine))
+        self.engine = engine
+
+    def set_beam(self, beam_width=None, beam_threshold=None):
+        """
+        Set the pruning of the forward backward algorithm used in the E step,
+        an approximation for models with many states. See forward_backward_beam.
+        Parameters
+        ----------
+        beam_width: None (default) or int, the maximum number of states kept at each timestamp.
+        beam_threshold: None (default) or float, the states whose forward log probability
+                        is more than beam_threshold below the most probable one are dropped.
+        Notes
+        ----------
+        With pruning, the E step runs sequence by sequence at the log level, whatever the engine,
+        on dense transition probabilities even with a transition structure,
+        and pruned_masses is the probability mass dropped in each sequence,
+        0 if the posteriors are exact.
+        With both parameters None, the E step is exact.
+        """
+        if beam_width is not None and beam_width < 1:
+            raise ValueError('beam_width must be a positive integer.')
+        if beam_threshold is not None and not beam_threshold > 0:
+            raise ValueError('beam_threshold must be positive.')
+        self.beam_width = beam_width
+        self.beam_threshold = beam_threshold
+
+    def set_joint_transition(self, joint_transition=True):
+        """
+        Set whether the M step fits the transition models of all the hidden states
+        jointly, as a single optimization (see CrossEntropyMNL.fit_batch),
+        which goes over the transition design matrix once per iteration of the solver
+        instead of once per state.
+        Parameters
+        ----------
+        joint_transition: boolean, False by default.
+        Notes
+        ----------
+        The transition models are fitted jointly only if they can be
+        (see CrossEntropyMNL.can_fit_batch), and with a transition structure,
+        only if all the states have the same number of successors.
+        Otherwise they are fitted one by one.
+        The coefficients are the same up to the tolerance of the solver.
+        """
+        self.joint_transition = joint_transition
+
+    def set_dtype(self, dtype='float64'):
+        """
+        Set the floating point type of the design matrices, the posteriors
+        and the arrays of the forward backward algorithm, as well as of the linear models.
+        Call it before set_data.
+        Parameters
+        ----------
+        dtype: one of
+               'float64': double precision (default).
+               'float32': single precision, halves the memory of the training data
+                          and of the E step. The log likelihoods are still accumulated
+                          in double precision.
+        Notes
+        ----------
+        On the two-state model of examples/data/speed.csv (see the tests),
+        training in single precision gives the log likelihood to within 1e-4,
+        the posteriors to within 5e-4 and the emission coefficients to within 1e-4
+        of double precision, with either engine.
+        The errors of the 'log' engine grow with the length of the sequences,
+        since its forward and backward variables are not normalized;
+        the 'scaled' engine normalizes them at each timestamp and is recommended
+        with single precision for long sequences.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError('Unsupported dtype: {}.'.format(dtype))
+        self.dtype = dtype
+        if hasattr(self, 'model_initial'):
+            self._set_models_dtype()
+
+    def set_transition_structure(self, structure=None):
+        """
+        Set the allowed transitions between the hidden states.
+        Call it before set_data.
+        Parameters
+        ----------
+        structure: one of
+                   None: all transitions are allowed (default).
+                   a TransitionStructure, e.g. TransitionStructure.left_right(num_states)
+                   or TransitionStructure.banded(num_states, lower, upper).
+                   array-like of shape (num_states, num_states) of booleans
+                   or a scipy.sparse matrix, the mask of the allowed transitions.
+                   list of list of ints, the allowed successors of each state.
+        Notes
+        ----------
+        With a structure, the transition model of each state only fits (and predicts)
+        the probabilities of its allowed successors,
+        the posterior "transition" probabilities (log_epsilons) are of shape
+        (df.shape[0] - 1, nnz) in the order of the allowed transitions of the structure,
+        and the exact E step does O(nnz) work per timestamp at the log level, whatever the engine.
+        The pruned E step (see set_beam) does not use the structure: it expands the transition
+        probabilities to dense arrays of shape (df.shape[0] - 1, num_states, num_states),
+        with -np.Infinity for the transitions not allowed, and does O(num_states ** 2) work
+        per timestamp.
+        The ground truth hidden states must be consistent with the structure.
+        """
+        if structure is not None and not isinstance(structure, TransitionStructure):
+            if isinstance(structure, list):
+                structure = TransitionStructure.from_list(structure)
+            else:
+                structure = TransitionStructure.from_mask(structure)
+        if structure is not None and structure.num_states != self.num_states:
+            raise ValueError('The transition structure has {} states instead of {}.'.format(
+                structure.num_states, self.num_states))
+        self.transition_structure = structure
+
+    def _transition_edges(self, st):
+        """
+        The index of the posterior "transition" probabilities from a state
+        in the arrays of log_epsilons.
+        Parameters
+        ----------
+        st: the previous state
+        Returns
+        -------
+        index: log_epsilon[index] is of shape (df.shape[0] - 1, num_states),
+               or (df.shape[0] - 1, number of successors of st) with a transition structure.
+        """
+        if self.transition_structure is None:
+            return (slice(None), st)
+        return (slice(None), self.transition_structure.edges(st))
+
+    def _linear_models(self):
+        """
+        All the linear models.
+        Returns
+        -------
+        models: list of the initial, transition and emission models
+        """
+        return [self.model_initial] + list(self.model_transition) + [
+            model for models in self.model_emissions for model in models]
+
+    def _set_models_dtype(self):
+        """
+        Set the floating point type of all the linear models to the one of the IOHMM.
+        """
+        for model in self._linear_models():
+            model.dtype = self.dtype
+
     def set_data(self, dfs):
         """
         Set data for the model
@@ -166,9 +437,14 @@ class BaseIOHMM(object):
     def _initialize(self, with_randomness=True):
         """
         Initialize
-        (1) log_gammas: list of arrays, the state posterior probability for each sequence
+        (1) log_gammas: list of arrays, the state posterior probability for each sequence,
+            views of log_gammas_all_sequences, array of shape
+            (sum(df.shape[0] for df in dfs), num_states).
         (2) log_epsilons: list of arrays, the state posterior 'transition' probability
-            (joint probability of two consecutive points) for each sequence
+            (joint probability of two consecutive points) for each sequence,
+            views of log_epsilons_all_sequences, array of shape
+            (sum(df.shape[0]-1 for df in dfs), num_states, num_states),
+            or (sum(df.shape[0]-1 for df in dfs), nnz) with a transition structure.
         based on the ground truth labels supplied.
         (3) log likelihood as negative inifinity
         (4) inp_initials: list of arrays of shape (1, len(covariates_initial)),
@@ -203,6 +479,16 @@ class BaseIOHMM(object):
                                           The list is for each emission model.
                                           This is the concatenation of all sequences
                                           for each emission model.
+        (12) offsets: array of shape (len(sequences) + 1, ),
+                      sequence i is the rows offsets[i]:offsets[i + 1]
+                      of inp_emissions_all_sequences, out_emissions_all_sequences
+                      and log_gammas_all_sequences.
+        (13) offsets_transition: array of shape (len(sequences) + 1, ),
+                                 sequence i is the rows
+                                 offsets_transition[i]:offsets_transition[i + 1]
+                                 of inp_transitions_all_sequences and log_epsilons_all_sequences.
+        The lists of arrays of each sequence are views of the arrays of all sequences,
+        so that they share the same memory.
 
 
         Parameters
@@ -228,6 +514,7 @@ class BaseIOHMM(object):
                        The log_state[t] is the ground truth hidden state array of time stamp t.
                        log_state[t][k] is 0 and log_state[t][~k] is -np.Infinity
                        if the hidden state of timestamp t is k.
+                       Or an array of the known states, see forward_backward.
             Returns:
             ----------
             log_gamma: array of shape (df.shape[0], num_states).
@@ -237,10 +524,10 @@ class BaseIOHMM(object):
                        If at time stamp t there is no ground truth,
                        log_gamma[t] will be all -np.Infinity.
             """
-            log_gamma = np.log(np.zeros((df.shape[0], self.num_states)))
-            for time_stamp in log_state:
-                log_gamma[time_stamp, :] = log_state[time_stamp]
-            return log_gamma
+            log_states, known_states = _log_state_to_dense(
+                log_state, df.shape[0], self.num_states)
+            return np.where(known_states[:, np.newaxis], log_states,
+                            -np.Infinity).astype(self.dtype)
 
         def _initialize_log_epsilon(df, log_state):
             """
@@ -253,9 +540,11 @@ class BaseIOHMM(object):
                        The log_state[i] is the ground truth hidden state array of time stamp i.
                        log_state[i][k] is 0 and log_state[i][~k] is -np.Infinity
                        if the hidden state of timestamp i is k.
+                       Or an array of the known states, see forward_backward.
             Returns:
             ----------
-            log_epsilon: array of shape (df.shape[0] - 1, num_states, num_states).
+            log_epsilon: array of shape (df.shape[0] - 1, num_states, num_states),
+                         or (df.shape[0] - 1, nnz) with a transition structure.
                          The posterior joint probability of two consecutive points.
                          log_epsilon[t][k][j] is 0 and log_epsilon[t][~k][~j] is -np.Infinity
                          if the hidden state of timestamp t is k and
@@ -264,60 +553,171 @@ class BaseIOHMM(object):
                          log_epsilon[t] will be all -np.Infinity.
 
             """
-            log_epsilon = np.log(np.zeros((df.shape[0] - 1, self.num_states, self.num_states)))
-            for time_stamp in log_state:
-                if time_stamp + 1 in log_state:
-                    # actually should find the index of 1
-                    st = int(np.argmax(log_state[time_stamp]))
-                    log_epsilon[time_stamp, st, :] = log_state[time_stamp + 1]
+            if self.transition_structure is not None:
+                structure = self.transition_structure
+                log_epsilon = np.full((df.shape[0] - 1, structure.nnz), -np.Infinity,
+                                      dtype=self.dtype)
+                log_states, known_states = _log_state_to_dense(
+                    log_state, df.shape[0], self.num_states)
+                known_pairs = known_states[:-1] & known_states[1:]
+                log_epsilon[known_pairs] = (log_states[:-1][known_pairs][:, structure.rows] +
+                                            log_states[1:][known_pairs][:, structure.indices])
+                return log_epsilon
+            log_epsilon = np.full((df.shape[0] - 1, self.num_states, self.num_states),
+                                  -np.Infinity, dtype=self.dtype)
+            _mask_known_pairs(log_epsilon, *_log_state_to_dense(
+                log_state, df.shape[0], self.num_states))
             return log_epsilon
 
+        # initialize the offsets of the sequences in the arrays of all sequences
+        self.offsets = np.concatenate([[0], np.cumsum(
+            [df.shape[0] for df, log_state in self.dfs_logStates])]).astype(int)
+        # a sequence of length t has t - 1 transitions
+        self.offsets_transition = self.offsets - np.arange(self.num_seqs + 1)
+
         # initialize log_gammas
-        self.log_gammas = [_initialize_log_gamma(df, log_state)
-                           for df, log_state in self.dfs_logStates]
+        self.log_gammas_all_sequences = np.concatenate(
+            [_initialize_log_gamma(df, log_state) for df, log_state in self.dfs_logStates])
         # initialize log_epsilons
-        self.log_epsilons = [_initialize_log_epsilon(df, log_state)
-                             for df, log_state in self.dfs_logStates]
+        self.log_epsilons_all_sequences = np.concatenate(
+            [_initialize_log_epsilon(df, log_state) for df, log_state in self.dfs_logStates])
+        self._split_posteriors()
         if with_randomness:
+            lg = self.log_gammas_all_sequences
             for st in range(self.num_states):
-                if np.exp(np.hstack([lg[:, st] for lg in self.log_gammas])).sum() < EPS:
+                if np.exp(lg[:, st]).sum() < EPS:
                     # there is no any sample associated with this state
-                    for lg in self.log_gammas:
-                        lg[:, st] = np.random.rand(lg.shape[0])
+                    lg[:, st] = np.random.rand(lg.shape[0])
+            le = self.log_epsilons_all_sequences
             for st in range(self.num_states):
-                if np.exp(np.vstack([le[:, st, :] for le in self.log_epsilons])).sum() < EPS:
+                edges = self._transition_edges(st)
+                if np.exp(le[edges]).sum() < EPS:
                     # there is no any sample associated with this state
-                    for le in self.log_epsilons:
-                        le[:, st, :] = np.random.rand(le.shape[0], self.num_states)
+                    le[edges] = np.random.rand(*le[edges].shape)
 
         # initialize log_likelihood
         self.log_likelihoods = [-np.Infinity for _ in range(self.num_seqs)]
         self.log_likelihood = -np.Infinity
+        self.pruned_masses = [0. for _ in range(self.num_seqs)]
 
-        # initialize input/output covariates
-        self.inp_initials = [np.array(df[self.covariates_initial].iloc[0]).reshape(
-            1, -1).astype('float64') for df, log_state in self.dfs_logStates]
-        self.inp_initials_all_sequences = np.vstack(self.inp_initials)
-
-        self.inp_transitions = [np.array(df[self.covariates_transition].iloc[1:]).astype(
-            'float64') for df, log_state in self.dfs_logStates]
-        self.inp_transitions_all_sequences = np.vstack(self.inp_transitions)
+        # initialize the workspace of E_step
+        self.workspace = self._initialize_workspace()
 
-        self.inp_emissions = [[np.array(df[cov]).astype('float64') for
-                               cov in self.covariates_emissions]
-                              for df, log_state in self.dfs_logStates]
+        # initialize input/output covariates
+        inp_initials, inp_transitions, inp_emissions, out_emissions = zip(
+            *[self._get_inputs_outputs(df) for df, log_state in self.dfs_logStates])
+        self.inp_initials_all_sequences = np.vstack(inp_initials)
+        self.inp_transitions_all_sequences = np.vstack(inp_transitions)
         self.inp_emissions_all_sequences = [np.vstack([seq[emis] for
-                                                       seq in self.inp_emissions]) for
+                                                       seq in inp_emissions]) for
                                             emis in range(self.num_emissions)]
-        self.out_emissions = [[np.array(df[res]) for
-                               res in self.responses_emissions]
-                              for df, log_state in self.dfs_logStates]
-
         self.out_emissions_all_sequences = [np.vstack([seq[emis] for
-                                                       seq in self.out_emissions]) for
+                                                       seq in out_emissions]) for
                                             emis in range(self.num_emissions)]
+        self.inp_initials = _split_rows(self.inp_initials_all_sequences,
+                                        np.arange(self.num_seqs + 1))
+        self.inp_transitions = _split_rows(self.inp_transitions_all_sequences,
+                                           self.offsets_transition)
+        self.inp_emissions = [list(x) for x in zip(*[
+            _split_rows(inp, self.offsets) for inp in self.inp_emissions_all_sequences])]
+        self.out_emissions = [list(x) for x in zip(*[
+            _split_rows(out, self.offsets) for out in self.out_emissions_all_sequences])]
 
-    def E_step(self):
+    def _split_posteriors(self):
+        """
+        Set log_gammas and log_epsilons, the posteriors of each sequence,
+        as views of log_gammas_all_sequences and log_epsilons_all_sequences.
+        """
+        self.log_gammas = _split_rows(self.log_gammas_all_sequences, self.offsets)
+        self.log_epsilons = _split_rows(self.log_epsilons_all_sequences, self.offsets_transition)
+
+    def _make_shard(self, start, stop):
+        """
+        A copy of the model holding only a contiguous range of the sequences,
+        to run the E step on them in a worker process, see EStepPool.
+        The arrays of all sequences of the shard are views of the ones of the model,
+        so that its E step writes the posteriors into the arrays of the model.
+        Parameters
+        ----------
+        start, stop: the sequences start, ..., stop - 1 are in the shard
+        Returns
+        -------
+        shard: a shallow copy of the model with the data of the sequences.
+        """
+        shard = copy(self)
+        shard.dfs_logStates = self.dfs_logStates[start:stop]
+        shard.num_seqs = stop - start
+        rows = slice(self.offsets[start], self.offsets[stop])
+        rows_transition = slice(self.offsets_transition[start], self.offsets_transition[stop])
+        shard.offsets = self.offsets[start:stop + 1] - self.offsets[start]
+        shard.offsets_transition = (self.offsets_transition[start:stop + 1] -
+                                    self.offsets_transition[start])
+        shard.inp_initials_all_sequences = self.inp_initials_all_sequences[start:stop]
+        shard.inp_transitions_all_sequences = self.inp_transitions_all_sequences[rows_transition]
+        shard.inp_emissions_all_sequences = [inp[rows] for inp in self.inp_emissions_all_sequences]
+        shard.out_emissions_all_sequences = [out[rows] for out in self.out_emissions_all_sequences]
+        shard.log_gammas_all_sequences = self.log_gammas_all_sequences[rows]
+        shard.log_epsilons_all_sequences = self.log_epsilons_all_sequences[rows_transition]
+        shard._split_posteriors()
+        shard.log_likelihoods = self.log_likelihoods[start:stop]
+        shard.pruned_masses = self.pruned_masses[start:stop]
+        for name in ['inp_initials', 'inp_transitions', 'inp_emissions', 'out_emissions']:
+            setattr(shard, name, None)
+        shard.workspace = shard._initialize_workspace()
+        return shard
+
+    def _initialize_workspace(self):
+        """
+        Allocate the buffers of the largest batch of E_step once,
+        so that the batches of every iteration reuse them.
+        Returns
+        -------
+        workspace: Workspace
+        """
+        workspace = Workspace()
+        lengths = np.diff(self.offsets)
+        batches = _split_batches(lengths)
+        n_batch = max(batch.shape[0] for batch in batches)
+        size = max(batch.shape[0] * lengths[batch].max() for batch in batches)
+        k = self.num_states
+        workspace.reserve('log_prob_initial', n_batch * k, self.dtype)
+        workspace.reserve('known_states', size, dtype=bool)
+        for name in ['log_Ey', 'log_states', 'log_alpha', 'log_beta', 'log_gamma']:
+            workspace.reserve(name, size * k, self.dtype)
+        n_transitions = int(np.prod(self._transition_shape()))
+        for name in ['log_prob_transition', 'log_epsilon']:
+            workspace.reserve(name, size * n_transitions, self.dtype)
+        # the log probabilities of all sequences, see _cal_log_probs_all_sequences
+        workspace.reserve('log_prob_transition_all_sequences',
+                          self.offsets_transition[-1] * n_transitions, self.dtype)
+        workspace.reserve('log_Ey_all_sequences', self.offsets[-1] * k, self.dtype)
+        if self.engine == 'scaled':
+            for name in ['Ey', 'alpha', 'beta']:
+                workspace.reserve(name, size * k, self.dtype)
+            workspace.reserve('prob_transition', size * k * k, self.dtype)
+        return workspace
+
+    def _get_inputs_outputs(self, df):
+        """
+        Get the input/output covariates of a sequence
+        Parameters
+        ----------
+        df: The dataframe for a sequence.
+        Returns
+        -------
+        inp_initial: array of shape (1, len(covariates_initial))
+        inp_transition: array of shape (df.shape[0]-1, len(covariates_transition))
+        inp_emissions: list of arrays of shape (df.shape[0], len(covariates_emission[i]))
+        out_emissions: list of arrays of shape (df.shape[0], len(response_emission[i]))
+        """
+        inp_initial = np.array(df[self.covariates_initial].iloc[0]).reshape(
+            1, -1).astype(self.dtype)
+        inp_transition = np.array(df[self.covariates_transition].iloc[1:]).astype(self.dtype)
+        inp_emissions = [np.array(df[cov]).astype(self.dtype) for cov in self.covariates_emissions]
+        out_emissions = [np.array(df[res]) for res in self.responses_emissions]
+        return inp_initial, inp_transition, inp_emissions, out_emissions
+
+    def E_step(self, n_jobs=1):
         """
         The Expectation step, Update
         (1) log_gammas: list of arrays, state posterior probability for each sequence
@@ -326,37 +726,261 @@ class BaseIOHMM(object):
         (3) log likelihood
         based on the model coefficients from last iteration,
         with respect to the ground truth hidden states if any.
+        Notes:
+        ----------
+        Sequences are sorted by length and the forward backward algorithm runs
+        on batches of E_STEP_BATCH_SIZE padded sequences at once.
+        The log probabilities of all sequences, the padded arrays with the known states
+        folded in and the intermediate results live in the workspace,
+        and the posteriors are copied into the arrays allocated by _initialize,
+        so that the iterations of EM do not allocate them again.
+        With a beam (see set_beam), the pruned forward backward algorithm runs
+        on each sequence instead, and pruned_masses is updated.
+        Parameters
+        ----------
+        n_jobs: the number of worker processes, 1 (default) to run in this process,
+                -1 for the number of CPUs. See EStepPool.
+                To run many E steps in parallel, use an EStepPool directly
+                so that the worker processes are started only once, as train does.
         """
-        self.log_gammas = []
-        self.log_epsilons = []
-        self.log_likelihoods = []
-        for seq in range(self.num_seqs):
-            n_records = self.dfs_logStates[seq][0].shape[0]
-            # initial probability
-            log_prob_initial = self.model_initial.predict_log_proba(
-                self.inp_initials[seq]).reshape(self.num_states,)
-            # transition probability
-            log_prob_transition = np.zeros((n_records - 1, self.num_states, self.num_states))
-            for st in range(self.num_states):
-                log_prob_transition[:, st, :] = self.model_transition[st].predict_log_proba(
-                    self.inp_transitions[seq])
-            assert log_prob_transition.shape == (n_records - 1, self.num_states, self.num_states)
-            # emission probability
-            log_Ey = np.zeros((n_records, self.num_states))
-            for emis in range(self.num_emissions):
-                model_collection = [models[emis] for models in self.model_emissions]
-                log_Ey += np.vstack([model.loglike_per_sample(
-                    np.array(self.inp_emissions[seq][emis]).astype('float64'),
-                    np.array(self.out_emissions[seq][emis])) for model in model_collection]).T
+        if n_jobs != 1:
+            with EStepPool(self, n_jobs) as pool:
+                pool.E_step()
+            return
+        if self.beam_width is not None or self.beam_threshold is not None:
+            self._E_step_beam()
+            return
+        lengths = np.diff(self.offsets)
+        log_probs = self._cal_log_probs_all_sequences(sparse=True)
+        for batch in _split_batches(lengths):
+            padded = _pad_sequences(
+                [log_probs[seq] for seq in batch],
+                [self.dfs_logStates[seq][1] for seq in batch], self.num_states,
+                self.workspace, self.dtype)
             # forward backward to calculate posterior
-            log_gamma, log_epsilon, log_likelihood = forward_backward(
-                log_prob_initial, log_prob_transition, log_Ey, self.dfs_logStates[seq][1])
-            self.log_gammas.append(log_gamma)
-            self.log_epsilons.append(log_epsilon)
-            self.log_likelihoods.append(log_likelihood)
+            if self.transition_structure is None:
+                log_gamma, log_epsilon, log_likelihood = FORWARD_BACKWARD_ENGINES[self.engine](
+                    *padded, workspace=self.workspace)
+            else:
+                log_gamma, log_epsilon, log_likelihood = forward_backward_sparse_batch(
+                    *padded[:4], structure=self.transition_structure,
+                    log_states=padded[4], known_states=padded[5], workspace=self.workspace)
+            for b, seq in enumerate(batch):
+                self.log_gammas[seq][...] = log_gamma[b, :lengths[seq]]
+                self.log_epsilons[seq][...] = log_epsilon[b, :lengths[seq] - 1]
+                self.log_likelihoods[seq] = log_likelihood[b]
+        self.log_likelihood = sum(self.log_likelihoods)
+
+    def _E_step_beam(self):
+        """
+        The Expectation step with the beam-pruned forward backward algorithm,
+        Update log_gammas, log_epsilons, log likelihood and pruned_masses.
+        """
+        structure = self.transition_structure
+        log_probs = self._cal_log_probs_all_sequences()
+        for seq in range(self.num_seqs):
+            log_prob_initial, log_prob_transition, log_Ey = log_probs[seq]
+            log_gamma, log_epsilon, log_likelihood, pruned_mass = forward_backward_beam(
+                log_prob_initial, log_prob_transition, log_Ey, self.dfs_logStates[seq][1],
+                self.beam_width, self.beam_threshold,
+                log_epsilon_out=self.log_epsilons[seq] if structure is None else None)
+            self.log_gammas[seq][...] = log_gamma
+            if structure is not None:
+                self.log_epsilons[seq][...] = log_epsilon[:, structure.rows, structure.indices]
+            self.log_likelihoods[seq] = log_likelihood
+            self.pruned_masses[seq] = pruned_mass
         self.log_likelihood = sum(self.log_likelihoods)
 
-    def M_step(self):
+    def _cal_log_probs_all_sequences(self, sparse=False):
+        """
+        Calculate the initial, transition and emission log probabilities of all the sequences
+        based on the model coefficients from last iteration.
+        The initial model is evaluated once on inp_initials_all_sequences,
+        the transition model of each state once on inp_transitions_all_sequences,
+        and the emission models of each state once on
+        inp_emissions_all_sequences and out_emissions_all_sequences.
+        The log probabilities of each sequence are views of the rows between its offsets,
+        so that they are only copied once, when they are padded into a batch.
+        Parameters
+        ----------
+        sparse: see _cal_log_prob_transition.
+        Returns
+        -------
+        log_probs: list of (log_prob_initial, log_prob_transition, log_Ey) for each sequence,
+                   see _cal_log_probs.
+        """
+        log_prob_initial = self.model_initial.predict_log_proba(
+            self.inp_initials_all_sequences).reshape(self.num_seqs, self.num_states)
+        log_prob_transition = self._cal_log_prob_transition(
+            self.inp_transitions_all_sequences, sparse=sparse,
+            out=self.workspace.get('log_prob_transition_all_sequences',
+                                   (self.offsets_transition[-1], ) + self._transition_shape(),
+                                   self.dtype))
+        log_Ey = self._cal_log_Ey(
+            self.inp_emissions_all_sequences, self.out_emissions_all_sequences,
+            out=self.workspace.get('log_Ey_all_sequences',
+                                   (self.offsets[-1], self.num_states), self.dtype))
+        return list(zip(log_prob_initial, _split_rows(log_prob_transition, self.offsets_transition),
+                        _split_rows(log_Ey, self.offsets)))
+
+    def _cal_log_probs(self, inp_initial, inp_transition, inp_emissions, out_emissions,
+                       sparse=False):
+        """
+        Calculate the initial, transition and emission log probabilities of a sequence
+        based on the model coefficients from last iteration.
+        Parameters
+        ----------
+        inp_initial, inp_transition, inp_emissions, out_emissions:
+            the input/output covariates of the sequence, see _get_inputs_outputs.
+        sparse: see _cal_log_prob_transition.
+        Returns
+        -------
+        log_prob_initial: array of shape (num_states, )
+        log_prob_transition: array of shape (df.shape[0] - 1, num_states, num_states)
+                             or (df.shape[0] - 1, nnz), see _cal_log_prob_transition.
+        log_Ey: array of shape (df.shape[0], num_states)
+        """
+        log_prob_initial = self._cal_log_prob_initial(inp_initial)
+        log_prob_transition = self._cal_log_prob_transition(inp_transition, sparse=sparse)
+        log_Ey = self._cal_log_Ey(inp_emissions, out_emissions)
+        return log_prob_initial, log_prob_transition, log_Ey
+
+    def _cal_log_prob_initial(self, inp_initial):
+        """
+        Calculate the initial log probability of a sequence
+        Parameters
+        ----------
+        inp_initial: array of shape (1, len(covariates_initial))
+        Returns
+        -------
+        log_prob_initial: array of shape (num_states, )
+        """
+        return self.model_initial.predict_log_proba(inp_initial).reshape(self.num_states,)
+
+    def _cal_log_prob_transition(self, inp_transition, sparse=False, out=None):
+        """
+        Calculate the transition log probabilities of a sequence
+        Parameters
+        ----------
+        inp_transition: array of shape (n_records - 1, len(covariates_transition))
+        sparse: with a transition structure, whether to return the log probabilities
+                of the allowed transitions only.
+        out: array of shape (n_records - 1, num_states, num_states),
+             or (n_records - 1, nnz) with a transition structure, or None.
+             If given, the log probabilities are written into it instead of a new array.
+        Returns
+        -------
+        log_prob_transition: array of shape (n_records - 1, num_states, num_states),
+                             -np.Infinity for the transitions not allowed by the structure.
+                             With a transition structure and sparse,
+                             array of shape (n_records - 1, nnz).
+        """
+        structure = self.transition_structure
+        if out is None:
+            out = np.zeros((inp_transition.shape[0], ) + self._transition_shape(),
+                           dtype=self.dtype)
+        # sequences of a single record have no transition, the models reject empty inputs
+        if inp_transition.shape[0] > 0:
+            for st in range(self.num_states):
+                if structure is None:
+                    out[:, st, :] = self.model_transition[st].predict_log_proba(inp_transition)
+                else:
+                    out[:, structure.edges(st)] = \
+                        self.model_transition[st].predict_log_proba(inp_transition)
+        return out if structure is None or sparse else structure.to_dense(out)
+
+    def _transition_shape(self):
+        """
+        The shape of the transition log probabilities of a timestamp,
+        (num_states, num_states), or (nnz, ) with a transition structure.
+        """
+        if self.transition_structure is None:
+            return (self.num_states, self.num_states)
+        return (self.transition_structure.nnz, )
+
+    def _cal_log_Ey(self, inp_emissions, out_emissions, out=None):
+        """
+        Calculate the emission log probabilities of a sequence
+        Parameters
+        ----------
+        inp_emissions: list of arrays of shape (n_records, len(covariates_emission[i]))
+        out_emissions: list of arrays of shape (n_records, len(response_emission[i]))
+        out: array of shape (n_records, num_states) or None.
+             If given, the log probabilities are written into it instead of a new array.
+        Returns
+        -------
+        log_Ey: array of shape (n_records, num_states)
+        """
+        if out is None:
+            out = np.empty((inp_emissions[0].shape[0], self.num_states), dtype=self.dtype)
+        out[...] = 0
+        for emis in range(self.num_emissions):
+            inp = np.asarray(inp_emissions[emis], dtype=self.dtype)
+            out_emis = np.asarray(out_emissions[emis])
+            for st in range(self.num_states):
+                out[:, st] += self.model_emissions[st][emis].loglike_per_sample(inp, out_emis)
+        return out
+
+    def decode(self, dfs):
+        """
+        Decode the most likely hidden states of each sequence by the Viterbi algorithm,
+        based on the model coefficients.
+        Parameters
+        ----------
+        dfs: a list of dataframes, each df represents a sequence.
+        Returns
+        -------
+        states: list of arrays of shape (df.shape[0], ),
+                the most likely hidden state of each timestamp of each sequence.
+        Notes
+        ----------
+        Sequences are sorted by length and decoded in batches of
+        E_STEP_BATCH_SIZE padded sequences at once.
+        """
+        lengths = np.array([df.shape[0] for df in dfs])
+        states = [None] * len(dfs)
+        for batch in _split_batches(lengths):
+            padded = _pad_sequences(
+                [self._cal_log_probs(*self._get_inputs_outputs(dfs[seq])) for seq in batch],
+                [{} for _ in batch], self.num_states)
+            states_batch, _ = viterbi_batch(*padded)
+            for b, seq in enumerate(batch):
+                states[seq] = states_batch[b, :lengths[seq]]
+        return states
+
+    def sample_states(self, dfs, n_samples=1, random_state=None):
+        """
+        Draw hidden state paths of each sequence from their posterior
+        by forward filtering backward sampling, based on the model coefficients.
+        Parameters
+        ----------
+        dfs: a list of dataframes, each df represents a sequence.
+        n_samples: the number of paths to draw for each sequence.
+        random_state: None, int or numpy.random.Generator,
+                      the seed of numpy.random.default_rng.
+        Returns
+        -------
+        states: list of arrays of shape (n_samples, df.shape[0]),
+                the sampled hidden state of each timestamp of each path of each sequence.
+        Notes
+        ----------
+        Sequences are sorted by length and sampled in batches of
+        E_STEP_BATCH_SIZE padded sequences at once.
+        """
+        rng = np.random.default_rng(random_state)
+        lengths = np.array([df.shape[0] for df in dfs])
+        states = [None] * len(dfs)
+        for batch in _split_batches(lengths):
+            padded = _pad_sequences(
+                [self._cal_log_probs(*self._get_inputs_outputs(dfs[seq])) for seq in batch],
+                [{} for _ in batch], self.num_states)
+            states_batch = sample_states_batch(*padded[:4], n_samples=n_samples,
+                                               random_state=rng)
+            for b, seq in enumerate(batch):
+                states[seq] = states_batch[b, :, :lengths[seq]]
+        return states
+
+    def M_step(self, n_jobs=1):
         """
         The Maximization step, Update
         (1) model_initial: a linear model
@@ -365,48 +989,203 @@ class BaseIOHMM(object):
                              the outer list is for each hidden state,
                              the inner list is for each emission model.
         based on the posteriors, and dependent/independent covariates.
+        (4) fit_times: dictionary of the seconds each fit took, the keys are
+                       ('initial', ), ('transition', st) and ('emission', st, emis),
+                       or ('transitions', ) and ('emissions', emis) for the transition models
+                       and the emission models of all the states fitted at once, see Notes.
+        (5) n_iters: dictionary of the number of iterations of the solver of each fit,
+                     None for direct solvers, with the keys of fit_times.
+                     For the emission models fitted at once, the most iterations of a state.
+        Parameters
+        ----------
+        n_jobs: the number of threads fitting the linear models,
+                1 (default) to fit them one after another, -1 for the number of CPUs.
+                The fits are independent, so the linear models are the same either way.
+                With more than one thread, each fit uses a single BLAS thread
+                so that the threads do not oversubscribe the CPUs.
         Notes:
         ----------
         In the emission models, if the sum of sample weight is zero,
         the linear model will raise ValueError.
+        The state posterior probabilities are exponentiated once for all the models,
+        from log_gammas_all_sequences.
+        The transition models are fitted at once if set_joint_transition is set.
+        If the emission models of all the states for an emission are plain OLS
+        (see OLS.can_fit_batch), or GLM fitted by IRLS (see GLM.can_fit_batch),
+        they are fitted at once by OLS.fit_batch or GLM.fit_batch,
+        which go over the data a single time for all the states (in each iteration of IRLS).
         """
+        # gammas[st] is the sample weight of state st, contiguous in memory:
+        # the transpose is written in C order by the exponentiation itself
+        gammas = np.exp(self.log_gammas_all_sequences.T, order='C')
 
-        # optimize initial model
-        X = self.inp_initials_all_sequences
-        Y = np.exp(np.vstack([lg[0, :].reshape(1, -1) for lg in self.log_gammas]))
-        self.model_initial.fit(X, Y)
-
-        # optimize transition models
-        X = self.inp_transitions_all_sequences
-        for st in range(self.num_states):
-            Y = np.exp(np.vstack([eps[:, st, :] for eps in self.log_epsilons]))
-            self.model_transition[st].fit(X, Y)
+        def _fit(key):
+            """
+            Fit a linear model.
+            Parameters
+            ----------
+            key: ('initial', ), ('transition', st), ('emission', st, emis),
+                 ('transitions', ) or ('emissions', emis)
+            Returns
+            -------
+            seconds: the time the fit took
+            """
+            start = time.time()
+            if key[0] == 'initial':
+                # optimize initial model
+                self.model_initial.fit(self.inp_initials_all_sequences,
+                                       gammas[:, self.offsets[:-1]].T)
+            elif key[0] == 'transition':
+                # optimize transition models
+                st = key[1]
+                self.model_transition[st].fit(
+                    self.inp_transitions_all_sequences,
+                    np.exp(self.log_epsilons_all_sequences[self._transition_edges(st)]))
+            elif key[0] == 'transitions':
+                # optimize the transition models of all the states at once
+                CrossEntropyMNL.fit_batch(
+                    self.model_transition, self.inp_transitions_all_sequences,
+                    np.stack([np.exp(self.log_epsilons_all_sequences[self._transition_edges(st)])
+                              for st in range(self.num_states)]))
+            elif key[0] == 'emissions':
+                # optimize the emission models of all the states at once
+                emis = key[1]
+                models = [self.model_emissions[st][emis] for st in range(self.num_states)]
+                type(models[0]).fit_batch(models, self.inp_emissions_all_sequences[emis],
+                                          self.out_emissions_all_sequences[emis], gammas)
+            else:
+                # optimize emission models
+                st, emis = key[1:]
+                self.model_emissions[st][emis].fit(
+                    self.inp_emissions_all_sequences[emis], self.out_emissions_all_sequences[emis],
+                    sample_weight=gammas[st])
+            return time.time() - start
 
-        # optimize emission models
+        keys = [('initial', )]
+        if self._can_fit_joint_transition():
+            keys.append(('transitions', ))
+        else:
+            keys.extend(('transition', st) for st in range(self.num_states))
         for emis in range(self.num_emissions):
-            X = self.inp_emissions_all_sequences[emis]
-            Y = self.out_emissions_all_sequences[emis]
-            for st in range(self.num_states):
-                sample_weight = np.exp(np.hstack([lg[:, st] for lg in self.log_gammas]))
-                self.model_emissions[st][emis].fit(X, Y, sample_weight=sample_weight)
+            models = [self.model_emissions[st][emis] for st in range(self.num_states)]
+            if OLS.can_fit_batch(models) or GLM.can_fit_batch(models):
+                keys.append(('emissions', emis))
+            else:
+                keys.extend(('emission', st, emis) for st in range(self.num_states))
+        if n_jobs == -1:
+            n_jobs = multiprocessing.cpu_count()
+        if n_jobs == 1:
+            seconds = [_fit(key) for key in keys]
+        else:
+            with threadpool_limits(limits=1), ThreadPoolExecutor(n_jobs) as executor:
+                seconds = list(executor.map(_fit, keys))
+        self.fit_times = dict(zip(keys, seconds))
+        # the models fitted at once share the iterations of their fit
+        fitted = {'initial': lambda: self.model_initial,
+                  'transition': lambda st: self.model_transition[st],
+                  'transitions': lambda: self.model_transition[0],
+                  'emission': lambda st, emis: self.model_emissions[st][emis],
+                  'emissions': lambda emis: max(
+                      (self.model_emissions[st][emis] for st in range(self.num_states)),
+                      key=lambda model: model.n_iter or 0)}
+        self.n_iters = {key: fitted[key[0]](*key[1:]).n_iter for key in keys}
 
-    def train(self):
+    def _can_fit_joint_transition(self):
+        """
+        Whether the M step fits the transition models jointly, see set_joint_transition.
+        Returns
+        -------
+        boolean
+        """
+        if not self.joint_transition or not CrossEntropyMNL.can_fit_batch(self.model_transition):
+            return False
+        structure = self.transition_structure
+        return structure is None or np.all(np.diff(structure.indptr) == structure.indptr[1])
+
+    def train(self, n_jobs=1, warm_start=True, measure_warm_start=False):
         """
         The ieratioin of EM step,
+        Parameters
+        ----------
+        n_jobs: the number of worker processes of the E step and of threads of the M step,
+                1 (default) to run in this process, -1 for the number of CPUs.
+                The sequences are split into shards balanced by their number of timestamps,
+                and the worker processes hold their shard for all the iterations,
+                so that each iteration only sends them the linear models. See EStepPool.
+                The linear models are fitted in parallel, see M_step.
+        warm_start: boolean, True by default, whether the iterative solvers of the linear models
+                    start from the coefficients of the previous iteration of EM.
+                    Sets warm_start of all the linear models, see BaseModel.
+        measure_warm_start: boolean, False by default, whether each M step also refits
+                            copies of the linear models from scratch, only to count
+                            the solver iterations saved by warm start (solver_iterations_saved).
+                            The refits are discarded, but they double the cost of the M steps.
         Notes:
         ----------
         For SupervisedIOHMM, max_EM_iter is 1, thus will only go through one iteration of EM step,
         which means that it will only use the ground truth hidden states to train.
+        solver_iterations is the total number of iterations of the solvers
+        of the linear models in each M step.
+        With warm_start and measure_warm_start, solver_iterations_saved is the total number
+        of iterations of the refits from scratch minus the ones of the warm started fits,
+        None otherwise.
         """
-        for it in range(self.max_EM_iter):
-            log_likelihood_prev = self.log_likelihood
-            self.M_step()
-            self.E_step()
-            logging.info('log likelihood of iteration {0}: {1:.4f}'.format(it, self.log_likelihood))
-            if abs(self.log_likelihood - log_likelihood_prev) < self.EM_tol:
-                break
+        for model in self._linear_models():
+            model.warm_start = warm_start
+        measure_warm_start = measure_warm_start and warm_start
+        self.solver_iterations = []
+        self.solver_iterations_saved = 0 if measure_warm_start else None
+        pool = EStepPool(self, n_jobs) if n_jobs != 1 else None
+        try:
+            for it in range(self.max_EM_iter):
+                log_likelihood_prev = self.log_likelihood
+                if measure_warm_start:
+                    n_iters_cold = self._M_step_cold(n_jobs)
+                self.M_step(n_jobs)
+                n_iters = {key: n_iter for key, n_iter in self.n_iters.items()
+                           if n_iter is not None}
+                self.solver_iterations.append(sum(n_iters.values()))
+                if measure_warm_start:
+                    self.solver_iterations_saved += sum(
+                        n_iters_cold[key] - n_iter for key, n_iter in n_iters.items()
+                        if n_iters_cold.get(key) is not None)
+                if pool is None:
+                    self.E_step()
+                else:
+                    pool.E_step()
+                logging.info('log likelihood of iteration {0}: {1:.4f}'.format(
+                    it, self.log_likelihood))
+                if abs(self.log_likelihood - log_likelihood_prev) < self.EM_tol:
+                    break
+        finally:
+            if pool is not None:
+                pool.close()
+        if measure_warm_start:
+            logging.info('warm start saved {0} solver iterations, {1} were run'.format(
+                self.solver_iterations_saved, sum(self.solver_iterations)))
         self.trained = True
 
+    def _M_step_cold(self, n_jobs=1):
+        """
+        The Maximization step on copies of the linear models without warm start,
+        to measure the solver iterations saved by warm start, see train.
+        The linear models of the IOHMM are not changed.
+        Parameters
+        ----------
+        n_jobs: see M_step
+        Returns
+        -------
+        n_iters: dictionary of the number of iterations of the solver of each fit, see M_step.
+        """
+        cold = copy(self)
+        cold.model_initial = deepcopy(self.model_initial)
+        cold.model_transition = deepcopy(self.model_transition)
+        cold.model_emissions = deepcopy(self.model_emissions)
+        for model in cold._linear_models():
+            model.warm_start = False
+        cold.M_step(n_jobs)
+        return cold.n_iters
+
     def to_json(self, path):
         """
         Generate json object of the IOHMM model
@@ -436,6 +1215,8 @@ class BaseIOHMM(object):
                 ) for emis in range(self.num_emissions)] for st in range(self.num_states)]
             }
         }
+        if self.transition_structure is not None:
+            json_dict['properties']['transition_structure'] = self.transition_structure.to_list()
         return json_dict
 
     @classmethod
@@ -491,6 +1272,8 @@ class BaseIOHMM(object):
                          covariates_transition=covariates_transition,
                          covariates_emissions=covariates_emissions)
         model.set_outputs(responses_emissions=responses_emissions)
+        if 'transition_structure' in json_dict['properties']:
+            model.set_transition_structure(json_dict['properties']['transition_structure'])
         return model
 
     @classmethod
@@ -672,6 +1455,8 @@ class UnSupervisedIOHMM(BaseIOHMM):
                          covariates_transition=covariates_transition,
                          covariates_emissions=covariates_emissions)
         model.set_outputs(responses_emissions=responses_emissions)
+        if 'transition_structure' in json_dict['properties']:
+            model.set_transition_structure(json_dict['properties']['transition_structure'])
         return model
 
 
@@ -696,13 +1481,17 @@ class SemiSupervisedIOHMM(UnSupervisedIOHMM):
                     and states is a dictionary of (timestamp -> array of shape (num_states, ))
                     states[t][k] is 1 and states[t][~k] is 0 if the hidden state is k at
                     timestamp t.
+                    states can also be an array of shape (df.shape[0], ) of integers,
+                    the hidden state of each timestamp and -1 if unknown,
+                    or of shape (df.shape[0], num_states) of booleans,
+                    True at the hidden state of each timestamp and all False if unknown.
         Notes
         ----------
         The column names of each df must contain the covariates and response fields
         specified above.
         """
         self.num_seqs = len(dfs_states)
-        self.dfs_logStates = [[x[0], {k: np.log(x[1][k]) for k in x[1]}] for x in dfs_states]
+        self.dfs_logStates = [[x[0], _log_state_from_states(x[1])] for x in dfs_states]
         self._initialize(with_randomness=True)
 
 
@@ -739,11 +1528,15 @@ class SupervisedIOHMM(BaseIOHMM):
                     and states if a dictionary of (timestamp -> array of shape (num_states, ))
                     states[t][k] is 1 and states[t][~k] is 0 if the hidden state is k at
                     timestamp t.
+                    states can also be an array of shape (df.shape[0], ) of integers,
+                    the hidden state of each timestamp and -1 if unknown,
+                    or of shape (df.shape[0], num_states) of booleans,
+                    True at the hidden state of each timestamp and all False if unknown.
         Notes
         ----------
         The column names of each df must contains the covariates and response fields
         specified above.
         """
         self.num_seqs = len(dfs_states)
-        self.dfs_logStates = [[x[0], {k: np.log(x[1][k]) for k in x[1]}] for x in dfs_states]
+        self.dfs_logStates = [[x[0], _log_state_from_states(x[1])] for x in dfs_states]
         self._initialize(with_randomness=False)
@@ -4,9 +4,31 @@ from .IOHMM import (UnSupervisedIOHMM,
 from .forward_backward import (forward_backward,
                                forward,
                                backward,
+                               forward_backward_batch,
+                               forward_batch,
+                               backward_batch,
+                               forward_backward_scaled,
+                               forward_backward_scaled_batch,
+                               forward_backward_scan,
+                               forward_scan,
+                               backward_scan,
+                               forward_backward_checkpoint,
+                               forward_backward_beam,
                                cal_log_gamma,
                                cal_log_epsilon,
-                               cal_log_likelihood)
+                               cal_log_likelihood,
+                               Workspace)
+from .online import (OnlineFilter,
+                     FixedLagSmoother)
+from .parallel import EStepPool
+from .sampling import (sample_states,
+                       sample_states_batch,
+                       backward_sample_batch)
+from .transition_structure import (TransitionStructure,
+                                   forward_backward_sparse,
+                                   forward_backward_sparse_batch)
+from .viterbi import (viterbi,
+                      viterbi_batch)
 from .linear_models import (GLM,
                             OLS,
                             DiscreteMNL,
@@ -14,8 +36,16 @@ from .linear_models import (GLM,
 
 __all__ = [
     UnSupervisedIOHMM, SemiSupervisedIOHMM, SupervisedIOHMM,
+    OnlineFilter, FixedLagSmoother, EStepPool,
     forward_backward, forward, backward,
+    forward_backward_batch, forward_batch, backward_batch,
+    forward_backward_scaled, forward_backward_scaled_batch,
+    forward_backward_scan, forward_scan, backward_scan,
+    forward_backward_checkpoint, forward_backward_beam,
     cal_log_gamma, cal_log_epsilon,
-    cal_log_likelihood,
+    cal_log_likelihood, Workspace,
+    TransitionStructure, forward_backward_sparse, forward_backward_sparse_batch,
+    viterbi, viterbi_batch,
+    sample_states, sample_states_batch, backward_sample_batch,
     GLM, OLS, DiscreteMNL, CrossEntropyMNL
 ]
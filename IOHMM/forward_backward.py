@@ -7,13 +7,29 @@ A feature of this implementation is that it is vectorized to the greatest extent
 that we use numpy matrix operation as much as possible.
 We have only one for loop in forward/backward calculation,
 which is necessary due to dynamic programming (DP).
+The batched functions (forward_backward_batch, forward_batch, backward_batch) run
+the same loop for many padded sequences at once, so that the loop is over timestamps
+rather than over sequences.
 
 Another feature of this implementation is that it is calculated at the log level,
 so that it is more robust to long sequences.
+The scaled functions (forward_backward_scaled, forward_backward_scaled_batch) instead
+work with probabilities normalized at each timestamp (Rabiner scaling),
+replacing the logsumexp of every step with a matrix product.
+The scan functions (forward_backward_scan, forward_scan, backward_scan) replace the
+for loop with a parallel prefix (associative scan) of the transition matrices
+in the log semiring, which takes O(log t) vectorized passes for very long sequences.
+The beam function (forward_backward_beam) is an approximation for many states:
+it keeps only the most probable states of each timestamp in the forward pass,
+so that each step is O(B * k) instead of O(k^2), and reports the probability mass dropped.
+The checkpoint function (forward_backward_checkpoint) keeps only a few forward variables
+in memory, recomputes the rest segment by segment in the backward pass,
+and streams the posteriors to a callback instead of returning them.
 '''
 from __future__ import division
 
 from builtins import range
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 
 
@@ -21,9 +37,12 @@ import numpy as np
 from scipy.special import logsumexp
 
 warnings.simplefilter("ignore")
+# the number of elements of the (block, k, k, k) temporary of each block of _log_matmul
+LOG_MATMUL_BLOCK_ELEMENTS = 2 ** 20
 
 
-def forward_backward(log_prob_initial, log_prob_transition, log_Ey, log_state={}):
+def forward_backward(log_prob_initial, log_prob_transition, log_Ey, log_state={},
+                     log_epsilon_out=None, beam_width=None, beam_threshold=None):
     """
     The forward_backward algorithm.
     Parameters
@@ -45,19 +64,38 @@ def forward_backward(log_prob_initial, log_prob_transition, log_Ey, log_state={}
         Mostly used in semi-supervised and supervised IOHMM.
         log_state[t][i] is 0 and log_state[t][~i] is -np.Infinity
         if we know the state is i at timestamp t.
+        Alternatively, a compact array, either
+        of shape (t, ) of integers: the known state of each timestamp, -1 if unknown, or
+        of shape (t, k) of booleans: True at the known state of each timestamp,
+        all False if unknown.
+    log_epsilon_out : array-like of shape (t-1, k, k) or None
+        The array to write the posterior "transition" log probability into.
+        If None, a new array is allocated.
+    beam_width : int or None
+        If given, prune the forward pass to the beam_width most probable states
+        of each timestamp, see forward_backward_beam.
+    beam_threshold : float or None
+        If given, prune the forward pass to the states of each timestamp whose
+        forward log probability is within beam_threshold of the most probable one,
+        see forward_backward_beam.
     Returns
     -------
     (1) posterior state log probability of each timestamp.
     (2) posterior "transition" log probability of each timestamp.
     (3) log likelihood of the sequence.
+    (4) only if beam_width or beam_threshold is given,
+        the probability mass dropped by the pruning.
     see https://en.wikipedia.org/wiki/Forward-backward_algorithm for details.
     """
+    if beam_width is not None or beam_threshold is not None:
+        return forward_backward_beam(log_prob_initial, log_prob_transition, log_Ey, log_state,
+                                     beam_width, beam_threshold, log_epsilon_out)
     log_alpha = forward(log_prob_initial, log_prob_transition, log_Ey, log_state)
     log_beta = backward(log_prob_transition, log_Ey, log_state)
     log_likelihood = cal_log_likelihood(log_alpha)
     log_gamma = cal_log_gamma(log_alpha, log_beta, log_likelihood, log_state)
     log_epsilon = cal_log_epsilon(log_prob_transition, log_Ey, log_alpha,
-                                  log_beta, log_likelihood, log_state)
+                                  log_beta, log_likelihood, log_state, out=log_epsilon_out)
     return log_gamma, log_epsilon, log_likelihood
 
 
@@ -83,6 +121,10 @@ def forward(log_prob_initial, log_prob_transition, log_Ey, log_state={}):
         Mostly used in semi-supervised and supervised IOHMM.
         log_state[t][i] is 0 and log_state[t][~i] is -np.Infinity
         if we know the state is i at timestamp t.
+        Alternatively, a compact array, either
+        of shape (t, ) of integers: the known state of each timestamp, -1 if unknown, or
+        of shape (t, k) of booleans: True at the known state of each timestamp,
+        all False if unknown.
     Returns
     -------
     log_alpha : array-like of shape (t, k)
@@ -94,17 +136,14 @@ def forward(log_prob_initial, log_prob_transition, log_Ey, log_state={}):
     assert log_Ey.ndim == 2
     t = log_Ey.shape[0]
     k = log_Ey.shape[1]
+    log_states, known_states = _log_state_to_dense(log_state, t, k)
+    log_prob_initial, log_prob_transition = _apply_log_states(
+        log_prob_initial, log_prob_transition, log_states, known_states)
     log_alpha = np.zeros((t, k))
-    if 0 in log_state:
-        log_alpha[0, :] = log_state[0] + log_Ey[0, :]
-    else:
-        log_alpha[0, :] = log_prob_initial + log_Ey[0, :]
+    log_alpha[0, :] = log_prob_initial + log_Ey[0, :]
     for i in range(1, t):
-        if i in log_state:
-            log_alpha[i, :] = logsumexp(log_alpha[i - 1, :]) + log_state[i] + log_Ey[i, :]
-        else:
-            log_alpha[i, :] = logsumexp(log_prob_transition[i - 1, :, :].T +
-                                        log_alpha[i - 1, :], axis=1) + log_Ey[i, :]
+        log_alpha[i, :] = logsumexp(log_prob_transition[i - 1, :, :].T +
+                                    log_alpha[i - 1, :], axis=1) + log_Ey[i, :]
     assert log_alpha.shape == (t, k)
     return log_alpha
 
@@ -126,6 +165,10 @@ def backward(log_prob_transition, log_Ey, log_state={}):
         Mostly used in semi-supervised and supervised IOHMM.
         log_state[t][i] is 0 and log_state[t][~i] is -np.Infinity
         if we know the state is i at timestamp t.
+        Alternatively, a compact array, either
+        of shape (t, ) of integers: the known state of each timestamp, -1 if unknown, or
+        of shape (t, k) of booleans: True at the known state of each timestamp,
+        all False if unknown.
     Returns
     -------
     log_beta : array-like of shape (t, k)
@@ -136,13 +179,13 @@ def backward(log_prob_transition, log_Ey, log_state={}):
     assert log_Ey.ndim == 2
     t = log_Ey.shape[0]
     k = log_Ey.shape[1]
+    log_states, known_states = _log_state_to_dense(log_state, t, k)
+    _, log_prob_transition = _apply_log_states(
+        np.zeros(k), log_prob_transition, log_states, known_states)
     log_beta = np.zeros((t, k))
     for i in range(t - 2, -1, -1):
-        if i + 1 in log_state:
-            log_beta[i, :] = logsumexp(log_state[i + 1] + log_beta[i + 1, :] + log_Ey[i + 1, :])
-        else:
-            log_beta[i, :] = logsumexp(log_prob_transition[i, :, :] +
-                                       (log_beta[i + 1, :] + log_Ey[i + 1, :]), axis=1)
+        log_beta[i, :] = logsumexp(log_prob_transition[i, :, :] +
+                                   (log_beta[i + 1, :] + log_Ey[i + 1, :]), axis=1)
     assert log_beta.shape == (t, k)
     return log_beta
 
@@ -180,6 +223,10 @@ def cal_log_gamma(log_alpha, log_beta, log_likelihood, log_state={}):
         Mostly used in semi-supervised and supervised IOHMM.
         log_state[t][i] is 0 and log_state[t][~i] is -np.Infinity
         if we know the state is i at timestamp t.
+        Alternatively, a compact array, either
+        of shape (t, ) of integers: the known state of each timestamp, -1 if unknown, or
+        of shape (t, k) of booleans: True at the known state of each timestamp,
+        all False if unknown.
     Returns
     -------
     log_gamma : array-like of shape (t, k)
@@ -189,12 +236,13 @@ def cal_log_gamma(log_alpha, log_beta, log_likelihood, log_state={}):
         see https://en.wikipedia.org/wiki/Forward-backward_algorithm for details.
     """
     log_gamma = log_alpha + log_beta - log_likelihood
-    for i in log_state:
-        log_gamma[i, :] = log_state[i]
+    log_states, known_states = _log_state_to_dense(log_state, *log_alpha.shape)
+    log_gamma[known_states] = log_states[known_states]
     return log_gamma
 
 
-def cal_log_epsilon(log_prob_transition, log_Ey, log_alpha, log_beta, log_likelihood, log_state={}):
+def cal_log_epsilon(log_prob_transition, log_Ey, log_alpha, log_beta, log_likelihood,
+                    log_state={}, out=None):
     """
     The function to calculate the log of the posterior joint probability
     of two consecutive timestamps
@@ -218,6 +266,13 @@ def cal_log_epsilon(log_prob_transition, log_Ey, log_alpha, log_beta, log_likeli
         Mostly used in semi-supervised and supervised IOHMM.
         log_state[t][i] is 0 and log_state[t][~i] is -np.Infinity
         if we know the state is i at timestamp t.
+        Alternatively, a compact array, either
+        of shape (t, ) of integers: the known state of each timestamp, -1 if unknown, or
+        of shape (t, k) of booleans: True at the known state of each timestamp,
+        all False if unknown.
+    out : array-like of shape (t-1, k, k) or None
+        The array to write the result into. If None, a new array is allocated.
+        log_prob_transition is never modified.
     Returns
     -------
     log_epsilon : array-like of shape (t-1, k, k)
@@ -229,14 +284,857 @@ def cal_log_epsilon(log_prob_transition, log_Ey, log_alpha, log_beta, log_likeli
     """
     k = log_Ey.shape[1]
     if log_prob_transition.shape[0] == 0:
-        return np.zeros((0, k, k))
+        return np.zeros((0, k, k)) if out is None else out
     else:
-        log_p = log_prob_transition
-        for i in log_state:
-            log_p[i - 1, :, :] = log_state[i]
-        log_epsilon = np.tile((log_Ey + log_beta)[1:, np.newaxis, :], [1, k, 1]) + \
-            np.tile(log_alpha[:-1, :, np.newaxis], [1, 1, k]) + log_p - log_likelihood
-        for i in log_state:
-            if i + 1 in log_state:
-                log_epsilon[i, :, :] = np.add.outer(log_state[i], log_state[i + 1])
+        log_states, known_states = _log_state_to_dense(log_state, *log_Ey.shape)
+        log_Ey_beta = (log_Ey + log_beta)[1:] - log_likelihood
+        log_epsilon = np.add(log_alpha[:-1, :, np.newaxis], log_prob_transition, out=out)
+        log_epsilon += log_Ey_beta[:, np.newaxis, :]
+        # the transition into a known state is the known state for any previous state
+        known_next = known_states[1:]
+        log_epsilon[known_next] = (log_alpha[:-1][known_next][:, :, np.newaxis] +
+                                   (log_Ey_beta + log_states[1:])[known_next][:, np.newaxis, :])
+        _mask_known_pairs(log_epsilon, log_states, known_states)
         return log_epsilon
+
+
+def forward_backward_beam(log_prob_initial, log_prob_transition, log_Ey, log_state={},
+                          beam_width=None, beam_threshold=None, log_epsilon_out=None):
+    """
+    The beam-pruned forward_backward algorithm, an approximation for many states.
+    After each step of the forward pass, only the states in the beam are kept
+    and the others are treated as -np.Infinity, the next step sums over the kept states only,
+    and the backward pass runs over the same states.
+    The posteriors are exact for the HMM restricted to the kept states.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_Ey : array-like of shape (t, k)
+    log_state: dict(int -> array-like of shape (k, )), or an array of the known states
+    see forward_backward for details.
+    beam_width : int or None
+        the maximum number of states kept at each timestamp.
+    beam_threshold : float or None
+        the states whose forward log probability is more than beam_threshold
+        below the most probable one are dropped.
+    log_epsilon_out : array-like of shape (t-1, k, k) or None
+        The array to write the posterior "transition" log probability into.
+        If None, a new array is allocated.
+    Returns
+    -------
+    (1) posterior state log probability of each timestamp,
+        -np.Infinity for the dropped states.
+    (2) posterior "transition" log probability of each timestamp.
+    (3) log likelihood of the sequence, a lower bound of the exact one.
+    (4) pruned_mass : float
+        the probability mass dropped by the pruning, 1 - prod_t (1 - d_t),
+        where d_t is the fraction of the (filtered) forward probability
+        of timestamp t that is dropped. 0 if nothing is dropped.
+    """
+    assert log_prob_initial.ndim == 1
+    assert log_prob_transition.ndim == 3
+    assert log_Ey.ndim == 2
+    t, k = log_Ey.shape
+    log_states, known_states = _log_state_to_dense(log_state, t, k)
+    log_prob_initial, log_prob_transition = _apply_log_states(
+        log_prob_initial, log_prob_transition, log_states, known_states)
+    log_alpha = np.full((t, k), -np.Infinity, dtype=log_Ey.dtype)
+    log_beta = np.full((t, k), -np.Infinity, dtype=log_Ey.dtype)
+    beams = []
+    log_kept = np.zeros(t)
+    for i in range(t):
+        if i == 0:
+            log_alpha_i = log_prob_initial + log_Ey[0, :]
+        else:
+            prev = beams[-1]
+            log_alpha_i = logsumexp(log_prob_transition[i - 1][prev, :].T +
+                                    log_alpha[i - 1, prev], axis=1) + log_Ey[i, :]
+        beam = _beam_states(log_alpha_i, beam_width, beam_threshold)
+        log_alpha[i, beam] = log_alpha_i[beam]
+        log_total = logsumexp(log_alpha_i)
+        if log_total > -np.Infinity:
+            log_kept[i] = logsumexp(log_alpha_i[beam]) - log_total
+        beams.append(beam)
+    log_likelihood = logsumexp(log_alpha[-1, beams[-1]])
+    log_beta[-1, beams[-1]] = 0
+    for i in range(t - 2, -1, -1):
+        beam, beam_next = beams[i], beams[i + 1]
+        log_beta[i, beam] = logsumexp(
+            log_prob_transition[i][np.ix_(beam, beam_next)] +
+            (log_beta[i + 1, beam_next] + log_Ey[i + 1, beam_next]), axis=1)
+    log_gamma = log_alpha + log_beta - log_likelihood
+    log_gamma[known_states] = log_states[known_states]
+    if log_epsilon_out is None:
+        log_epsilon = np.full((t - 1, k, k), -np.Infinity, dtype=log_Ey.dtype)
+    else:
+        log_epsilon = log_epsilon_out
+        log_epsilon[...] = -np.Infinity
+    for i in range(t - 1):
+        beam, beam_next = beams[i], beams[i + 1]
+        log_epsilon[i][np.ix_(beam, beam_next)] = (
+            log_alpha[i, beam, np.newaxis] + log_prob_transition[i][np.ix_(beam, beam_next)] +
+            (log_Ey[i + 1, beam_next] + log_beta[i + 1, beam_next] - log_likelihood))
+    _mask_known_pairs(log_epsilon, log_states, known_states)
+    pruned_mass = max(0., -np.expm1(log_kept.sum()))
+    return log_gamma, log_epsilon, log_likelihood, pruned_mass
+
+
+def _beam_states(log_alpha, beam_width=None, beam_threshold=None):
+    """
+    The states kept by the beam at a timestamp.
+    Parameters
+    ----------
+    log_alpha : array-like of shape (k, )
+        log of forward variable alpha at the timestamp.
+    beam_width : int or None
+    beam_threshold : float or None
+    see forward_backward_beam for details.
+    Returns
+    -------
+    beam : array of shape (B, ) of integers, the sorted indices of the kept states,
+           all the states if none of them is possible.
+    """
+    log_max = np.max(log_alpha)
+    if log_max == -np.Infinity:
+        return np.arange(log_alpha.shape[0])
+    keep = log_alpha > -np.Infinity
+    if beam_threshold is not None:
+        keep &= log_alpha >= log_max - beam_threshold
+    beam = np.flatnonzero(keep)
+    if beam_width is not None and beam.shape[0] > beam_width:
+        beam = np.sort(beam[np.argpartition(-log_alpha[beam], beam_width - 1)[:beam_width]])
+    return beam
+
+
+def forward_backward_batch(log_prob_initial, log_prob_transition, log_Ey, lengths,
+                           log_states=None, known_states=None, workspace=None):
+    """
+    The forward_backward algorithm on a batch of padded sequences.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+        where n is the number of sequences and k is the number of states of the HMM.
+        log_prob_initial_{s, i} is the log of the probability of sequence s
+        being in state i at timestamp 0.
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+        where t is the length of the longest sequence.
+        log_prob_transition_{s, t, i, j} is the log of the probability of sequence s
+        transferring to state j from state i at timestamp t.
+    log_Ey : array-like of shape (n, t, k)
+        log_Ey_{s, t, i} is the log of the probability of sequence s observing
+        emission variables from state i at timestamp t.
+    lengths : array-like of shape (n, )
+        the number of timestamps of each sequence.
+        Entries of the other arrays beyond the length of a sequence are ignored.
+    log_states : array-like of shape (n, t, k) or None
+        log_states[s, t] plays the role of log_state[t] of sequence s
+        for the timestamps where known_states[s, t] is True.
+    known_states : array-like of shape (n, t) of booleans or None
+        known_states[s, t] is True if we know the state of sequence s at timestamp t.
+    workspace : Workspace or None
+        If given, the intermediate and returned arrays are views of its buffers,
+        which are overwritten by the next call with the same workspace.
+        The known states are then folded into log_prob_initial and log_prob_transition
+        in place, so they should be buffers of the caller, as the padded arrays of E_step.
+    Returns
+    -------
+    (1) posterior state log probability of each timestamp, of shape (n, t, k).
+    (2) posterior "transition" log probability of each timestamp, of shape (n, t-1, k, k).
+    (3) log likelihood of each sequence, of shape (n, ).
+    The padded timestamps of (1) and (2) are -np.Infinity.
+    """
+    lengths = np.asarray(lengths)
+    valid = np.arange(log_Ey.shape[1]) < lengths[:, np.newaxis]
+    log_prob_initial, log_prob_transition = _apply_log_states_batch(
+        log_prob_initial, log_prob_transition, log_states, known_states,
+        inplace=workspace is not None)
+    dtype = log_Ey.dtype
+    log_alpha = forward_batch(log_prob_initial, log_prob_transition, log_Ey, lengths,
+                              out=_empty(workspace, 'log_alpha', log_Ey.shape, dtype))
+    log_beta = backward_batch(log_prob_transition, log_Ey, lengths,
+                              out=_empty(workspace, 'log_beta', log_Ey.shape, dtype))
+    # the likelihood is always accumulated in double precision
+    log_likelihood = logsumexp(
+        log_alpha[np.arange(lengths.shape[0]), lengths - 1].astype(np.float64), axis=1)
+
+    log_gamma = np.add(log_alpha, log_beta,
+                       out=_empty(workspace, 'log_gamma', log_Ey.shape, dtype))
+    log_gamma -= log_likelihood[:, np.newaxis, np.newaxis]
+    log_epsilon = np.add(log_alpha[:, :-1, :, np.newaxis], log_prob_transition,
+                         out=_empty(workspace, 'log_epsilon', log_prob_transition.shape, dtype))
+    log_beta += log_Ey
+    log_beta -= log_likelihood[:, np.newaxis, np.newaxis]
+    log_epsilon += log_beta[:, 1:, np.newaxis, :]
+    _mask_padded_and_known_batch(log_gamma, log_epsilon, valid, log_states, known_states)
+    return log_gamma, log_epsilon, log_likelihood
+
+
+def _mask_padded_and_known_batch(log_gamma, log_epsilon, valid, log_states, known_states):
+    """
+    In place, set the posteriors of the padded timestamps to -np.Infinity
+    and the posteriors of the known timestamps to the known states.
+    Parameters
+    ----------
+    log_gamma : array-like of shape (n, t, k)
+    log_epsilon : array-like of shape (n, t-1, k, k)
+    valid : array-like of shape (n, t) of booleans, False for the padded timestamps
+    log_states : array-like of shape (n, t, k) or None
+    known_states : array-like of shape (n, t) of booleans or None
+    """
+    log_gamma[~valid] = -np.Infinity
+    log_epsilon[~valid[:, 1:]] = -np.Infinity
+    if known_states is not None:
+        log_gamma[known_states] = log_states[known_states]
+        _mask_known_pairs(log_epsilon, log_states, known_states)
+
+
+def _mask_known_pairs(log_epsilon, log_states, known_states):
+    """
+    In place, set the posterior "transition" of the consecutive timestamps
+    whose states are both known to the known states.
+    Parameters
+    ----------
+    log_epsilon : array-like of shape (..., t-1, k, k)
+    log_states : array-like of shape (..., t, k)
+    known_states : array-like of shape (..., t) of booleans
+    """
+    known_pairs = known_states[..., :-1] & known_states[..., 1:]
+    log_epsilon[known_pairs] = (log_states[..., :-1, :][known_pairs][:, :, np.newaxis] +
+                                log_states[..., 1:, :][known_pairs][:, np.newaxis, :])
+
+
+def _apply_log_states_batch(log_prob_initial, log_prob_transition, log_states, known_states,
+                            inplace=False):
+    """
+    Fold the known states into the initial and transition probabilities,
+    so that the forward/backward recursions do not need to look them up.
+    Knowing the state at timestamp t is equivalent to replacing
+    the initial probability (t = 0) or the transition probability into timestamp t
+    with log_states[:, t], whatever the previous state is.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+    log_states : array-like of shape (n, t, k) or None
+    known_states : array-like of shape (n, t) of booleans or None
+    inplace : whether to overwrite log_prob_initial and log_prob_transition
+              instead of returning new arrays.
+    Returns
+    -------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+    """
+    if known_states is None or not known_states.any():
+        return log_prob_initial, log_prob_transition
+    if inplace:
+        log_prob_initial[known_states[:, 0]] = log_states[known_states[:, 0], 0, :]
+        log_prob_transition[known_states[:, 1:]] = \
+            log_states[:, 1:][known_states[:, 1:]][:, np.newaxis, :]
+        return log_prob_initial, log_prob_transition
+    log_prob_initial = np.where(known_states[:, 0, np.newaxis],
+                                log_states[:, 0, :], log_prob_initial)
+    log_prob_transition = np.where(known_states[:, 1:, np.newaxis, np.newaxis],
+                                   log_states[:, 1:, np.newaxis, :], log_prob_transition)
+    return log_prob_initial, log_prob_transition
+
+
+def forward_batch(log_prob_initial, log_prob_transition, log_Ey, lengths, out=None):
+    """
+    The forward function on a batch of padded sequences.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    see forward_backward_batch for details.
+    out : array-like of shape (n, t, k) or None
+        The array to write the result into. If None, a new array is allocated.
+    Returns
+    -------
+    log_alpha : array-like of shape (n, t, k)
+        log of forward variable alpha.
+        The padded timestamps of a sequence repeat its last alpha.
+    """
+    assert log_prob_initial.ndim == 2
+    assert log_prob_transition.ndim == 4
+    assert log_Ey.ndim == 3
+    n, t, k = log_Ey.shape
+    valid = np.arange(t) < np.asarray(lengths)[:, np.newaxis]
+    log_alpha = np.zeros((n, t, k), dtype=log_Ey.dtype) if out is None else out
+    log_alpha[:, 0, :] = log_prob_initial + log_Ey[:, 0, :]
+    for i in range(1, t):
+        log_alpha[:, i, :] = np.where(
+            valid[:, i, np.newaxis],
+            logsumexp(log_alpha[:, i - 1, :, np.newaxis] +
+                      log_prob_transition[:, i - 1, :, :], axis=1) + log_Ey[:, i, :],
+            log_alpha[:, i - 1, :])
+    return log_alpha
+
+
+def backward_batch(log_prob_transition, log_Ey, lengths, out=None):
+    """
+    The backward function on a batch of padded sequences.
+    Parameters
+    ----------
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    see forward_backward_batch for details.
+    out : array-like of shape (n, t, k) or None
+        The array to write the result into. If None, a new array is allocated.
+    Returns
+    -------
+    log_beta : array-like of shape (n, t, k)
+        log of backward variable beta.
+        The padded timestamps of a sequence are 0.
+    """
+    assert log_prob_transition.ndim == 4
+    assert log_Ey.ndim == 3
+    n, t, k = log_Ey.shape
+    valid = np.arange(t) < np.asarray(lengths)[:, np.newaxis]
+    log_beta = np.zeros((n, t, k), dtype=log_Ey.dtype) if out is None else out
+    log_beta[:, -1, :] = 0
+    for i in range(t - 2, -1, -1):
+        log_beta[:, i, :] = np.where(
+            valid[:, i + 1, np.newaxis],
+            logsumexp(log_prob_transition[:, i, :, :] +
+                      (log_beta[:, i + 1, :] + log_Ey[:, i + 1, :])[:, np.newaxis, :], axis=2),
+            0)
+    return log_beta
+
+
+class Workspace(object):
+    """
+    Buffers reused across calls of the batched forward backward functions,
+    so that repeated calls on batches of similar sizes do not allocate large arrays.
+    Each named buffer is a flat array, and the arrays handed out are views of its head,
+    so a buffer only grows when a larger array than ever before is requested.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._buffers = {}
+
+    def reserve(self, name, size, dtype=np.float64):
+        """
+        Make sure the named buffer can hold at least size elements of dtype.
+        Parameters
+        ----------
+        name: the name of the buffer
+        size: the number of elements
+        dtype: the data type of the elements
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            self._buffers[name] = np.empty(size, dtype=dtype)
+
+    def get(self, name, shape, dtype=np.float64):
+        """
+        An uninitialized array of the given shape backed by the named buffer.
+        Parameters
+        ----------
+        name: the name of the buffer
+        shape: the shape of the array
+        dtype: the data type of the array
+        Returns
+        -------
+        array of the given shape, a view of the named buffer.
+        It is overwritten by the next array requested with the same name.
+        """
+        size = int(np.prod(shape))
+        self.reserve(name, size, dtype)
+        return self._buffers[name][:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        """
+        The total number of bytes of the buffers.
+        """
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+
+def _empty(workspace, name, shape, dtype=np.float64):
+    """
+    An uninitialized array from the workspace, or a new one if the workspace is None.
+    """
+    if workspace is None:
+        return np.empty(shape, dtype=dtype)
+    return workspace.get(name, shape, dtype)
+
+
+def forward_backward_scaled(log_prob_initial, log_prob_transition, log_Ey, log_state={}):
+    """
+    The forward_backward algorithm with scaled probabilities instead of logs.
+    Same parameters and returns as forward_backward.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_Ey : array-like of shape (t, k)
+    log_state: dict(int -> array-like of shape (k, )), or an array of the known states
+    see forward_backward for details.
+    Returns
+    -------
+    (1) posterior state log probability of each timestamp.
+    (2) posterior "transition" log probability of each timestamp.
+    (3) log likelihood of the sequence.
+    """
+    log_states, known_states = _log_state_to_dense(log_state, *log_Ey.shape)
+    log_gamma, log_epsilon, log_likelihood = forward_backward_scaled_batch(
+        log_prob_initial[np.newaxis], log_prob_transition[np.newaxis], log_Ey[np.newaxis],
+        np.array([log_Ey.shape[0]]), log_states[np.newaxis], known_states[np.newaxis])
+    return log_gamma[0], log_epsilon[0], log_likelihood[0]
+
+
+def _log_state_to_dense(log_state, t, k):
+    """
+    Convert the known states of a sequence into dense arrays.
+    Parameters
+    ----------
+    log_state: the known states of the sequence, one of
+        dict(int -> array-like of shape (k, )),
+        array of shape (t, ) of integers, -1 if unknown,
+        array of shape (t, k) of booleans, all False if unknown.
+        see forward_backward for details.
+    t: the number of timestamps of the sequence
+    k: the number of states
+    Returns
+    -------
+    log_states : array-like of shape (t, k)
+        log_states[i] is log_state[i] if the state of timestamp i is known.
+    known_states : array-like of shape (t, ) of booleans
+    """
+    if isinstance(log_state, dict):
+        log_states = np.zeros((t, k))
+        known_states = np.zeros(t, dtype=bool)
+        for i in log_state:
+            log_states[i] = log_state[i]
+            known_states[i] = True
+        return log_states, known_states
+    log_state = np.asarray(log_state)
+    if log_state.ndim == 2:
+        known_states = log_state.any(axis=1)
+        return np.where(log_state.astype(bool), 0., -np.Infinity), known_states
+    known_states = log_state >= 0
+    log_states = np.full((t, k), -np.Infinity)
+    log_states[known_states, log_state[known_states]] = 0
+    return log_states, known_states
+
+
+def _slice_log_state(log_state, start, end):
+    """
+    The known states of timestamps start, ..., end - 1 of a sequence,
+    in the same format, with timestamps counted from start.
+    Parameters
+    ----------
+    log_state: the known states of the sequence, see _log_state_to_dense.
+    start: the first timestamp
+    end: the timestamp after the last
+    Returns
+    -------
+    log_state: the known states of the slice
+    """
+    if isinstance(log_state, dict):
+        return {i - start: log_state[i] for i in log_state if start <= i < end}
+    return np.asarray(log_state)[start:end]
+
+
+def _apply_log_states(log_prob_initial, log_prob_transition, log_states, known_states):
+    """
+    Fold the known states of a sequence into its initial and transition probabilities,
+    see _apply_log_states_batch.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_states : array-like of shape (t, k)
+    known_states : array-like of shape (t, ) of booleans
+    Returns
+    -------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    """
+    log_prob_initial, log_prob_transition = _apply_log_states_batch(
+        log_prob_initial[np.newaxis], log_prob_transition[np.newaxis],
+        log_states[np.newaxis], known_states[np.newaxis])
+    return log_prob_initial[0], log_prob_transition[0]
+
+
+def forward_backward_scaled_batch(log_prob_initial, log_prob_transition, log_Ey, lengths,
+                                  log_states=None, known_states=None, workspace=None):
+    """
+    The scaled forward_backward algorithm on a batch of padded sequences.
+    Same parameters and returns as forward_backward_batch.
+    The forward variable is normalized to sum to one at each timestamp,
+    and the backward variable is divided by the same normalizers.
+    The emission probabilities are shifted by their maximum at each timestamp
+    before exponentiation so that they do not underflow.
+    see http://www.cs.ubc.ca/~murphyk/Software/HMM/rabiner.pdf for details.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    log_states : array-like of shape (n, t, k) or None
+    known_states : array-like of shape (n, t) of booleans or None
+    workspace : Workspace or None
+    see forward_backward_batch for details.
+    Returns
+    -------
+    (1) posterior state log probability of each timestamp, of shape (n, t, k).
+    (2) posterior "transition" log probability of each timestamp, of shape (n, t-1, k, k).
+    (3) log likelihood of each sequence, of shape (n, ).
+    """
+    lengths = np.asarray(lengths)
+    n, t, k = log_Ey.shape
+    valid = np.arange(t) < lengths[:, np.newaxis]
+    log_prob_initial, log_prob_transition = _apply_log_states_batch(
+        log_prob_initial, log_prob_transition, log_states, known_states,
+        inplace=workspace is not None)
+    dtype = log_Ey.dtype
+    prob_transition = np.exp(log_prob_transition, out=_empty(
+        workspace, 'prob_transition', log_prob_transition.shape, dtype))
+    log_Ey_max = np.max(log_Ey, axis=2, keepdims=True)
+    log_Ey_max[~np.isfinite(log_Ey_max)] = 0
+    Ey = np.subtract(log_Ey, log_Ey_max, out=_empty(workspace, 'Ey', log_Ey.shape, dtype))
+    np.exp(Ey, out=Ey)
+
+    # forward, the scales are kept in double precision
+    alpha = _empty(workspace, 'alpha', (n, t, k), dtype)
+    scale = np.ones((n, t))
+    alpha[:, 0, :] = np.exp(log_prob_initial) * Ey[:, 0, :]
+    scale[:, 0] = alpha[:, 0, :].sum(axis=1)
+    alpha[:, 0, :] /= scale[:, 0, np.newaxis]
+    for i in range(1, t):
+        alpha_i = np.matmul(alpha[:, i - 1, np.newaxis, :],
+                            prob_transition[:, i - 1, :, :])[:, 0, :] * Ey[:, i, :]
+        scale[:, i] = np.where(valid[:, i], alpha_i.sum(axis=1), 1)
+        alpha[:, i, :] = np.where(valid[:, i, np.newaxis],
+                                  alpha_i / scale[:, i, np.newaxis], alpha[:, i - 1, :])
+
+    # backward
+    beta = _empty(workspace, 'beta', (n, t, k), dtype)
+    beta[:, -1, :] = 1
+    for i in range(t - 2, -1, -1):
+        beta[:, i, :] = np.where(
+            valid[:, i + 1, np.newaxis],
+            np.matmul(prob_transition[:, i, :, :],
+                      (Ey[:, i + 1, :] * beta[:, i + 1, :])[:, :, np.newaxis])[:, :, 0] /
+            scale[:, i + 1, np.newaxis],
+            1)
+
+    log_likelihood = np.sum(np.log(scale) + log_Ey_max[:, :, 0].astype(np.float64) * valid,
+                            axis=1)
+    log_gamma = np.multiply(alpha, beta, out=_empty(workspace, 'log_gamma', (n, t, k), dtype))
+    np.log(log_gamma, out=log_gamma)
+    log_epsilon = np.multiply(alpha[:, :-1, :, np.newaxis], prob_transition,
+                              out=_empty(workspace, 'log_epsilon', prob_transition.shape, dtype))
+    beta *= Ey
+    beta[:, 1:] /= scale[:, 1:, np.newaxis]
+    log_epsilon *= beta[:, 1:, np.newaxis, :]
+    np.log(log_epsilon, out=log_epsilon)
+    _mask_padded_and_known_batch(log_gamma, log_epsilon, valid, log_states, known_states)
+    return log_gamma, log_epsilon, log_likelihood
+
+
+def forward_backward_scan(log_prob_initial, log_prob_transition, log_Ey, log_state={}, n_jobs=1):
+    """
+    The forward_backward algorithm by associative scan.
+    Same parameters and returns as forward_backward.
+    The scan keeps the prefix and suffix products of the transition matrices,
+    so it takes O(t * k^2) memory, a few times the memory of log_prob_transition,
+    on top of the blocks of _log_matmul.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_Ey : array-like of shape (t, k)
+    log_state: dict(int -> array-like of shape (k, )), or an array of the known states
+    see forward_backward for details.
+    n_jobs: the number of threads to split each pass of the scan across.
+    Returns
+    -------
+    (1) posterior state log probability of each timestamp.
+    (2) posterior "transition" log probability of each timestamp.
+    (3) log likelihood of the sequence.
+    """
+    log_states, known_states = _log_state_to_dense(log_state, *log_Ey.shape)
+    log_prob_initial, log_prob_transition = _apply_log_states(
+        log_prob_initial, log_prob_transition, log_states, known_states)
+    log_alpha = forward_scan(log_prob_initial, log_prob_transition, log_Ey, n_jobs=n_jobs)
+    log_beta = backward_scan(log_prob_transition, log_Ey, n_jobs=n_jobs)
+    log_likelihood = cal_log_likelihood(log_alpha)
+    log_gamma = log_alpha + log_beta - log_likelihood
+    log_epsilon = (log_alpha[:-1, :, np.newaxis] + log_prob_transition +
+                   (log_Ey + log_beta)[1:, np.newaxis, :] - log_likelihood)
+    _mask_padded_and_known_batch(
+        log_gamma[np.newaxis], log_epsilon[np.newaxis], np.ones((1, log_Ey.shape[0]), dtype=bool),
+        log_states[np.newaxis], known_states[np.newaxis])
+    return log_gamma, log_epsilon, log_likelihood
+
+
+def forward_scan(log_prob_initial, log_prob_transition, log_Ey, n_jobs=1):
+    """
+    The forward function by associative scan.
+    log_alpha[i] is log_alpha[0] multiplied by the matrices
+    log_prob_transition[s - 1] + log_Ey[s] for s in 1..i in the log semiring,
+    and these products are all calculated by one parallel prefix.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_Ey : array-like of shape (t, k)
+    see forward for details.
+    n_jobs: the number of threads to split each pass of the scan across.
+    Returns
+    -------
+    log_alpha : array-like of shape (t, k)
+        log of forward variable alpha.
+    """
+    assert log_prob_initial.ndim == 1
+    assert log_prob_transition.ndim == 3
+    assert log_Ey.ndim == 2
+    log_alpha = np.zeros(log_Ey.shape)
+    log_alpha[0, :] = log_prob_initial + log_Ey[0, :]
+    if log_Ey.shape[0] > 1:
+        log_prefix = _log_matrix_scan(
+            log_prob_transition + log_Ey[1:, np.newaxis, :], reverse=False, n_jobs=n_jobs)
+        log_alpha[1:, :] = logsumexp(log_alpha[0, :, np.newaxis] + log_prefix, axis=1)
+    return log_alpha
+
+
+def backward_scan(log_prob_transition, log_Ey, n_jobs=1):
+    """
+    The backward function by associative scan.
+    log_beta[i] is the products of the matrices log_prob_transition[s - 1] + log_Ey[s]
+    for s in i+1..t-1 in the log semiring, summed over the last state,
+    and these products are all calculated by one parallel suffix.
+    Parameters
+    ----------
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_Ey : array-like of shape (t, k)
+    see backward for details.
+    n_jobs: the number of threads to split each pass of the scan across.
+    Returns
+    -------
+    log_beta : array-like of shape (t, k)
+        log of backward variable beta.
+    """
+    assert log_prob_transition.ndim == 3
+    assert log_Ey.ndim == 2
+    log_beta = np.zeros(log_Ey.shape)
+    if log_Ey.shape[0] > 1:
+        log_suffix = _log_matrix_scan(
+            log_prob_transition + log_Ey[1:, np.newaxis, :], reverse=True, n_jobs=n_jobs)
+        log_beta[:-1, :] = logsumexp(log_suffix, axis=2)
+    return log_beta
+
+
+def _log_matmul(log_A, log_B, n_jobs=1):
+    """
+    Multiply two stacks of matrices in the log semiring,
+    where addition is logsumexp and multiplication is addition.
+    The stacks are multiplied in blocks of matrices whose (block, k, k, k) temporary
+    has at most LOG_MATMUL_BLOCK_ELEMENTS elements, so that the memory does not grow
+    with k^3 times the length of the stacks.
+    Parameters
+    ----------
+    log_A : array-like of shape (n, k, k)
+    log_B : array-like of shape (n, k, k)
+    n_jobs: the number of threads to split the blocks across.
+    Returns
+    -------
+    log_C : array-like of shape (n, k, k)
+        log_C[s, i, j] = logsumexp(log_A[s, i, :] + log_B[s, :, j])
+    """
+    n, k = log_A.shape[:2]
+    log_C = np.empty(log_A.shape, dtype=np.result_type(log_A, log_B))
+    block = max(1, LOG_MATMUL_BLOCK_ELEMENTS // k ** 3)
+
+    def _log_matmul_block(lo):
+        hi = min(lo + block, n)
+        log_C[lo:hi] = logsumexp(
+            log_A[lo:hi, :, :, np.newaxis] + log_B[lo:hi, np.newaxis, :, :], axis=2)
+
+    starts = range(0, n, block)
+    if n_jobs == 1 or len(starts) < 2:
+        for lo in starts:
+            _log_matmul_block(lo)
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(_log_matmul_block, starts))
+    return log_C
+
+
+def _log_matrix_scan(log_M, reverse=False, n_jobs=1):
+    """
+    The inclusive prefix (or suffix) products of a stack of matrices in the log semiring,
+    by a work efficient parallel scan:
+    the adjacent pairs are multiplied, the scan recurses on the pairs,
+    and the remaining products are filled in, all with vectorized operations.
+    Parameters
+    ----------
+    log_M : array-like of shape (n, k, k)
+    reverse: if False, calculate the prefix products log_M[0] ... log_M[i],
+             otherwise calculate the suffix products log_M[i] ... log_M[n - 1].
+    n_jobs: the number of threads to split each pass across.
+    Returns
+    -------
+    log_P : array-like of shape (n, k, k)
+    """
+    def _combine(log_left, log_right):
+        # combine in the order of the sequence, whichever direction we scan
+        if reverse:
+            return _log_matmul(log_right, log_left, n_jobs=n_jobs)
+        return _log_matmul(log_left, log_right, n_jobs=n_jobs)
+
+    if reverse:
+        return _log_matrix_scan_ordered(log_M[::-1], _combine)[::-1]
+    return _log_matrix_scan_ordered(log_M, _combine)
+
+
+def _log_matrix_scan_ordered(log_M, combine):
+    """
+    The inclusive scan of log_M with an associative combine function.
+    Parameters
+    ----------
+    log_M : array-like of shape (n, k, k)
+    combine: function of two stacks of matrices returning their elementwise product
+    Returns
+    -------
+    log_P : array-like of shape (n, k, k), log_P[i] = combine(... combine(log_M[0], log_M[1]) ...)
+    """
+    n = log_M.shape[0]
+    if n == 1:
+        return log_M.copy()
+    log_P = np.empty(log_M.shape)
+    log_P[1::2] = _log_matrix_scan_ordered(combine(log_M[0:n - 1:2], log_M[1::2]), combine)
+    log_P[0] = log_M[0]
+    log_P[2::2] = combine(log_P[1:n - 1:2], log_M[2::2])
+    return log_P
+
+
+def forward_backward_checkpoint(log_prob_initial, log_prob_transition, log_Ey, callback,
+                                log_state={}, max_memory=None):
+    """
+    The forward_backward algorithm with checkpoints, for sequences whose posteriors
+    do not fit in memory.
+    The sequence is split into segments. The forward pass only keeps the forward variable
+    at the start of each segment, the backward pass recomputes the forward variables of
+    one segment at a time and passes the posteriors of the segment to the callback.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_Ey : array-like of shape (t, k)
+    see forward_backward for details.
+    callback : function of (start, log_gamma, log_epsilon), called once per segment,
+        from the last segment to the first, where
+        log_gamma is of shape (m, k), the posterior state log probability of
+        timestamps start, ..., start + m - 1,
+        log_epsilon is of shape (m', k, k), the posterior "transition" log probability of
+        timestamps start, ..., start + m' - 1 (m' is m - 1 for the last segment, m otherwise).
+    log_state: dict(int -> array-like of shape (k, )), or an array of the known states
+        see forward_backward for details.
+    max_memory: approximate number of bytes the arrays of a segment may use.
+                If None, the segments have sqrt(t) timestamps.
+    Returns
+    -------
+    log likelihood of the sequence.
+    """
+    assert log_prob_initial.ndim == 1
+    assert log_prob_transition.ndim == 3
+    assert log_Ey.ndim == 2
+    t, k = log_Ey.shape
+    segment = _checkpoint_segment_length(t, k, log_Ey.itemsize, max_memory)
+    bounds = list(range(0, t, segment)) + [t]
+    segments = list(zip(bounds[:-1], bounds[1:]))
+
+    def _segment_log_probs(lo, end):
+        """
+        The transitions into timestamps lo + 1, ..., end - 1 with the known states folded in,
+        and the known states of timestamps lo, ..., end - 1.
+        """
+        log_states, known_states = _log_state_to_dense(
+            _slice_log_state(log_state, lo, end), end - lo, k)
+        log_prob_segment = log_prob_transition[lo:end - 1]
+        if known_states[1:].any():
+            log_prob_segment = np.where(known_states[1:, np.newaxis, np.newaxis],
+                                        log_states[1:, np.newaxis, :], log_prob_segment)
+        return log_prob_segment, log_states, known_states
+
+    def _forward_segment(log_alpha_lo, log_prob_segment, lo, hi):
+        log_alpha = np.zeros((hi - lo, k))
+        log_alpha[0, :] = log_alpha_lo
+        for i in range(1, hi - lo):
+            log_alpha[i, :] = logsumexp(log_prob_segment[i - 1, :, :].T +
+                                        log_alpha[i - 1, :], axis=1) + log_Ey[lo + i, :]
+        return log_alpha
+
+    # forward pass, keep the forward variable at the start of each segment
+    checkpoints = []
+    log_alpha_last = None
+    for lo, hi in segments:
+        if lo == 0:
+            log_states, known_states = _log_state_to_dense(_slice_log_state(log_state, 0, 1), 1, k)
+            log_alpha_lo = _apply_log_states(
+                log_prob_initial, log_prob_transition[:0], log_states, known_states)[0] + \
+                log_Ey[0, :]
+        else:
+            log_prob_lo = _segment_log_probs(lo - 1, lo + 1)[0][0]
+            log_alpha_lo = logsumexp(log_prob_lo.T + log_alpha_last, axis=1) + log_Ey[lo, :]
+        checkpoints.append(log_alpha_lo)
+        log_alpha_last = _forward_segment(
+            log_alpha_lo, _segment_log_probs(lo, hi)[0], lo, hi)[-1, :]
+    log_likelihood = logsumexp(log_alpha_last)
+
+    # backward pass, recompute the forward variables of each segment
+    log_beta_hi = None
+    for (lo, hi), log_alpha_lo in zip(segments[::-1], checkpoints[::-1]):
+        end = min(hi + 1, t)
+        log_prob_segment, log_states, known_states = _segment_log_probs(lo, end)
+        log_alpha = _forward_segment(log_alpha_lo, log_prob_segment, lo, hi)
+        log_beta = np.zeros((end - lo, k))
+        if end > hi:
+            log_beta[-1, :] = log_beta_hi
+        for i in range(end - lo - 2, -1, -1):
+            log_beta[i, :] = logsumexp(log_prob_segment[i, :, :] +
+                                       (log_beta[i + 1, :] + log_Ey[lo + i + 1, :]), axis=1)
+        log_gamma = log_alpha + log_beta[:hi - lo] - log_likelihood
+        log_epsilon = (log_alpha[:end - lo - 1, :, np.newaxis] + log_prob_segment +
+                       (log_Ey[lo + 1:end] + log_beta[1:])[:, np.newaxis, :] - log_likelihood)
+        known_gamma = known_states[:hi - lo]
+        log_gamma[known_gamma] = log_states[:hi - lo][known_gamma]
+        known_pairs = known_states[:-1] & known_states[1:]
+        log_epsilon[known_pairs] = (log_states[:-1, :, np.newaxis] +
+                                    log_states[1:, np.newaxis, :])[known_pairs]
+        callback(lo, log_gamma, log_epsilon)
+        log_beta_hi = log_beta[0, :]
+    return log_likelihood
+
+
+def _checkpoint_segment_length(t, k, itemsize, max_memory=None):
+    """
+    The number of timestamps of each segment of forward_backward_checkpoint.
+    Parameters
+    ----------
+    t: the number of timestamps of the sequence
+    k: the number of states
+    itemsize: the number of bytes of each float
+    max_memory: approximate number of bytes the arrays of a segment may use, or None.
+    Returns
+    -------
+    segment: the number of timestamps of each segment
+    """
+    if max_memory is None:
+        return max(1, int(np.ceil(np.sqrt(t))))
+    # alpha, beta, gamma of k floats and transition, epsilon of k * k floats per timestamp
+    segment = int(max_memory // ((3 * k + 2 * k * k) * itemsize))
+    if segment < 1:
+        raise ValueError('max_memory is too small to hold one timestamp.')
+    return min(segment, t)
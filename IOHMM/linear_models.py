@@ -34,6 +34,18 @@ Note:
 2. For the GLM, statsmodels is not great when fitting with regularizations
    (espicially l1, and elstic_net). In this case the coefficients might be np.nan.
    Try not using regularizations if you select GLM until statsmodels is stable on this.
+
+3. sklearn only fits hard labels, so CrossEntropyMNL with l1 or elastic_net regularization
+   repeats each sample for each class. With l2 regularization (or none)
+   and the 'lbfgs' or 'newton-cg' solver, the cross entropy with the probability outputs
+   is minimized directly instead, with the same loss and solvers as sklearn.
+   The other solvers still use sklearn on the repeated samples.
+
+4. GLM without regularization and with the IRLS solver is fitted by the IRLS of this module,
+   with the same iterations as statsmodels, but without building a statsmodels model
+   and for the emission models of all the hidden states at once.
+   If it fails or does not converge, the model is fitted by statsmodels instead.
+   The other solvers and the regularized GLM still use statsmodels.
 '''
 
 # //TODO in future add arguments compatibility check
@@ -51,13 +63,15 @@ import os
 
 
 import numpy as np
+from scipy import optimize
+from scipy.special import expit
 from scipy.stats import multivariate_normal
 from sklearn import linear_model
 from sklearn.linear_model._base import _rescale_data
 from sklearn.preprocessing import label_binarize
 import statsmodels.api as sm
-from statsmodels.genmod.families import Poisson, Binomial
-from statsmodels.tools import add_constant
+from statsmodels.genmod.families import Poisson, Binomial, NegativeBinomial
+from statsmodels.tools.sm_exceptions import PerfectSeparationError
 standard_library.install_aliases()
 EPS = np.finfo(float).eps
 
@@ -78,7 +92,9 @@ class BaseModel(object):
                  alpha=0,
                  l1_ratio=0,
                  coef=None,
-                 stderr=None):
+                 stderr=None,
+                 dtype=np.float64,
+                 warm_start=False):
         """
         Constructor
         Parameters
@@ -94,6 +110,11 @@ class BaseModel(object):
         l1_ratio: if elastic_net, the l1 alpha ratio
         coef: the coefficients if loading from trained model
         stderr: the std.err of coefficients if loading from trained model
+        dtype: the floating point type of the design matrix and sample weights,
+               np.float64 (default) or np.float32.
+               Solvers that do not support np.float32 cast to np.float64 internally.
+        warm_start: boolean indicating whether fit starts the iterative solvers
+                    from the coefficients of the previous fit (or the loaded ones), if any.
         -------
         """
         self.solver = solver
@@ -106,6 +127,10 @@ class BaseModel(object):
         self.l1_ratio = l1_ratio
         self.coef = coef
         self.stderr = stderr
+        self.dtype = np.dtype(dtype)
+        self.warm_start = warm_start
+        # the number of iterations of the solver in the last fit, None for direct solvers
+        self.n_iter = None
 
     def fit(self, X, Y, sample_weight=None):
         """
@@ -119,6 +144,21 @@ class BaseModel(object):
         """
         raise NotImplementedError
 
+    def _warm_start_coef(self, shape):
+        """
+        The coefficients to start the solver from, see warm_start.
+        Parameters
+        ----------
+        shape: the shape of the coefficients the solver expects
+        Returns
+        -------
+        coef: the coefficients of the previous fit reshaped to shape,
+              None if not warm_start, not fitted yet or of a different size.
+        """
+        if not self.warm_start or self.coef is None or np.size(self.coef) != np.prod(shape):
+            return None
+        return np.reshape(self.coef, shape)
+
     def _raise_error_if_model_not_trained(self):
         """
         Raise error if the model is not trained (thus has coef)
@@ -145,8 +185,9 @@ class BaseModel(object):
         -------
         X : design matrix of shape (n_samples, n_features + 1) if fit intercept
         """
+        X = np.asarray(X, dtype=self.dtype)
         if self.fit_intercept:
-            X = add_constant(X, has_constant='add')
+            X = np.column_stack([np.ones(X.shape[0], dtype=self.dtype), X])
         return X
 
     def _transform_sample_weight(self, X, sample_weight=None):
@@ -160,9 +201,11 @@ class BaseModel(object):
         sample_weight: array of (n_samples, )
         """
         if sample_weight is None:
-            sample_weight = np.ones(X.shape[0])
+            sample_weight = np.ones(X.shape[0], dtype=self.dtype)
         elif isinstance(sample_weight, numbers.Number):
-            sample_weight = np.ones(X.shape[0]) * sample_weight
+            sample_weight = np.full(X.shape[0], sample_weight, dtype=self.dtype)
+        else:
+            sample_weight = np.asarray(sample_weight, dtype=self.dtype)
         assert X.shape[0] == sample_weight.shape[0]
         return sample_weight
 
@@ -337,7 +380,8 @@ class GLM(BaseModel):
                  l1_ratio=0,
                  coef=None,
                  stderr=None,
-                 dispersion=None):
+                 dispersion=None,
+                 dtype=np.float64, warm_start=False):
         """
         Constructor
         Parameters
@@ -357,19 +401,28 @@ class GLM(BaseModel):
 
         family: statsmodels.genmod.families.family.Family
         dispersion: dispersion/scale of the GLM
+        dtype: the floating point type of the design matrix and sample weights
+        warm_start: boolean indicating whether fit starts the iterative solvers
+                    from the coefficients of the previous fit, see BaseModel.
         -------
         """
         super(GLM, self).__init__(
             solver=solver, fit_intercept=fit_intercept, est_stderr=est_stderr,
             tol=tol, max_iter=max_iter,
             reg_method=reg_method, alpha=alpha, l1_ratio=l1_ratio,
-            coef=coef, stderr=stderr)
+            coef=coef, stderr=stderr, dtype=dtype, warm_start=warm_start)
         self.family = family
         self.dispersion = dispersion
-        if self.coef is not None:
-            dummy_X = dummy_Y = dummy_weight = np.zeros(1)
-            self._model = sm.GLM(dummy_Y, dummy_X, family=family,
-                                 freq_weights=dummy_weight)
+
+    def _is_irls(self):
+        """
+        Whether fit uses the IRLS of this module (see _fit_irls_batch),
+        rather than statsmodels: with the IRLS solver and without regularization.
+        Returns
+        -------
+        boolean
+        """
+        return self.solver.lower() == 'irls' and (self.reg_method is None or self.alpha < EPS)
 
     def fit(self, X, Y, sample_weight=None):
         """
@@ -379,6 +432,29 @@ class GLM(BaseModel):
         X : design matrix of shape (n_samples, n_features), 2d
         Y : response matrix of shape (n_samples, ) or (n_samples, k) depending on family
         sample_weight: sample weight vector of shape (n_samples, ), or float, or None
+        Notes
+        -------
+        With the IRLS solver and without regularization, the model is fitted by
+        the IRLS of this module (see _fit_irls_batch), and falls back to statsmodels
+        if it raises LinAlgError or does not converge in max_iter iterations.
+        Otherwise the model is fitted by statsmodels.
+        """
+        X, sample_weight = self._transform_X_sample_weight(X, sample_weight=sample_weight)
+        self._raise_error_if_sample_weight_sum_zero(sample_weight)
+        Y = self._transform_Y(Y)
+        if self._is_irls():
+            GLM._fit_irls([self], X, Y, sample_weight[np.newaxis])
+            return
+        self._fit_statsmodels(X, Y, sample_weight)
+
+    def _fit_statsmodels(self, X, Y, sample_weight):
+        """
+        Fit the weighted model by statsmodels, see fit.
+        Parameters
+        ----------
+        X : transformed design matrix of shape (n_samples, n_features), 2d
+        Y : transformed response matrix of shape (n_samples, ) or (n_samples, 2)
+        sample_weight: transformed sample weight vector of shape (n_samples, )
         """
         def _estimate_dispersion():
             """
@@ -409,24 +485,110 @@ class GLM(BaseModel):
                 return fit_results.bse * np.sqrt(self.dispersion / self._model.scale)
             return None
 
-        X, sample_weight = self._transform_X_sample_weight(X, sample_weight=sample_weight)
-        self._raise_error_if_sample_weight_sum_zero(sample_weight)
-        Y = self._transform_Y(Y)
         self._model = sm.GLM(Y, X, family=self.family, freq_weights=sample_weight)
         # dof in weighted regression does not make sense, hard code it to the total weights
         self._model.df_resid = np.sum(sample_weight)
+        start_params = self._warm_start_coef((X.shape[1], ))
         if self.reg_method is None or self.alpha < EPS:
             fit_results = self._model.fit(
+                start_params=start_params,
                 maxiter=self.max_iter, tol=self.tol, method=self.solver, wls_method='pinv')
         else:
             fit_results = self._model.fit_regularized(
-                method=self.reg_method, alpha=self.alpha,
+                method=self.reg_method, alpha=self.alpha, start_params=start_params,
                 L1_wt=self.l1_ratio, maxiter=self.max_iter)
         self.coef = fit_results.params
+        if hasattr(fit_results, 'fit_history'):
+            self.n_iter = fit_results.fit_history['iteration']
+        else:
+            self.n_iter = (getattr(fit_results, 'mle_retvals', None) or {}).get('iterations')
         self.dispersion = _estimate_dispersion()
         if self.est_stderr:
             self.stderr = _estimate_stderr()
 
+    @staticmethod
+    def _fit_irls(models, X, Y, sample_weights):
+        """
+        Fit GLM models by the IRLS of this module, see fit and fit_batch.
+        Parameters
+        ----------
+        models: list of k GLM models with the same family and solver parameters
+        X : transformed design matrix of shape (n_samples, n_features), 2d
+        Y : transformed response matrix of shape (n_samples, ) or (n_samples, 2)
+        sample_weights: sample weight matrix of shape (k, n_samples), one row for each model.
+        Notes
+        -------
+        The models whose IRLS does not converge in max_iter iterations,
+        or all of them if it raises LinAlgError, are fitted by statsmodels instead.
+        """
+        model = models[0]
+        try:
+            coef, scale, weights, n_iter, converged = _fit_irls_batch(
+                X, Y, sample_weights, model.family, model.tol, model.max_iter,
+                start_params=[m._warm_start_coef((X.shape[1], )) for m in models])
+        except np.linalg.LinAlgError:
+            converged = np.zeros(len(models), dtype=bool)
+        for s, model in enumerate(models):
+            if not converged[s]:
+                logging.warning('IRLS did not converge, fitting the GLM by statsmodels instead.')
+                model._fit_statsmodels(X, Y, sample_weights[s])
+                continue
+            model.coef = coef[s]
+            model.n_iter = int(n_iter[s])
+            if isinstance(model.family, (Binomial, Poisson)):
+                model.dispersion = 1.
+            else:
+                model.dispersion = scale[s]
+            if model.est_stderr:
+                # the normalized covariance is the pseudo-inverse of X^T diag(weights) X,
+                # see _estimate_stderr in fit
+                pinv_wexog = np.linalg.pinv(np.sqrt(weights[s])[:, np.newaxis] * X)
+                model.stderr = np.sqrt(np.sum(pinv_wexog ** 2, axis=1) * model.dispersion)
+
+    @staticmethod
+    def can_fit_batch(models):
+        """
+        Whether some GLM models can be fitted together by fit_batch:
+        they are all GLM with the IRLS solver and without regularization,
+        with the same family, fit_intercept, tol, max_iter and dtype.
+        Parameters
+        ----------
+        models: list of linear models
+        Returns
+        -------
+        boolean
+        """
+        def _parameters(model):
+            family = model.family
+            return (type(family), type(family.link), getattr(family, 'alpha', None),
+                    getattr(family, 'var_power', None),
+                    model.fit_intercept, model.tol, model.max_iter, model.dtype)
+
+        return all(type(model) is GLM and model._is_irls() and
+                   _parameters(model) == _parameters(models[0]) for model in models)
+
+    @staticmethod
+    def fit_batch(models, X, Y, sample_weights):
+        """
+        Fit several GLM models on the same X and Y with different sample weights,
+        such as the emission models of all the hidden states,
+        the same as calling fit of each model but with a single pass over the data
+        in each iteration of IRLS.
+        Parameters
+        ----------
+        models: list of k GLM models, see can_fit_batch.
+        X : design matrix of shape (n_samples, n_features), 2d
+        Y : response matrix of shape (n_samples, ) or (n_samples, k) depending on family
+        sample_weights: sample weight matrix of shape (k, n_samples), one row for each model.
+        """
+        assert GLM.can_fit_batch(models)
+        X_train = models[0]._transform_X(X)
+        sample_weights = np.asarray(sample_weights, dtype=models[0].dtype)
+        assert sample_weights.shape == (len(models), X_train.shape[0])
+        for model, sample_weight in zip(models, sample_weights):
+            model._raise_error_if_sample_weight_sum_zero(sample_weight)
+        GLM._fit_irls(models, X_train, models[0]._transform_Y(Y), sample_weights)
+
     def _transform_Y(self, Y):
         """
         Transform the response Y
@@ -451,7 +613,7 @@ class GLM(BaseModel):
         """
         self._raise_error_if_model_not_trained()
         X = self._transform_X(X)
-        return self._model.predict(self.coef, exog=X)
+        return self.family.fitted(X.dot(self.coef))
 
     def loglike_per_sample(self, X, Y):
         """
@@ -549,7 +711,8 @@ class OLS(BaseModel):
 
     def __init__(self, solver='svd', fit_intercept=True, est_stderr=False,
                  reg_method=None,  alpha=0, l1_ratio=0, tol=1e-4, max_iter=100,
-                 coef=None, stderr=None,  dispersion=None, n_targets=None):
+                 coef=None, stderr=None,  dispersion=None, n_targets=None,
+                 dtype=np.float64, warm_start=False):
         """
         Constructor
         Parameters
@@ -569,13 +732,16 @@ class OLS(BaseModel):
 
         n_targets: the number of dependent variables
         dispersion: dispersion/scale mareix of the OLS
+        dtype: the floating point type of the design matrix and sample weights
+        warm_start: boolean indicating whether fit starts the iterative solvers
+                    from the coefficients of the previous fit, see BaseModel.
         -------
         """
         super(OLS, self).__init__(
             solver=solver, fit_intercept=fit_intercept, est_stderr=est_stderr,
             tol=tol, max_iter=max_iter,
             reg_method=reg_method, alpha=alpha, l1_ratio=l1_ratio,
-            coef=coef, stderr=stderr)
+            coef=coef, stderr=stderr, dtype=dtype, warm_start=warm_start)
         self.dispersion = dispersion
         self.n_targets = n_targets
         self._pick_model()
@@ -664,12 +830,67 @@ class OLS(BaseModel):
         self._raise_error_if_sample_weight_sum_zero(sample_weight)
         Y = self._transform_Y(Y)
         self.n_targets = Y.shape[1]
+        if isinstance(self._model, linear_model.ElasticNet):
+            # Lasso and ElasticNet start from the coef_ of the previous fit of self._model
+            self._model.warm_start = self._warm_start_coef(
+                (Y.shape[1], X_train.shape[1])) is not None
         self._model.fit(X_train, Y, sample_weight)
         self.coef = self._model.coef_
+        n_iter = getattr(self._model, 'n_iter_', None)
+        self.n_iter = None if n_iter is None else int(np.sum(n_iter))
         self.dispersion = _estimate_dispersion()
         if self.est_stderr:
             self.stderr = _estimate_stderr()
 
+    @staticmethod
+    def can_fit_batch(models):
+        """
+        Whether some OLS models can be fitted together by fit_batch:
+        they are all OLS without regularization,
+        with the same fit_intercept and dtype.
+        Parameters
+        ----------
+        models: list of linear models
+        Returns
+        -------
+        boolean
+        """
+        return all(type(model) is OLS and (model.reg_method is None or model.alpha < EPS) and
+                   model.fit_intercept == models[0].fit_intercept and
+                   model.dtype == models[0].dtype for model in models)
+
+    @staticmethod
+    def fit_batch(models, X, Y, sample_weights):
+        """
+        Fit several OLS models on the same X and Y with different sample weights,
+        such as the emission models of all the hidden states,
+        the same as calling fit of each model but with a single pass over the data.
+        Parameters
+        ----------
+        models: list of k OLS models, see can_fit_batch.
+        X : design matrix of shape (n_samples, n_features), 2d
+        Y : response matrix of shape (n_samples, n_targets), 2d
+        sample_weights: sample weight matrix of shape (k, n_samples), one row for each model.
+        """
+        assert OLS.can_fit_batch(models)
+        X_train = models[0]._transform_X(X)
+        sample_weights = np.asarray(sample_weights, dtype=models[0].dtype)
+        assert sample_weights.shape == (len(models), X_train.shape[0])
+        for model, sample_weight in zip(models, sample_weights):
+            model._raise_error_if_sample_weight_sum_zero(sample_weight)
+        Y = np.asarray(models[0]._transform_Y(Y), dtype=X_train.dtype)
+        coef, dispersion, stderr = _fit_weighted_least_squares_batch(
+            X_train, Y, sample_weights, est_stderr=any(model.est_stderr for model in models))
+        for s, model in enumerate(models):
+            model.n_targets = Y.shape[1]
+            model.n_iter = None
+            model.coef = coef[s]
+            model._model.coef_ = coef[s]
+            model._model.intercept_ = 0
+            model.dispersion = dispersion[s]
+            if model.est_stderr:
+                model.stderr = stderr[s]
+
     def _transform_Y(self, Y):
         """
         Transform the response Y
@@ -797,6 +1018,433 @@ class OLS(BaseModel):
                    n_targets=json_dict['properties']['n_targets'])
 
 
+def _solve_normal_equations_batch(XWX, XWY, max_cond=None):
+    """
+    Solve a batch of normal equations XWX_s coef_s = XWY_s by Cholesky decomposition.
+    Parameters
+    ----------
+    XWX: array of shape (k, n_features, n_features), symmetric positive semi-definite
+    XWY: array of shape (k, n_features, n_targets)
+    max_cond: the largest condition number of a regular XWX_s, estimated by
+              the ratio of the largest to the smallest squared pivot of its Cholesky factor,
+              without another factorization. Default 1 / (n_features * EPS).
+    Returns
+    -------
+    coef: array of shape (k, n_features, n_targets),
+          unset where XWX_s is not regular, left to the caller.
+    regular: boolean array of shape (k, ), whether XWX_s is regular (not nearly singular)
+    """
+    k, n_features = XWX.shape[:2]
+    if max_cond is None:
+        max_cond = 1 / (n_features * EPS)
+    try:
+        L = np.linalg.cholesky(XWX)
+        pivots = np.diagonal(L, axis1=1, axis2=2) ** 2
+        regular = pivots.min(axis=1) * max_cond > pivots.max(axis=1)
+    except np.linalg.LinAlgError:
+        L, regular = None, np.zeros(k, dtype=bool)
+    coef = np.empty(XWY.shape, dtype=XWY.dtype)
+    if regular.any():
+        L_regular = L[regular]
+        coef[regular] = np.linalg.solve(np.swapaxes(L_regular, 1, 2),
+                                        np.linalg.solve(L_regular, XWY[regular]))
+    return coef, regular
+
+
+def _fit_weighted_least_squares_batch(X, Y, sample_weights, est_stderr=False):
+    """
+    Weighted least squares of the same design matrix and response
+    with several sample weights, by the normal equations.
+    X^T diag(w_s) X and X^T diag(w_s) Y of all the sample weights are calculated
+    in one pass over the data, and solved by Cholesky decomposition,
+    or by pseudo-inverse if X^T diag(w_s) X is singular (or nearly).
+    Parameters
+    ----------
+    X : design matrix of shape (n_samples, n_features), 2d
+    Y : response matrix of shape (n_samples, n_targets), 2d
+    sample_weights: sample weight matrix of shape (k, n_samples)
+    est_stderr: boolean indicating calculte std.err of coefficients or not
+    Returns
+    -------
+    coef: array of shape (k, n_targets, n_features)
+    dispersion: array of shape (k, n_targets, n_targets),
+                the weighted covariance of the residuals, see OLS.fit.
+    stderr: array of shape (k, n_targets, n_features), see OLS.fit.
+            None for a singular X^T diag(w_s) X, or if not est_stderr.
+    """
+    k = sample_weights.shape[0]
+    XWX = np.einsum('sn,ni,nj->sij', sample_weights, X, X, optimize=True)
+    XWY = np.einsum('sn,ni,nt->sit', sample_weights, X, Y, optimize=True)
+    coef, regular = _solve_normal_equations_batch(XWX, XWY)
+    for s in np.flatnonzero(~regular):
+        coef[s] = np.linalg.pinv(XWX[s]).dot(XWY[s])
+    coef = np.swapaxes(coef, 1, 2)
+    resid = Y - np.einsum('ni,sti->snt', X, coef, optimize=True)
+    dispersion = np.einsum('sn,snt,snu->stu', sample_weights, resid, resid,
+                           optimize=True) / sample_weights.sum(axis=1)[:, np.newaxis, np.newaxis]
+    stderr = [None] * k
+    if est_stderr:
+        XW2X = np.einsum('sn,ni,nj->sij', sample_weights ** 2, X, X, optimize=True)
+        for s in range(k):
+            if not regular[s]:
+                logging.warning('Covariance matrix is singular, cannot estimate stderr.')
+                continue
+            XWX_inverse = np.linalg.inv(XWX[s])
+            stderr[s] = np.sqrt(np.outer(np.diag(dispersion[s]),
+                                         np.diag(XWX_inverse.dot(XW2X[s]).dot(XWX_inverse))))
+    return coef, dispersion, stderr
+
+
+def _fit_irls_batch(X, Y, sample_weights, family, tol, max_iter, start_params=None):
+    """
+    Iteratively reweighted least squares (IRLS) of a generalized linear model
+    with the same design matrix and response and several frequency weights,
+    the same iterations as statsmodels GLM.fit(method='IRLS'),
+    with the residual degrees of freedom set to the total weights (see GLM.fit).
+    Each iteration solves the weighted least squares of all the sample weights
+    in one pass over the data (see _fit_weighted_least_squares_batch),
+    the sample weights whose deviance has converged are not iterated anymore.
+    Parameters
+    ----------
+    X : design matrix of shape (n_samples, n_features), 2d
+    Y : response matrix of shape (n_samples, ) or (n_samples, 2) depending on family
+    sample_weights: sample weight matrix of shape (k, n_samples)
+    family: statsmodels.genmod.families.family.Family
+    tol: tolerence of the change of the deviance
+    max_iter: maximum iteraration of fitting
+    start_params: None, or a list of k start coefficients of shape (n_features, ) or None
+    Returns
+    -------
+    coef: array of shape (k, n_features)
+    scale: array of shape (k, ), the scale of the GLM, see statsmodels GLM.estimate_scale.
+    weights: array of shape (k, n_samples), the weights of the last least squares,
+             the inverse of X^T diag(weights_s) X is the normalized covariance of coef_s.
+    n_iter: array of shape (k, ), the number of iterations of each sample weight
+    converged: boolean array of shape (k, ), whether the deviance of each sample weight
+               converged within max_iter iterations
+    """
+    k, n_features = sample_weights.shape[0], X.shape[1]
+    if isinstance(family, Binomial):
+        endog, n_trials = family.initialize(Y, 1.0)
+    else:
+        endog, n_trials = Y, 1.
+    endog = np.asarray(endog, dtype=X.dtype)
+    coef = np.zeros((k, n_features), dtype=X.dtype)
+    mu = np.empty((k, X.shape[0]), dtype=X.dtype)
+    mu[...] = family.starting_mu(endog)
+    lin_pred = family.predict(mu)
+    for s, start in enumerate(start_params or []):
+        if start is not None:
+            coef[s] = start
+            lin_pred[s] = X.dot(start)
+            mu[s] = family.fitted(lin_pred[s])
+
+    def _scale(mu, sample_weights):
+        if isinstance(family, (Binomial, Poisson, NegativeBinomial)):
+            return np.ones(mu.shape[0])
+        return np.sum(sample_weights * (endog - mu) ** 2 / family.variance(mu),
+                      axis=1) / sample_weights.sum(axis=1)
+
+    def _deviance(mu, sample_weights, scale):
+        return np.sum(family.resid_dev(endog, mu, sample_weights, scale[:, np.newaxis]) ** 2,
+                      axis=1)
+
+    scale = _scale(mu, sample_weights)
+    deviance = _deviance(mu, sample_weights, scale)
+    weights = np.empty((k, X.shape[0]), dtype=X.dtype)
+    n_iter = np.zeros(k, dtype=int)
+    converged = np.zeros(k, dtype=bool)
+    active = np.arange(k)
+    for _ in range(max_iter):
+        w = sample_weights[active] * n_trials * family.weights(mu[active])
+        z = lin_pred[active] + family.link.deriv(mu[active]) * (endog - mu[active])
+        XW = np.swapaxes(w[:, :, np.newaxis] * X, 1, 2)
+        XWX = np.matmul(XW, X)
+        # the normal equations square the condition number of the least squares
+        coef_active, regular = _solve_normal_equations_batch(
+            XWX, np.matmul(XW, z[:, :, np.newaxis]), max_cond=1 / np.sqrt(EPS))
+        coef_active = coef_active[:, :, 0]
+        for s in np.flatnonzero(~regular):
+            # the minimum norm least squares, as the pseudo-inverse of statsmodels
+            sqrt_w = np.sqrt(w[s])
+            coef_active[s] = np.linalg.lstsq(sqrt_w[:, np.newaxis] * X, sqrt_w * z[s],
+                                             rcond=None)[0]
+        coef[active] = coef_active
+        weights[active] = w
+        lin_pred[active] = coef_active.dot(X.T)
+        mu[active] = family.fitted(lin_pred[active])
+        # the deviance is scaled by the scale of the previous iteration, as in statsmodels
+        deviance_active = _deviance(mu[active], sample_weights[active], scale[active])
+        scale[active] = _scale(mu[active], sample_weights[active])
+        if endog.squeeze().ndim == 1 and any(np.allclose(mu[s] - endog, 0) for s in active):
+            raise PerfectSeparationError('Perfect separation detected, results not available')
+        n_iter[active] += 1
+        converged_active = np.abs(deviance[active] - deviance_active) <= tol
+        deviance[active] = deviance_active
+        converged[active[converged_active]] = True
+        active = active[~converged_active]
+        if active.shape[0] == 0:
+            break
+    return coef, scale, weights, n_iter, converged
+
+
+def _soft_mnl_decision(w, X, n_models, n_classes):
+    """
+    The decision function of several multinomial logistic regressions (without intercept)
+    on the same design matrix, with a single product with X.
+    Parameters
+    ----------
+    w: the flattened coefficients of all the models,
+       of shape (n_models * n_features, ) for two classes
+       (the log odds of the second class, as in sklearn),
+       else (n_models * n_classes * n_features, ).
+    X : design matrix of shape (n_samples, n_features), 2d
+    n_models: the number of models
+    n_classes: the number of classes of each model
+    Returns
+    -------
+    z: array of shape (n_samples, n_models, 1) for two classes,
+       else (n_samples, n_models, n_classes).
+    """
+    n_rows = 1 if n_classes == 2 else n_classes
+    z = X.dot(w.reshape(n_models * n_rows, X.shape[1]).T)
+    return z.reshape(X.shape[0], n_models, n_rows)
+
+
+def _log_softmax(z):
+    """
+    The log probabilities and the probabilities of a multinomial logistic regression
+    given its decision function, with a single exponentiation.
+    Parameters
+    ----------
+    z: array of shape (..., n_classes), overwritten.
+    Returns
+    -------
+    log_p: array of shape (..., n_classes)
+    p: array of shape (..., n_classes)
+    """
+    z -= z.max(axis=-1, keepdims=True)
+    p = np.exp(z)
+    norm = p.sum(axis=-1, keepdims=True)
+    p /= norm
+    z -= np.log(norm)
+    return z, p
+
+
+def _soft_mnl_gradient(residual, X):
+    """
+    The gradient of the loss of several multinomial logistic regressions
+    on the same design matrix, with a single product with X.
+    Parameters
+    ----------
+    residual: the derivative of the loss by the decision function,
+              of the shape of _soft_mnl_decision
+    X : design matrix of shape (n_samples, n_features), 2d
+    Returns
+    -------
+    grad: the flattened gradient of the coefficients, see _soft_mnl_decision
+    """
+    n_samples, n_models, n_rows = residual.shape
+    return residual.reshape(n_samples, n_models * n_rows).T.dot(X).ravel()
+
+
+def _soft_mnl_loss_grad(w, X, Y, sample_weight, alpha):
+    """
+    The weighted cross entropy of several multinomial logistic regressions
+    (without intercept) on the same design matrix with probability targets,
+    plus the l2 penalty, and its gradient.
+    For each model, it is the loss of sklearn LogisticRegression with C = 1 / alpha
+    on the samples repeated for each class, see CrossEntropyMNL._label_encoder.
+    The loss of the models is summed.
+    Parameters
+    ----------
+    w: the flattened coefficients of all the models, see _soft_mnl_decision
+    X : design matrix of shape (n_samples, n_features), 2d
+    Y : response matrix of shape (n_samples, n_models, n_classes),
+        the target probabilities (the rows need not sum to one).
+    sample_weight: sample weight matrix of shape (n_samples, n_models)
+    alpha: the l2 regularization strength
+    Returns
+    -------
+    loss: float
+    grad: the gradient of the loss, of the shape of w
+    """
+    _, n_models, n_classes = Y.shape
+    z = _soft_mnl_decision(w, X, n_models, n_classes)
+    if n_classes == 2:
+        z = z[:, :, 0]
+        loss = np.sum(sample_weight * (Y[:, :, 1] * np.logaddexp(0, -z) +
+                                       Y[:, :, 0] * np.logaddexp(0, z)))
+        residual = (sample_weight * (Y.sum(axis=2) * expit(z) - Y[:, :, 1]))[:, :, np.newaxis]
+    else:
+        log_p, p = _log_softmax(z)
+        weighted_Y = sample_weight[:, :, np.newaxis] * Y
+        loss = -np.sum(weighted_Y * log_p)
+        residual = weighted_Y.sum(axis=2, keepdims=True) * p - weighted_Y
+    return loss + .5 * alpha * w.dot(w), _soft_mnl_gradient(residual, X) + alpha * w
+
+
+def _soft_mnl_hessp(w, v, X, Y, sample_weight, alpha):
+    """
+    The product of the hessian of the loss of _soft_mnl_loss_grad with a vector.
+    Parameters
+    ----------
+    w: the flattened coefficients, see _soft_mnl_decision
+    v: the vector, of the shape of w
+    X, Y, sample_weight, alpha: see _soft_mnl_loss_grad
+    Returns
+    -------
+    hessp: the product, of the shape of w
+    """
+    _, n_models, n_classes = Y.shape
+    weight = (sample_weight * Y.sum(axis=2))[:, :, np.newaxis]
+    z = _soft_mnl_decision(w, X, n_models, n_classes)
+    zv = _soft_mnl_decision(v, X, n_models, n_classes)
+    if n_classes == 2:
+        p = expit(z)
+        residual = weight * p * (1 - p) * zv
+    else:
+        p = _log_softmax(z)[1]
+        residual = weight * p * (zv - np.sum(p * zv, axis=2, keepdims=True))
+    return _soft_mnl_gradient(residual, X) + alpha * v
+
+
+def _conjugate_gradient(hessp, grad, max_iter, tol):
+    """
+    Solve the Newton system hessp(p) = -grad approximately by conjugate gradient,
+    stopped when the l1 norm of the residual is below tol,
+    or at a direction of non-positive curvature.
+    Parameters
+    ----------
+    hessp: callable, the product of the Hessian with a vector
+    grad: the gradient, array of shape (n_params, )
+    max_iter: the maximum number of iterations
+    tol: the tolerance of the l1 norm of the residual
+    Returns
+    -------
+    p: array of shape (n_params, ), the Newton direction
+    """
+    p = np.zeros(grad.shape[0], dtype=grad.dtype)
+    residual = grad
+    direction = -residual
+    residual_norm = np.dot(residual, residual)
+    for i in range(max_iter + 1):
+        if np.sum(np.abs(residual)) <= tol:
+            break
+        hess_direction = hessp(direction)
+        curvature = np.dot(direction, hess_direction)
+        if 0 <= curvature <= 3 * EPS:
+            break
+        if curvature < 0:
+            if i == 0:
+                p += residual_norm / curvature * direction
+            break
+        step = residual_norm / curvature
+        p += step * direction
+        residual = residual + step * hess_direction
+        residual_norm_next = np.dot(residual, residual)
+        direction = -residual + residual_norm_next / residual_norm * direction
+        residual_norm = residual_norm_next
+    return p
+
+
+def _newton_cg(loss_grad, hessp, w0, args, tol, max_iter, max_inner=200):
+    """
+    Minimize a function by truncated Newton steps,
+    solved by conjugate gradient (see _conjugate_gradient) and followed by a Wolfe line search,
+    until the largest absolute value of the gradient is below tol,
+    the same iterations as the Newton-CG solver of sklearn LogisticRegression.
+    Parameters
+    ----------
+    loss_grad: callable (w, *args) -> (loss, gradient)
+    hessp: callable (w, v, *args) -> the product of the Hessian at w with v
+    w0: the start parameters, array of shape (n_params, )
+    args: the extra arguments of loss_grad and hessp
+    tol: the tolerance of the largest absolute value of the gradient
+    max_iter: the maximum number of Newton steps
+    max_inner: the maximum number of conjugate gradient iterations of a Newton step
+    Returns
+    -------
+    w: array of shape (n_params, ), the minimizer
+    n_iter: the number of Newton steps
+    """
+    # the line search asks for the loss and the gradient separately, at the same points
+    cache = {}
+
+    def _loss_grad(w):
+        if 'w' not in cache or not np.array_equal(cache['w'], w):
+            cache['w'], cache['loss_grad'] = w.copy(), loss_grad(w, *args)
+        return cache['loss_grad']
+
+    w = np.asarray(w0, dtype=np.float64).ravel()
+    loss, loss_prev = _loss_grad(w)[0], None
+    n_iter = 0
+    while n_iter < max_iter:
+        grad = _loss_grad(w)[1]
+        abs_grad = np.abs(grad)
+        if np.max(abs_grad) <= tol:
+            break
+        grad_l1 = np.sum(abs_grad)
+        direction = _conjugate_gradient(lambda v: hessp(w, v, *args), grad, max_inner,
+                                        min(0.5, np.sqrt(grad_l1)) * grad_l1)
+        step, _, _, loss, loss_prev, _ = optimize.line_search(
+            lambda w: _loss_grad(w)[0], lambda w: _loss_grad(w)[1], w, direction, grad,
+            loss, loss_prev)
+        if step is None:
+            logging.warning('newton-cg line search failed.')
+            break
+        w = w + step * direction
+        n_iter += 1
+    if n_iter >= max_iter:
+        logging.warning('newton-cg failed to converge, increase the number of iterations.')
+    return w, n_iter
+
+
+def _fit_soft_mnl(X, Y, sample_weight, alpha, solver, tol, max_iter, coef_init=None):
+    """
+    Fit several multinomial logistic regressions with probability targets
+    on the same design matrix, as a single optimization of their summed loss,
+    by L-BFGS, or by Newton-CG if solver is 'newton-cg' (see _newton_cg),
+    the same way as sklearn LogisticRegression with these solvers.
+    Each iteration goes over X once for all the models.
+    Parameters
+    ----------
+    X : design matrix of shape (n_samples, n_features), 2d
+    Y : response matrix of shape (n_models, n_samples, n_classes), n_classes >= 2
+    sample_weight: sample weight matrix of shape (n_models, n_samples)
+    alpha: the l2 regularization strength
+    solver: 'newton-cg' or 'lbfgs'.
+    tol: the tolerance of the gradient
+    max_iter: the maximum number of iterations
+    coef_init: None or the coefficients to start from, of the shape of coef.
+    Returns
+    -------
+    coef: array of shape (n_models, 1, n_features) for two classes,
+          else (n_models, n_classes, n_features),
+          the coef_ of sklearn LogisticRegression of each model.
+    n_iter: the number of iterations of the solver
+    """
+    n_models, _, n_classes = Y.shape
+    n_features = X.shape[1]
+    if coef_init is None:
+        w0 = np.zeros(n_models * (1 if n_classes == 2 else n_classes) * n_features)
+    else:
+        w0 = np.asarray(coef_init, dtype=np.float64).ravel()
+    # the samples first, so that the decision function of all the models is a single product
+    args = (X, np.ascontiguousarray(np.swapaxes(Y, 0, 1)), np.ascontiguousarray(sample_weight.T),
+            alpha)
+    assert solver in ('lbfgs', 'newton-cg')
+    if solver == 'newton-cg':
+        w, n_iter = _newton_cg(_soft_mnl_loss_grad, _soft_mnl_hessp, w0, args, tol, max_iter)
+    else:
+        result = optimize.minimize(_soft_mnl_loss_grad, w0, args=args, method='L-BFGS-B',
+                                   jac=True, options={'gtol': tol, 'maxiter': max_iter})
+        if not result.success:
+            logging.warning('lbfgs failed to converge: {}'.format(result.message))
+        w, n_iter = result.x, result.nit
+    return w.reshape(n_models, -1, n_features).astype(X.dtype), n_iter
+
+
 class BaseMNL(BaseModel):
     """
     A Base Multinomial Logistic regression model.
@@ -809,7 +1457,7 @@ class BaseMNL(BaseModel):
                  reg_method='l2', alpha=0, l1_ratio=0,
                  tol=1e-4, max_iter=100,
                  coef=None, stderr=None,
-                 classes=None, n_classes=None):
+                 classes=None, n_classes=None, dtype=np.float64, warm_start=False):
         """
         Constructor
         Parameters
@@ -830,13 +1478,16 @@ class BaseMNL(BaseModel):
 
         classes: an array of class labels
         n_classes: the number of classes to be classified
+        dtype: the floating point type of the design matrix and sample weights
+        warm_start: boolean indicating whether fit starts the iterative solvers
+                    from the coefficients of the previous fit, see BaseModel.
         -------
         """
         super(BaseMNL, self).__init__(
             solver=solver, fit_intercept=fit_intercept, est_stderr=est_stderr,
             tol=tol, max_iter=max_iter,
             reg_method=reg_method, alpha=alpha, l1_ratio=l1_ratio,
-            coef=coef, stderr=stderr)
+            coef=coef, stderr=stderr, dtype=dtype, warm_start=warm_start)
 
         self.classes = classes
         self.n_classes = n_classes
@@ -857,14 +1508,15 @@ class BaseMNL(BaseModel):
             # perform logistic regression
             self._model = linear_model.LogisticRegression(
                 fit_intercept=False, penalty=self.reg_method, C=C,
-                solver=self.solver, tol=self.tol, max_iter=self.max_iter)
+                solver=self.solver, tol=self.tol, max_iter=self.max_iter,
+                warm_start=self.warm_start)
 
         else:
             # perform multinomial logistic regression
             self._model = linear_model.LogisticRegression(
                 fit_intercept=False, penalty=self.reg_method, C=C,
                 solver=self.solver, tol=self.tol, max_iter=self.max_iter,
-                multi_class='multinomial')
+                multi_class='multinomial', warm_start=self.warm_start)
 
     def fit(self, X, Y, sample_weight=None):
         """
@@ -915,12 +1567,19 @@ class BaseMNL(BaseModel):
             # self.coef is a all zeros array of shape (n_features,1)
             self.coef = np.zeros((X.shape[1], 1))
             self.classes = classes
+            self.n_iter = None
         else:
             self._pick_model()
+            coef_init = self._warm_start_coef(
+                (1 if self.n_classes == 2 else self.n_classes, X.shape[1]))
+            if coef_init is not None and np.array_equal(classes, self.classes):
+                # sklearn starts from coef_
+                self._model.coef_ = coef_init
             self._model.fit(X, Y, sample_weight=sample_weight)
             # self.coef shape is wierd in sklearn, I will stick with it
             self.coef = self._model.coef_
             self.classes = self._model.classes_
+            self.n_iter = int(np.sum(self._model.n_iter_))
             if self.est_stderr:
                 self.stderr = _estimate_stderr()
 
@@ -973,7 +1632,7 @@ class BaseMNL(BaseModel):
         self._raise_error_if_model_not_trained()
         X = self._transform_X(X)
         if self.n_classes == 1:
-            return np.zeros((X.shape[0], 1))
+            return np.zeros((X.shape[0], 1), dtype=self.dtype)
 
         return self._model.predict_log_proba(X)
 
@@ -1083,7 +1742,7 @@ class DiscreteMNL(BaseMNL):
                  reg_method='l2', alpha=0, l1_ratio=0,
                  tol=1e-4, max_iter=100,
                  coef=None, stderr=None,
-                 classes=None):
+                 classes=None, dtype=np.float64, warm_start=False):
         """
         Constructor
         Parameters
@@ -1103,6 +1762,9 @@ class DiscreteMNL(BaseMNL):
         stderr: the std.err of coefficients if loading from trained model
 
         classes: class labels if loading from trained model
+        dtype: the floating point type of the design matrix and sample weights
+        warm_start: boolean indicating whether fit starts the iterative solvers
+                    from the coefficients of the previous fit, see BaseModel.
         -------
         """
         n_classes = None if classes is None else classes.shape[0]
@@ -1111,7 +1773,7 @@ class DiscreteMNL(BaseMNL):
             reg_method=reg_method, alpha=alpha, l1_ratio=l1_ratio,
             tol=tol, max_iter=max_iter,
             coef=coef, stderr=stderr,
-            classes=classes, n_classes=n_classes)
+            classes=classes, n_classes=n_classes, dtype=dtype, warm_start=warm_start)
 
     @staticmethod
     def _label_encoder(X, Y, sample_weight):
@@ -1224,7 +1886,7 @@ class CrossEntropyMNL(BaseMNL):
                  reg_method='l2', alpha=0, l1_ratio=0,
                  tol=1e-4, max_iter=100,
                  coef=None, stderr=None,
-                 n_classes=None):
+                 n_classes=None, dtype=np.float64, warm_start=False):
         """
         Constructor
         Parameters
@@ -1244,6 +1906,9 @@ class CrossEntropyMNL(BaseMNL):
         stderr: the std.err of coefficients if loading from trained model
 
         n_classes: number of classes to be classified
+        dtype: the floating point type of the design matrix and sample weights
+        warm_start: boolean indicating whether fit starts the iterative solvers
+                    from the coefficients of the previous fit, see BaseModel.
         -------
         """
         classes = None if n_classes is None else np.arange(n_classes)
@@ -1252,13 +1917,145 @@ class CrossEntropyMNL(BaseMNL):
             reg_method=reg_method, alpha=alpha, l1_ratio=l1_ratio,
             tol=tol, max_iter=max_iter,
             coef=coef, stderr=stderr,
-            classes=classes, n_classes=n_classes)
+            classes=classes, n_classes=n_classes, dtype=dtype, warm_start=warm_start)
+
+    def fit(self, X, Y, sample_weight=None):
+        """
+        Fit the weighted model
+        With l2 regularization or none and the 'lbfgs' or 'newton-cg' solver,
+        the cross entropy with the probability targets is minimized directly on X and Y
+        (see _fit_soft_mnl), giving the same coefficients as sklearn on the repeated samples.
+        With other regularizations or solvers, sklearn is fitted on the repeated samples,
+        see _label_encoder.
+        Parameters
+        ----------
+        X : design matrix of shape (n_samples, n_features), 2d
+        Y : response matrix of shape (n_samples, n_classes)
+        sample_weight: sample weight vector of shape (n_samples, ), or float, or None
+        """
+        if not self._is_soft():
+            return super(CrossEntropyMNL, self).fit(X, Y, sample_weight=sample_weight)
+        X, sample_weight = self._transform_X_sample_weight(X, sample_weight=sample_weight)
+        self._raise_error_if_sample_weight_sum_zero(sample_weight)
+        Y = np.asarray(Y, dtype=X.dtype)
+        assert Y.ndim == 2
+        assert Y.shape[0] == X.shape[0]
+        self.n_classes = Y.shape[1]
+        self.classes = np.arange(self.n_classes)
+        if self.n_classes == 1:
+            # no need to perform any model, see BaseMNL.fit
+            self.coef = np.zeros((X.shape[1], 1))
+            self.n_iter = None
+            return
+        alpha = self.alpha if self.reg_method == 'l2' else 0
+        coef_init = self._warm_start_coef(
+            (1, 1 if self.n_classes == 2 else self.n_classes, X.shape[1]))
+        coef, self.n_iter = _fit_soft_mnl(X, Y[np.newaxis], sample_weight[np.newaxis], alpha,
+                                          self.solver, self.tol, self.max_iter, coef_init)
+        self._set_coef(coef[0])
+
+    def _is_soft(self):
+        """
+        Whether fit minimizes the cross entropy with the probability targets directly,
+        rather than fitting sklearn on the repeated samples, see fit.
+        Returns
+        -------
+        boolean
+        """
+        return self.reg_method in (None, 'none', 'l2') and self.solver in ('lbfgs', 'newton-cg')
+
+    @staticmethod
+    def can_fit_batch(models):
+        """
+        Whether some CrossEntropyMNL models can be fitted together by fit_batch:
+        they are all CrossEntropyMNL with l2 regularization or none,
+        fitted by L-BFGS (the Newton-CG steps of the joint problem would have to
+        resolve the conditioning of all the models at once, which is slower),
+        and with the same parameters.
+        Parameters
+        ----------
+        models: list of linear models
+        Returns
+        -------
+        boolean
+        """
+        def _parameters(model):
+            return (model.solver, model.fit_intercept, model.reg_method, model.alpha,
+                    model.tol, model.max_iter, model.dtype)
+        return all(type(model) is CrossEntropyMNL and model.reg_method in (None, 'none', 'l2') and
+                   model.solver == 'lbfgs' and
+                   _parameters(model) == _parameters(models[0]) for model in models)
+
+    @staticmethod
+    def fit_batch(models, X, Y, sample_weights=None):
+        """
+        Fit several CrossEntropyMNL models on the same X with different probability targets,
+        such as the transition models of all the hidden states,
+        as a single optimization of their summed loss (see _fit_soft_mnl).
+        Each iteration of the solver goes over X once for all the models,
+        instead of once for each model as when calling fit of each model,
+        which saves the overhead of the separate fits when they are small.
+        The coefficients are the same up to the tolerance of the solver.
+        Parameters
+        ----------
+        models: list of k CrossEntropyMNL models, see can_fit_batch.
+        X : design matrix of shape (n_samples, n_features), 2d
+        Y : response matrix of shape (k, n_samples, n_classes), one for each model.
+        sample_weights: sample weight matrix of shape (k, n_samples), or None
+        """
+        assert CrossEntropyMNL.can_fit_batch(models)
+        model = models[0]
+        X = model._transform_X(X)
+        Y = np.asarray(Y, dtype=X.dtype)
+        assert Y.ndim == 3
+        assert Y.shape[:2] == (len(models), X.shape[0])
+        if sample_weights is None:
+            sample_weights = np.ones(Y.shape[:2], dtype=X.dtype)
+        sample_weights = np.asarray(sample_weights, dtype=X.dtype)
+        assert sample_weights.shape == Y.shape[:2]
+        for model, sample_weight in zip(models, sample_weights):
+            model._raise_error_if_sample_weight_sum_zero(sample_weight)
+            model.n_classes = Y.shape[2]
+            model.classes = np.arange(model.n_classes)
+            if model.n_classes == 1:
+                # no need to perform any model, see BaseMNL.fit
+                model.coef = np.zeros((X.shape[1], 1))
+                model.n_iter = None
+        if Y.shape[2] == 1:
+            return
+        alpha = model.alpha if model.reg_method == 'l2' else 0
+        coef_shape = (1 if Y.shape[2] == 2 else Y.shape[2], X.shape[1])
+        coef_init = [model._warm_start_coef(coef_shape) for model in models]
+        coef, n_iter = _fit_soft_mnl(
+            X, Y, sample_weights, alpha, model.solver, model.tol, model.max_iter,
+            None if any(c is None for c in coef_init) else np.stack(coef_init))
+        for model, model_coef in zip(models, coef):
+            model._set_coef(model_coef)
+            # the iterations of the joint fit
+            model.n_iter = n_iter
+
+    def _set_coef(self, coef):
+        """
+        Set the coefficients fitted on probability targets, see fit.
+        Parameters
+        ----------
+        coef: array of shape (1, n_features) for two classes, else (n_classes, n_features)
+        """
+        self.coef = coef
+        self._pick_model()
+        self._model.coef_ = self.coef
+        self._model.classes_ = self.classes
+        self._model.intercept_ = 0
+        if self.est_stderr:
+            # see BaseMNL.fit
+            self.stderr = None
 
     @staticmethod
     def _label_encoder(X, Y, sample_weight):
         """
         Convert input to proper format to be used by sklearn logistic regression.
         Mainly transforms Y to a 1d vector containing the class label for each sample.
+        Only used for the regularizations fit does not handle directly.
         This function overrides parent class.
         Parameters
         ----------
@@ -0,0 +1,219 @@
+'''
+Online inference of the hidden states of a trained IOHMM model,
+for the case where the records of a sequence arrive one at a time.
+
+OnlineFilter:
+    After each record, the filtered state probabilities
+    (the forward variable alpha normalized to sum to one) and
+    the log likelihood of the records so far.
+    Each record costs one evaluation of the linear models and O(k^2),
+    and the memory does not grow with the length of the stream.
+
+FixedLagSmoother:
+    Extends OnlineFilter with the smoothed state probabilities of the record
+    that arrived lag records ago, given all the records so far.
+    It keeps the last lag forward variables, transition and emission probabilities
+    in a ring buffer, so each record costs O(lag * k^2).
+'''
+from __future__ import division
+
+from builtins import object
+from builtins import range
+from collections import deque
+
+
+import numpy as np
+from scipy.special import logsumexp
+
+
+class OnlineFilter(object):
+    """
+    Forward filtering of a stream of records with a trained IOHMM model.
+    """
+
+    def __init__(self, model):
+        """
+        Constructor
+        Parameters
+        ----------
+        model: a trained IOHMM model (UnSupervisedIOHMM, SemiSupervisedIOHMM or SupervisedIOHMM)
+        """
+        if not model.trained:
+            raise ValueError('Model is not trained.')
+        self.model = model
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new sequence.
+        """
+        self.log_alpha = None
+        self.log_likelihood = 0.
+        self.n_records = 0
+
+    @property
+    def state_probabilities(self):
+        """
+        The filtered probability of each hidden state at the last record.
+        Returns
+        -------
+        array of shape (num_states, ), or None if no record has arrived
+        """
+        if self.log_alpha is None:
+            return None
+        return np.exp(self.log_alpha)
+
+    def update(self, row):
+        """
+        Advance the filter by one record.
+        Parameters
+        ----------
+        row: a record of the sequence, a pandas Series or a dictionary
+             containing the covariates and response fields of the model.
+        Returns
+        -------
+        state_probabilities: array of shape (num_states, )
+        """
+        log_prob_transition = None if self.log_alpha is None else self._log_prob_transition(row)
+        self._advance(row, log_prob_transition, self._log_Ey(row))
+        return self.state_probabilities
+
+    def _advance(self, row, log_prob_transition, log_Ey):
+        """
+        Advance the forward variable by one record.
+        Parameters
+        ----------
+        row: a record of the sequence
+        log_prob_transition: array of shape (num_states, num_states),
+                             the transition log probabilities into the record,
+                             None for the first record of the sequence.
+        log_Ey: array of shape (num_states, ), the emission log probabilities of the record
+        """
+        if log_prob_transition is None:
+            log_alpha = self.model._cal_log_prob_initial(self._get_values(
+                row, self.model.covariates_initial).astype(self.model.dtype)) + log_Ey
+        else:
+            log_alpha = logsumexp(log_prob_transition.T + self.log_alpha, axis=1) + log_Ey
+        log_c = logsumexp(log_alpha)
+        self.log_alpha = log_alpha - log_c
+        self.log_likelihood += log_c
+        self.n_records += 1
+
+    def _log_prob_transition(self, row):
+        """
+        The transition log probabilities into a new record.
+        Parameters
+        ----------
+        row: a record of the sequence
+        Returns
+        -------
+        log_prob_transition: array of shape (num_states, num_states)
+        """
+        return self.model._cal_log_prob_transition(
+            self._get_values(row, self.model.covariates_transition).astype(self.model.dtype))[0]
+
+    def _log_Ey(self, row):
+        """
+        The emission log probabilities of a new record.
+        Parameters
+        ----------
+        row: a record of the sequence
+        Returns
+        -------
+        log_Ey: array of shape (num_states, )
+        """
+        return self.model._cal_log_Ey(
+            [self._get_values(row, cov).astype(self.model.dtype)
+             for cov in self.model.covariates_emissions],
+            [self._get_values(row, res) for res in self.model.responses_emissions])[0]
+
+    @staticmethod
+    def _get_values(row, columns):
+        """
+        Get the values of some fields of a record
+        Parameters
+        ----------
+        row: a record of the sequence
+        columns: list of strings, the field names
+        Returns
+        -------
+        values: array of shape (1, len(columns))
+        """
+        return np.array([row[col] for col in columns]).reshape(1, -1)
+
+
+class FixedLagSmoother(OnlineFilter):
+    """
+    Fixed-lag smoothing of a stream of records with a trained IOHMM model.
+    """
+
+    def __init__(self, model, lag):
+        """
+        Constructor
+        Parameters
+        ----------
+        model: a trained IOHMM model (UnSupervisedIOHMM, SemiSupervisedIOHMM or SupervisedIOHMM)
+        lag: the number of records to wait before smoothing a record
+        """
+        self.lag = lag
+        super(FixedLagSmoother, self).__init__(model)
+
+    def reset(self):
+        """
+        Start a new sequence.
+        """
+        super(FixedLagSmoother, self).reset()
+        # (log_alpha, log_prob_transition, log_Ey) of the last lag + 1 records
+        self._buffer = deque(maxlen=self.lag + 1)
+
+    def update(self, row):
+        """
+        Advance the smoother by one record.
+        Parameters
+        ----------
+        row: a record of the sequence, a pandas Series or a dictionary
+             containing the covariates and response fields of the model.
+        Returns
+        -------
+        log_gamma: array of shape (num_states, ), the posterior state log probability of
+                   the record that arrived lag records ago (timestamp n_records - 1 - lag),
+                   given all the records so far.
+                   None if there are no more than lag records.
+        """
+        log_prob_transition = None if self.log_alpha is None else self._log_prob_transition(row)
+        log_Ey = self._log_Ey(row)
+        self._advance(row, log_prob_transition, log_Ey)
+        self._buffer.append((self.log_alpha, log_prob_transition, log_Ey))
+        if self.n_records <= self.lag:
+            return None
+        log_gamma = self._buffer[0][0] + self._log_betas()[0]
+        return log_gamma - logsumexp(log_gamma)
+
+    def flush(self):
+        """
+        Smooth the records that have not been returned by update,
+        at the end of the stream.
+        Returns
+        -------
+        log_gamma: array of shape (min(lag, n_records), num_states),
+                   the posterior state log probability of the last min(lag, n_records) records,
+                   given all the records.
+        """
+        if self.lag == 0 or self.n_records == 0:
+            return np.zeros((0, self.model.num_states))
+        log_gamma = np.array([log_alpha for log_alpha, _, _ in self._buffer]) + self._log_betas()
+        log_gamma -= logsumexp(log_gamma, axis=1, keepdims=True)
+        return log_gamma[-min(self.lag, self.n_records):]
+
+    def _log_betas(self):
+        """
+        The backward variables of the records in the buffer given all the records so far.
+        Returns
+        -------
+        log_beta: array of shape (len(buffer), num_states)
+        """
+        log_beta = np.zeros((len(self._buffer), self.model.num_states))
+        for i in range(len(self._buffer) - 2, -1, -1):
+            _, log_prob_transition, log_Ey = self._buffer[i + 1]
+            log_beta[i, :] = logsumexp(log_prob_transition + (log_beta[i + 1, :] + log_Ey), axis=1)
+        return log_beta
@@ -0,0 +1,411 @@
+'''
+Parallel E step of IOHMM models over a pool of worker processes.
+
+The sequences are split into contiguous shards balanced by their total number of timestamps,
+one shard per worker.
+
+The stacked design matrices and posteriors of the model (see BaseIOHMM._initialize)
+are placed in shared memory (multiprocessing.shared_memory,
+or memory-mapped files where it is not available, Python < 3.8).
+Each worker attaches to them by a small descriptor (SharedArray.descriptor),
+so that the data itself is never serialized: the design matrices of a shard
+are views of the shared arrays, and its E step writes the posteriors straight into them.
+Each iteration of EM only sends the workers the linear models (their coefficients),
+and only receives the log likelihoods of their sequences.
+An exception in a worker is sent back with its traceback, and raised by EStepPool.E_step.
+'''
+from __future__ import division
+
+from builtins import object
+from copy import copy
+import multiprocessing
+import os
+import pickle
+import tempfile
+import traceback
+
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+# the stacked design matrices of a model, read by the workers
+SHARED_INPUTS = ['inp_initials_all_sequences', 'inp_transitions_all_sequences',
+                 'inp_emissions_all_sequences', 'out_emissions_all_sequences']
+# the stacked posteriors of a model, written by the workers
+SHARED_POSTERIORS = ['log_gammas_all_sequences', 'log_epsilons_all_sequences']
+
+
+class SharedArray(object):
+    """
+    A copy of an array in memory shared between processes.
+    Other processes attach to it by its descriptor, without copying or serializing the data.
+    Arrays of objects (e.g. string labels) cannot be shared,
+    their descriptor holds the array itself.
+    """
+
+    def __init__(self, array, backend=None):
+        """
+        Constructor
+        Parameters
+        ----------
+        array: the array to copy into shared memory
+        backend: one of
+                 None: 'shared_memory' if available, else 'memmap' (default).
+                 'shared_memory': a block of multiprocessing.shared_memory.
+                 'memmap': a memory-mapped temporary file.
+        """
+        array = np.ascontiguousarray(array)
+        if backend is None:
+            backend = 'memmap' if shared_memory is None else 'shared_memory'
+        if array.dtype.hasobject:
+            backend = 'inline'
+        self.backend = backend
+        self.name = None
+        self._buffer = None
+        if backend == 'inline':
+            self.array = array
+            return
+        size = max(array.nbytes, 1)
+        if backend == 'shared_memory':
+            self._buffer = shared_memory.SharedMemory(create=True, size=size)
+            self.name = self._buffer.name
+            buffer = self._buffer.buf
+        elif backend == 'memmap':
+            fd, self.name = tempfile.mkstemp(prefix='iohmm_', suffix='.dat')
+            os.close(fd)
+            self._buffer = buffer = np.memmap(self.name, dtype=np.uint8, mode='w+',
+                                              shape=(size,))
+        else:
+            raise ValueError('Unknown shared memory backend: {}.'.format(backend))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=buffer)
+        self.array[...] = array
+
+    @property
+    def descriptor(self):
+        """
+        The picklable descriptor of the array, see attach.
+        Returns
+        -------
+        descriptor: tuple of (backend, name, shape, dtype),
+                    or ('inline', array) for an array of objects.
+        """
+        if self.backend == 'inline':
+            return ('inline', self.array)
+        return (self.backend, self.name, self.array.shape, self.array.dtype.str)
+
+    @staticmethod
+    def attach(descriptor):
+        """
+        Attach to a shared array, read/write and without copying.
+        Parameters
+        ----------
+        descriptor: the descriptor of a SharedArray
+        Returns
+        -------
+        array: the shared array
+        buffer: the shared memory block or memory map behind the array,
+                to be kept alive as long as the array is used. None for 'inline'.
+        """
+        if descriptor[0] == 'inline':
+            return descriptor[1], None
+        backend, name, shape, dtype = descriptor
+        if backend == 'shared_memory':
+            buffer = shared_memory.SharedMemory(name=name)
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer.buf)
+        else:
+            buffer = np.memmap(name, dtype=np.uint8, mode='r+')
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer)
+        return array, buffer
+
+    def close(self):
+        """
+        Release the shared memory. The array must not be used afterwards.
+        """
+        self.array = None
+        if self.backend == 'shared_memory':
+            try:
+                self._buffer.close()
+            except BufferError:
+                # some views of the array are still alive, the block is freed with them
+                pass
+            self._buffer.unlink()
+        elif self.backend == 'memmap':
+            self._buffer = None
+            os.remove(self.name)
+        self._buffer = None
+
+
+def _share(arrays, backend=None):
+    """
+    Copy an array or a list of arrays into shared memory.
+    Parameters
+    ----------
+    arrays: an array or a list of arrays
+    backend: see SharedArray
+    Returns
+    -------
+    shared: a SharedArray or a list of SharedArray
+    """
+    if isinstance(arrays, list):
+        return [SharedArray(array, backend) for array in arrays]
+    return SharedArray(arrays, backend)
+
+
+def _descriptor(shared):
+    """
+    The descriptor of a SharedArray or a list of SharedArray.
+    """
+    if isinstance(shared, list):
+        return [s.descriptor for s in shared]
+    return shared.descriptor
+
+
+def _attach(descriptor, buffers):
+    """
+    Attach to a SharedArray or a list of SharedArray by descriptor,
+    see SharedArray.attach.
+    Parameters
+    ----------
+    descriptor: the descriptor, or a list of descriptors
+    buffers: list, the buffers behind the arrays are appended to it.
+    Returns
+    -------
+    array: the shared array or the list of shared arrays
+    """
+    if isinstance(descriptor, list):
+        return [_attach(d, buffers) for d in descriptor]
+    array, buffer = SharedArray.attach(descriptor)
+    buffers.append(buffer)
+    return array
+
+
+def _balance_shards(lengths, n_shards):
+    """
+    Split the sequences into contiguous shards of similar total number of timestamps,
+    each sequence goes to the shard that contains the middle of its timestamps.
+    Parameters
+    ----------
+    lengths: array of shape (n_seqs, ), the length of each sequence
+    n_shards: the number of shards
+    Returns
+    -------
+    shards: list of (start, stop), the sequences start, ..., stop - 1 are in the shard,
+            at most n_shards of them, none empty.
+    """
+    lengths = np.asarray(lengths)
+    middles = np.cumsum(lengths) - lengths / 2
+    shard_of_seq = np.minimum((middles * n_shards // lengths.sum()).astype(int), n_shards - 1)
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(shard_of_seq)) + 1, [lengths.shape[0]]])
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+class _RemoteTraceback(Exception):
+    """
+    The traceback of an exception raised in a worker process,
+    the cause of the exception raised again by EStepPool.E_step.
+    """
+
+    def __str__(self):
+        return self.args[0]
+
+
+def _worker_error(error):
+    """
+    An exception raised in a worker process, to be sent back to EStepPool.E_step.
+    Must be called in the except clause that caught the exception.
+    Parameters
+    ----------
+    error: the exception
+    Returns
+    -------
+    error: the exception, or a RuntimeError with its message if it cannot be pickled.
+    remote_traceback: _RemoteTraceback of the exception
+    """
+    remote_traceback = _RemoteTraceback('\n"""\n{}"""'.format(traceback.format_exc()))
+    try:
+        pickle.dumps(error)
+    except Exception:
+        error = RuntimeError(repr(error))
+    return error, remote_traceback
+
+
+def _e_step_worker(conn, model, descriptors, start, stop):
+    """
+    The loop of a worker process: receive the linear models,
+    run the E step on the shard and send back the log likelihoods, until None is received.
+    The worker sends back (None, (log_likelihoods, pruned_masses)),
+    or ((error, remote_traceback), None) if the E step raised (see _worker_error),
+    and keeps waiting for the next models.
+    Parameters
+    ----------
+    conn: the worker end of a multiprocessing.Pipe
+    model: a copy of the IOHMM model without its stacked arrays
+    descriptors: dict of the name of the stacked arrays to their descriptors
+    start, stop: the sequences start, ..., stop - 1 are in the shard
+    """
+    buffers = []
+    try:
+        for name in descriptors:
+            setattr(model, name, _attach(descriptors[name], buffers))
+        shard, setup_error = model._make_shard(start, stop), None
+    except Exception as error:
+        shard, setup_error = None, _worker_error(error)
+    while True:
+        models = conn.recv()
+        if models is None:
+            break
+        if setup_error is not None:
+            conn.send((setup_error, None))
+            continue
+        try:
+            shard.model_initial, shard.model_transition, shard.model_emissions = models
+            shard.E_step()
+        except Exception as error:
+            conn.send((_worker_error(error), None))
+        else:
+            conn.send((None, (shard.log_likelihoods, shard.pruned_masses)))
+    conn.close()
+
+
+class EStepPool(object):
+    """
+    A pool of worker processes running the E step of an IOHMM model on shards of its sequences.
+    While the pool is open, the stacked posteriors of the model
+    (log_gammas_all_sequences, log_epsilons_all_sequences and their views)
+    live in shared memory, they are copied back into the arrays of the model by close.
+    Use it as a context manager, or call close when done.
+    """
+
+    def __init__(self, model, n_jobs=-1, backend=None):
+        """
+        Constructor
+        Parameters
+        ----------
+        model: an IOHMM model after set_data
+        n_jobs: the number of worker processes, -1 for the number of CPUs.
+                There are no more workers than sequences.
+        backend: the shared memory backend, see SharedArray.
+        """
+        if n_jobs == -1:
+            n_jobs = multiprocessing.cpu_count()
+        if n_jobs < 1:
+            raise ValueError('n_jobs must be a positive integer or -1.')
+        self.model = model
+        self.shards = _balance_shards(np.diff(model.offsets), min(n_jobs, model.num_seqs))
+        self.shared = {name: _share(getattr(model, name), backend)
+                       for name in SHARED_INPUTS + SHARED_POSTERIORS}
+        # the model reads and writes the posteriors in shared memory while the pool is open
+        self._private = {name: getattr(model, name)
+                         for name in SHARED_POSTERIORS + ['log_gammas', 'log_epsilons']}
+        self._bind_posteriors({name: self.shared[name].array for name in SHARED_POSTERIORS})
+        descriptors = {name: _descriptor(self.shared[name]) for name in self.shared}
+        template = copy(model)
+        template.dfs_logStates = [(None, log_state) for _, log_state in model.dfs_logStates]
+        for name in list(self.shared) + ['log_gammas', 'log_epsilons', 'inp_initials',
+                                         'inp_transitions', 'inp_emissions', 'out_emissions',
+                                         'workspace']:
+            setattr(template, name, None)
+        self.conns, self.workers = [], []
+        for start, stop in self.shards:
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=_e_step_worker, args=(worker_conn, template, descriptors, start, stop))
+            worker.daemon = True
+            worker.start()
+            worker_conn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def _bind_posteriors(self, arrays):
+        """
+        Point the stacked posteriors of the model, and their views, to some arrays.
+        Parameters
+        ----------
+        arrays: dict of the names in SHARED_POSTERIORS to arrays
+        """
+        for name in SHARED_POSTERIORS:
+            setattr(self.model, name, arrays[name])
+        self.model._split_posteriors()
+
+    def E_step(self):
+        """
+        The Expectation step of the model, see BaseIOHMM.E_step.
+        Send the current linear models to the workers,
+        which write the posteriors of their shard into the shared arrays.
+        If the E step of a worker raised, the exception is raised again here,
+        once all the workers have answered, with the traceback of the worker as its cause.
+        """
+        model = self.model
+        models = (model.model_initial, model.model_transition, model.model_emissions)
+        exited = (RuntimeError('An E step worker process exited.'), None)
+        errors, answering = [], []
+        for conn, shard in zip(self.conns, self.shards):
+            try:
+                conn.send(models)
+                answering.append((conn, shard))
+            except (BrokenPipeError, OSError):
+                errors.append(exited)
+        for conn, (start, stop) in answering:
+            try:
+                error, results = conn.recv()
+            except EOFError:
+                error, results = exited, None
+            if error is not None:
+                errors.append(error)
+                continue
+            log_likelihoods, pruned_masses = results
+            model.log_likelihoods[start:stop] = log_likelihoods
+            model.pruned_masses[start:stop] = pruned_masses
+        if errors:
+            error, remote_traceback = errors[0]
+            raise error from remote_traceback
+        model.log_likelihood = sum(model.log_likelihoods)
+
+    def close(self):
+        """
+        Stop the worker processes, copy the posteriors back into the arrays of the model
+        and release the shared memory.
+        The shared memory is released even if a worker process already exited.
+        """
+        try:
+            for conn in self.conns:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, EOFError, OSError):
+                    # the worker already exited
+                    pass
+                conn.close()
+            for worker in self.workers:
+                worker.join()
+        finally:
+            self.conns, self.workers = [], []
+            self._release()
+
+    def _release(self):
+        """
+        Copy the posteriors back into the arrays of the model and release the shared memory.
+        """
+        if not self.shared:
+            return
+        model = self.model
+        try:
+            for name in SHARED_POSTERIORS:
+                self._private[name][...] = getattr(model, name)
+            for name in self._private:
+                setattr(model, name, self._private[name])
+        finally:
+            for shared in self.shared.values():
+                for s in (shared if isinstance(shared, list) else [shared]):
+                    s.close()
+            self.shared = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
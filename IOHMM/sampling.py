@@ -0,0 +1,136 @@
+'''
+Sampling of whole hidden state paths of hidden markov model (HMM) from their posterior,
+given the (1) initial probabilities, (2) transition probabilities, and (3) emission probabilities,
+by forward filtering backward sampling (FFBS).
+
+The forward pass is the forward function of the forward backward algorithm,
+and the backward pass draws the state of each timestamp given the state of the next one,
+for many paths and many padded sequences at once,
+so that there is only one for loop over the timestamps.
+The random numbers come from a numpy.random.Generator,
+so that the samples are reproducible given its seed.
+'''
+from __future__ import division
+
+from builtins import range
+
+
+import numpy as np
+
+
+from .forward_backward import (_apply_log_states_batch, _log_state_to_dense, forward_batch)
+
+
+def sample_states(log_prob_initial, log_prob_transition, log_Ey, n_samples=1, log_state={},
+                  random_state=None):
+    """
+    Draw hidden state paths of a sequence from their posterior.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, k, k)
+    log_Ey : array-like of shape (t, k)
+    n_samples : the number of paths to draw
+    log_state: dict(int -> array-like of shape (k, )), or an array of the known states
+    see forward_backward for details.
+    random_state : None, int or numpy.random.Generator,
+                   the seed of numpy.random.default_rng.
+    Returns
+    -------
+    states : array of shape (n_samples, t), the sampled state of each timestamp of each path.
+    """
+    log_states, known_states = _log_state_to_dense(log_state, *log_Ey.shape)
+    states = sample_states_batch(
+        log_prob_initial[np.newaxis], log_prob_transition[np.newaxis], log_Ey[np.newaxis],
+        np.array([log_Ey.shape[0]]), n_samples, log_states[np.newaxis],
+        known_states[np.newaxis], random_state)
+    return states[0]
+
+
+def sample_states_batch(log_prob_initial, log_prob_transition, log_Ey, lengths, n_samples=1,
+                        log_states=None, known_states=None, random_state=None):
+    """
+    Draw hidden state paths of a batch of padded sequences from their posterior.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    n_samples : the number of paths to draw for each sequence
+    log_states : array-like of shape (n, t, k) or None
+    known_states : array-like of shape (n, t) of booleans or None
+    see forward_backward_batch for details.
+    random_state : None, int or numpy.random.Generator,
+                   the seed of numpy.random.default_rng.
+    Returns
+    -------
+    states : array of shape (n, n_samples, t), the sampled state of each timestamp
+             of each path of each sequence. The padded timestamps are -1.
+    """
+    log_prob_initial, log_prob_transition = _apply_log_states_batch(
+        log_prob_initial, log_prob_transition, log_states, known_states)
+    log_alpha = forward_batch(log_prob_initial, log_prob_transition, log_Ey, lengths)
+    return backward_sample_batch(log_alpha, log_prob_transition, lengths, n_samples,
+                                 random_state)
+
+
+def backward_sample_batch(log_alpha, log_prob_transition, lengths, n_samples=1,
+                          random_state=None):
+    """
+    The backward sampling pass, given the output of the forward function.
+    The state of the last timestamp is drawn from the normalized alpha,
+    and the state of timestamp i given the state j of timestamp i + 1
+    from alpha_{i} * prob_transition_{i, :, j} normalized.
+    Parameters
+    ----------
+    log_alpha : array-like of shape (n, t, k)
+        log of forward variable alpha, see forward_batch.
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+        the transition log probabilities the forward variable was calculated with,
+        including the known states, see _apply_log_states_batch.
+    lengths : array-like of shape (n, )
+    n_samples : the number of paths to draw for each sequence
+    random_state : None, int or numpy.random.Generator,
+                   the seed of numpy.random.default_rng.
+    Returns
+    -------
+    states : array of shape (n, n_samples, t), the sampled state of each timestamp
+             of each path of each sequence. The padded timestamps are -1.
+    """
+    assert log_alpha.ndim == 3
+    assert log_prob_transition.ndim == 4
+    rng = np.random.default_rng(random_state)
+    lengths = np.asarray(lengths)
+    n, t, k = log_alpha.shape
+    states = np.full((n, n_samples, t), -1, dtype=int)
+    seqs = np.arange(n)[:, np.newaxis]
+    for i in range(t - 1, -1, -1):
+        inner = i < lengths - 1
+        log_weight = np.repeat(log_alpha[:, i, np.newaxis, :], n_samples, axis=1)
+        if inner.any():
+            # the transition log probabilities into the sampled states of timestamp i + 1
+            next_states = np.where(inner[:, np.newaxis], states[:, :, i + 1], 0)
+            log_weight += np.where(inner[:, np.newaxis, np.newaxis],
+                                   log_prob_transition[seqs, i, :, next_states], 0)
+        states[:, :, i] = np.where((i < lengths)[:, np.newaxis],
+                                   _sample_log_categorical(log_weight, rng), -1)
+    return states
+
+
+def _sample_log_categorical(log_weight, rng):
+    """
+    Draw from categorical distributions given their unnormalized log probabilities.
+    Parameters
+    ----------
+    log_weight : array-like of shape (..., k)
+    rng : numpy.random.Generator
+    Returns
+    -------
+    draws : array of shape log_weight.shape[:-1] of integers in [0, k)
+    """
+    weight = np.exp(log_weight - np.max(log_weight, axis=-1, keepdims=True))
+    cum_weight = np.cumsum(weight, axis=-1)
+    u = rng.random(log_weight.shape[:-1]) * cum_weight[..., -1]
+    draws = (cum_weight <= u[..., np.newaxis]).sum(axis=-1)
+    return np.minimum(draws, log_weight.shape[-1] - 1)
@@ -0,0 +1,368 @@
+'''
+Sparse transition structures of hidden markov model (HMM).
+
+Many models with a large number of hidden states only allow a few successors of each state,
+for example left-to-right models, where a state can only stay or move forward,
+or banded models, where a state can only move to its neighbours.
+TransitionStructure stores the allowed transitions (edges) in the
+compressed sparse row (CSR) format:
+the successors of state i are indices[indptr[i]:indptr[i + 1]].
+
+With a structure, the transition log probabilities of a sequence are given per edge,
+of shape (t-1, nnz) where nnz is the number of allowed transitions,
+and the forward backward algorithm (forward_backward_sparse_batch) does O(nnz) work
+per timestamp instead of O(k^2).
+The posterior "transition" log probabilities are returned per edge as well.
+'''
+from __future__ import division
+
+from builtins import object
+from builtins import range
+
+
+import numpy as np
+from scipy.special import logsumexp
+
+
+from .forward_backward import _empty, _log_state_to_dense
+
+
+class TransitionStructure(object):
+    """
+    The allowed transitions between the hidden states, in the CSR format.
+    """
+
+    def __init__(self, indptr, indices):
+        """
+        Constructor
+        Parameters
+        ----------
+        indptr: array of shape (k + 1, ), the successors of state i are
+                indices[indptr[i]:indptr[i + 1]].
+        indices: array of shape (nnz, ), the successor state of each allowed transition.
+        """
+        self.indptr = np.asarray(indptr, dtype=int)
+        self.indices = np.asarray(indices, dtype=int)
+        self.num_states = self.indptr.shape[0] - 1
+        if np.any(np.diff(self.indptr) < 1):
+            raise ValueError('Every state must have at least one successor.')
+        # the predecessor state of each allowed transition
+        self.rows = np.repeat(np.arange(self.num_states), np.diff(self.indptr))
+        # the allowed transitions grouped by their successor state
+        self.order_by_successor = np.argsort(self.indices, kind='stable')
+        self.indptr_by_successor = np.concatenate(
+            [[0], np.cumsum(np.bincount(self.indices, minlength=self.num_states))])
+
+    @property
+    def nnz(self):
+        """
+        The number of allowed transitions.
+        """
+        return self.indices.shape[0]
+
+    def successors(self, state):
+        """
+        The allowed successors of a state.
+        Parameters
+        ----------
+        state: the predecessor state
+        Returns
+        -------
+        array of the successor states
+        """
+        return self.indices[self.indptr[state]:self.indptr[state + 1]]
+
+    def edges(self, state):
+        """
+        The positions of the allowed transitions from a state, in the arrays given per edge.
+        Parameters
+        ----------
+        state: the predecessor state
+        Returns
+        -------
+        slice
+        """
+        return slice(self.indptr[state], self.indptr[state + 1])
+
+    def to_mask(self):
+        """
+        The dense mask of the allowed transitions.
+        Returns
+        -------
+        mask: array of shape (k, k) of booleans, mask[i, j] is True if
+              the transition from state i to state j is allowed.
+        """
+        mask = np.zeros((self.num_states, self.num_states), dtype=bool)
+        mask[self.rows, self.indices] = True
+        return mask
+
+    def to_dense(self, log_prob_transition):
+        """
+        Convert transition log probabilities given per edge to a dense array.
+        Parameters
+        ----------
+        log_prob_transition: array of shape (..., nnz)
+        Returns
+        -------
+        array of shape (..., k, k), -np.Infinity for the transitions that are not allowed.
+        """
+        dense = np.full(log_prob_transition.shape[:-1] + (self.num_states, self.num_states),
+                        -np.Infinity, dtype=log_prob_transition.dtype)
+        dense[..., self.rows, self.indices] = log_prob_transition
+        return dense
+
+    def to_list(self):
+        """
+        The successors of each state, used for json serialization.
+        Returns
+        -------
+        list of list of ints
+        """
+        return [self.successors(st).tolist() for st in range(self.num_states)]
+
+    @classmethod
+    def from_list(cls, successors):
+        """
+        Construct a structure from the successors of each state.
+        Parameters
+        ----------
+        successors: list of list of ints, the allowed successors of each state.
+        Returns
+        -------
+        TransitionStructure
+        """
+        indices = [np.unique(np.asarray(succ, dtype=int)) for succ in successors]
+        indptr = np.concatenate([[0], np.cumsum([idx.shape[0] for idx in indices])])
+        return cls(indptr, np.concatenate(indices) if indices else np.zeros(0, dtype=int))
+
+    @classmethod
+    def from_mask(cls, mask):
+        """
+        Construct a structure from a mask of the allowed transitions.
+        Parameters
+        ----------
+        mask: array-like of shape (k, k) of booleans or a scipy.sparse matrix,
+              nonzero at [i, j] if the transition from state i to state j is allowed.
+        Returns
+        -------
+        TransitionStructure
+        """
+        if hasattr(mask, 'tocsr'):
+            mask = mask.toarray()
+        mask = np.asarray(mask, dtype=bool)
+        assert mask.ndim == 2 and mask.shape[0] == mask.shape[1]
+        return cls.from_list([np.flatnonzero(row) for row in mask])
+
+    @classmethod
+    def banded(cls, num_states, lower=1, upper=1):
+        """
+        A banded structure, state i can move to the states i - lower, ..., i + upper.
+        Parameters
+        ----------
+        num_states: the number of hidden states
+        lower: the number of states a state can move backward
+        upper: the number of states a state can move forward
+        Returns
+        -------
+        TransitionStructure
+        """
+        return cls.from_list([range(max(st - lower, 0), min(st + upper, num_states - 1) + 1)
+                              for st in range(num_states)])
+
+    @classmethod
+    def left_right(cls, num_states, max_jump=1):
+        """
+        A left-to-right structure, a state can stay or move forward by at most max_jump states.
+        Parameters
+        ----------
+        num_states: the number of hidden states
+        max_jump: the number of states a state can move forward
+        Returns
+        -------
+        TransitionStructure
+        """
+        return cls.banded(num_states, lower=0, upper=max_jump)
+
+
+def _segment_logsumexp(values, indptr):
+    """
+    logsumexp over the segments of the last axis.
+    Parameters
+    ----------
+    values : array-like of shape (..., nnz), sorted by segment.
+    indptr : array-like of shape (m + 1, ), segment s is values[..., indptr[s]:indptr[s + 1]].
+    Returns
+    -------
+    array of shape (..., m), -np.Infinity for the empty segments.
+    """
+    starts = indptr[:-1]
+    nonempty = indptr[1:] > starts
+    out = np.full(values.shape[:-1] + (starts.shape[0], ), -np.Infinity, dtype=values.dtype)
+    if values.shape[-1] == 0:
+        return out
+    values_max = np.full(out.shape, -np.Infinity, dtype=values.dtype)
+    values_max[..., nonempty] = np.maximum.reduceat(values, starts[nonempty], axis=-1)
+    values_max[~np.isfinite(values_max)] = 0
+    segments = np.repeat(np.arange(starts.shape[0]), np.diff(indptr))
+    sum_exp = np.add.reduceat(np.exp(values - values_max[..., segments]),
+                              starts[nonempty], axis=-1)
+    out[..., nonempty] = np.log(sum_exp) + values_max[..., nonempty]
+    return out
+
+
+def forward_backward_sparse(log_prob_initial, log_prob_transition, log_Ey, structure,
+                            log_state={}):
+    """
+    The forward_backward algorithm with a sparse transition structure.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+    log_prob_transition : array-like of shape (t-1, nnz)
+        log_prob_transition_{t, e} is the log of the probability of the allowed transition e
+        of the structure at timestamp t.
+    log_Ey : array-like of shape (t, k)
+    structure : TransitionStructure
+    log_state: dict(int -> array-like of shape (k, )), or an array of the known states
+        see forward_backward for details.
+        The known states must be consistent with the structure.
+    Returns
+    -------
+    (1) posterior state log probability of each timestamp, of shape (t, k).
+    (2) posterior "transition" log probability of each allowed transition
+        of each timestamp, of shape (t-1, nnz).
+    (3) log likelihood of the sequence.
+    """
+    log_states, known_states = _log_state_to_dense(log_state, *log_Ey.shape)
+    log_gamma, log_epsilon, log_likelihood = forward_backward_sparse_batch(
+        log_prob_initial[np.newaxis], log_prob_transition[np.newaxis], log_Ey[np.newaxis],
+        np.array([log_Ey.shape[0]]), structure, log_states[np.newaxis], known_states[np.newaxis])
+    return log_gamma[0], log_epsilon[0], log_likelihood[0]
+
+
+def forward_backward_sparse_batch(log_prob_initial, log_prob_transition, log_Ey, lengths,
+                                  structure, log_states=None, known_states=None,
+                                  workspace=None):
+    """
+    The forward_backward algorithm with a sparse transition structure
+    on a batch of padded sequences.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, nnz)
+        the transition log probabilities of each allowed transition of the structure.
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    structure : TransitionStructure
+    log_states : array-like of shape (n, t, k) or None
+    known_states : array-like of shape (n, t) of booleans or None
+    workspace : Workspace or None,
+        if given the known states are folded into log_prob_initial and log_prob_transition
+        in place.
+    see forward_backward_batch for details.
+    Returns
+    -------
+    (1) posterior state log probability of each timestamp, of shape (n, t, k).
+    (2) posterior "transition" log probability of each allowed transition
+        of each timestamp, of shape (n, t-1, nnz).
+    (3) log likelihood of each sequence, of shape (n, ).
+    The padded timestamps of (1) and (2) are -np.Infinity.
+    """
+    lengths = np.asarray(lengths)
+    n, t, k = log_Ey.shape
+    dtype = log_Ey.dtype
+    valid = np.arange(t) < lengths[:, np.newaxis]
+    if known_states is not None and workspace is not None:
+        # the transition into a known state is the known state for any previous state,
+        # the inputs are buffers of the caller, fold in place
+        log_prob_initial[known_states[:, 0]] = log_states[known_states[:, 0], 0, :]
+        log_prob_transition[known_states[:, 1:]] = \
+            log_states[:, 1:][known_states[:, 1:]][:, structure.indices]
+    elif known_states is not None:
+        log_prob_initial = np.where(known_states[:, 0, np.newaxis],
+                                    log_states[:, 0, :], log_prob_initial)
+        log_prob_transition = np.where(known_states[:, 1:, np.newaxis],
+                                       log_states[:, 1:, structure.indices], log_prob_transition)
+    log_alpha = forward_sparse_batch(
+        log_prob_initial, log_prob_transition, log_Ey, lengths, structure,
+        out=_empty(workspace, 'log_alpha', (n, t, k), dtype))
+    log_beta = backward_sparse_batch(log_prob_transition, log_Ey, lengths, structure,
+                                     out=_empty(workspace, 'log_beta', (n, t, k), dtype))
+    log_likelihood = logsumexp(
+        log_alpha[np.arange(n), lengths - 1].astype(np.float64), axis=1)
+
+    log_gamma = np.add(log_alpha, log_beta, out=_empty(workspace, 'log_gamma', (n, t, k), dtype))
+    log_gamma -= log_likelihood[:, np.newaxis, np.newaxis]
+    log_epsilon = np.add(log_alpha[:, :-1, structure.rows], log_prob_transition,
+                         out=_empty(workspace, 'log_epsilon', log_prob_transition.shape, dtype))
+    log_beta += log_Ey
+    log_beta -= log_likelihood[:, np.newaxis, np.newaxis]
+    log_epsilon += log_beta[:, 1:, structure.indices]
+
+    log_gamma[~valid] = -np.Infinity
+    log_epsilon[~valid[:, 1:]] = -np.Infinity
+    if known_states is not None:
+        log_gamma[known_states] = log_states[known_states]
+        known_pairs = known_states[:, :-1] & known_states[:, 1:]
+        log_epsilon[known_pairs] = (log_states[:, :-1][known_pairs][:, structure.rows] +
+                                    log_states[:, 1:][known_pairs][:, structure.indices])
+    return log_gamma, log_epsilon, log_likelihood
+
+
+def forward_sparse_batch(log_prob_initial, log_prob_transition, log_Ey, lengths, structure,
+                         out=None):
+    """
+    The forward function with a sparse transition structure on a batch of padded sequences.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, nnz)
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    structure : TransitionStructure
+    out : array-like of shape (n, t, k) or None
+    see forward_backward_sparse_batch for details.
+    Returns
+    -------
+    log_alpha : array-like of shape (n, t, k), the padded timestamps carry the last value.
+    """
+    n, t, k = log_Ey.shape
+    valid = np.arange(t) < np.asarray(lengths)[:, np.newaxis]
+    log_alpha = np.zeros((n, t, k), dtype=log_Ey.dtype) if out is None else out
+    log_alpha[:, 0, :] = log_prob_initial + log_Ey[:, 0, :]
+    order = structure.order_by_successor
+    for i in range(1, t):
+        log_scores = log_alpha[:, i - 1, structure.rows] + log_prob_transition[:, i - 1, :]
+        log_alpha[:, i, :] = np.where(
+            valid[:, i, np.newaxis],
+            _segment_logsumexp(log_scores[:, order], structure.indptr_by_successor) +
+            log_Ey[:, i, :],
+            log_alpha[:, i - 1, :])
+    return log_alpha
+
+
+def backward_sparse_batch(log_prob_transition, log_Ey, lengths, structure, out=None):
+    """
+    The backward function with a sparse transition structure on a batch of padded sequences.
+    Parameters
+    ----------
+    log_prob_transition : array-like of shape (n, t-1, nnz)
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    structure : TransitionStructure
+    out : array-like of shape (n, t, k) or None
+    see forward_backward_sparse_batch for details.
+    Returns
+    -------
+    log_beta : array-like of shape (n, t, k), the padded timestamps are 0.
+    """
+    n, t, k = log_Ey.shape
+    valid = np.arange(t) < np.asarray(lengths)[:, np.newaxis]
+    log_beta = np.zeros((n, t, k), dtype=log_Ey.dtype) if out is None else out
+    log_beta[:, -1, :] = 0
+    for i in range(t - 2, -1, -1):
+        log_scores = log_prob_transition[:, i, :] + \
+            (log_beta[:, i + 1, :] + log_Ey[:, i + 1, :])[:, structure.indices]
+        log_beta[:, i, :] = np.where(
+            valid[:, i + 1, np.newaxis],
+            _segment_logsumexp(log_scores, structure.indptr), 0)
+    return log_beta
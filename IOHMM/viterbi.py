@@ -0,0 +1,100 @@
+'''
+The Viterbi algorithm of hidden markov model (HMM).
+Mainly used to decode the most likely sequence of hidden states given the
+(1) initial probabilities, (2) transition probabilities, and (3) emission probabilities.
+
+The inputs have the same shapes as the forward backward algorithm,
+and like the forward backward algorithm it is calculated at the log level,
+with only one for loop over the timestamps (plus one for the backtracking).
+The batched function (viterbi_batch) decodes many padded sequences at once.
+'''
+from __future__ import division
+
+from builtins import range
+
+
+import numpy as np
+
+
+from .forward_backward import (_apply_log_states_batch, _log_state_to_dense)
+
+
+def viterbi(log_prob_initial, log_prob_transition, log_Ey, log_state={}):
+    """
+    The Viterbi algorithm.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (k, )
+        where k is the number of states of the HMM
+        The log of the probability of initial state at timestamp 0.
+    log_prob_transition : array-like of shape (t-1, k, k)
+        where t is the number of timestamps (length) of the sequence.
+        log_prob_transition_{t, i, j} is the log of the probability of transferring
+        to state j from state i at timestamp t.
+    log_Ey : array-like of shape (t, k)
+        log_Ey_{t, i} is the log of the probability of observing emission variables
+        from state i at timestamp t.
+    log_state: dict(int -> array-like of shape (k, ))
+        timestamp i is a key of log_state if we know the state of that timestamp.
+        log_state[t][i] is 0 and log_state[t][~i] is -np.Infinity
+        if we know the state is i at timestamp t.
+        Alternatively, an array of the known states, see forward_backward for details.
+    Returns
+    -------
+    (1) states : array of shape (t, ), the most likely state of each timestamp.
+    (2) log probability of the observations and the most likely states jointly.
+    see https://en.wikipedia.org/wiki/Viterbi_algorithm for details.
+    """
+    log_states, known_states = _log_state_to_dense(log_state, *log_Ey.shape)
+    states, log_prob = viterbi_batch(
+        log_prob_initial[np.newaxis], log_prob_transition[np.newaxis], log_Ey[np.newaxis],
+        np.array([log_Ey.shape[0]]), log_states[np.newaxis], known_states[np.newaxis])
+    return states[0], log_prob[0]
+
+
+def viterbi_batch(log_prob_initial, log_prob_transition, log_Ey, lengths,
+                  log_states=None, known_states=None):
+    """
+    The Viterbi algorithm on a batch of padded sequences.
+    Parameters
+    ----------
+    log_prob_initial : array-like of shape (n, k)
+    log_prob_transition : array-like of shape (n, t-1, k, k)
+    log_Ey : array-like of shape (n, t, k)
+    lengths : array-like of shape (n, )
+    log_states : array-like of shape (n, t, k) or None
+    known_states : array-like of shape (n, t) of booleans or None
+    see forward_backward_batch for details.
+    Returns
+    -------
+    (1) states : array of shape (n, t), the most likely state of each timestamp.
+        The padded timestamps are -1.
+    (2) log probability of the observations and the most likely states jointly,
+        of shape (n, ).
+    """
+    assert log_prob_initial.ndim == 2
+    assert log_prob_transition.ndim == 4
+    assert log_Ey.ndim == 3
+    lengths = np.asarray(lengths)
+    n, t, k = log_Ey.shape
+    valid = np.arange(t) < lengths[:, np.newaxis]
+    log_prob_initial, log_prob_transition = _apply_log_states_batch(
+        log_prob_initial, log_prob_transition, log_states, known_states)
+
+    # forward pass, keep the best previous state of each state
+    log_delta = log_prob_initial + log_Ey[:, 0, :]
+    best_previous = np.zeros((n, t, k), dtype=int)
+    for i in range(1, t):
+        log_scores = log_delta[:, :, np.newaxis] + log_prob_transition[:, i - 1, :, :]
+        best_previous[:, i, :] = np.argmax(log_scores, axis=1)
+        log_delta = np.where(valid[:, i, np.newaxis],
+                             np.max(log_scores, axis=1) + log_Ey[:, i, :], log_delta)
+
+    # backtracking, the padded timestamps carry the last state
+    states = np.zeros((n, t), dtype=int)
+    states[:, -1] = np.argmax(log_delta, axis=1)
+    for i in range(t - 1, 0, -1):
+        states[:, i - 1] = np.where(
+            valid[:, i], best_previous[np.arange(n), i, states[:, i]], states[:, i])
+    states[~valid] = -1
+    return states, np.max(log_delta, axis=1)
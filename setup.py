@@ -16,6 +16,7 @@ setup(
         'scikit-learn >= 0.24.1',
         'scipy >= 1.6.0',
         'statsmodels >= 0.12.2',
+        'threadpoolctl >= 2.0.0',
     ],
     extras_require={
         'tests': [
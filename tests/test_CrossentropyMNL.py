@@ -5,6 +5,7 @@ import unittest
 
 
 import numpy as np
+from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import label_binarize
 import statsmodels.api as sm
 
@@ -708,3 +709,93 @@ class CrossEntropyMNLMultinomialTests(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             self.model_col.predict(X),
             self.model.predict(self.data_anes96.exog[:, 0:1]), decimal=3)
+
+
+class CrossEntropyMNLSoftTargetTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(0)
+        cls.X = np.random.normal(size=(300, 2))
+        cls.sample_weight = np.random.rand(cls.X.shape[0])
+
+    def _test_same_as_repeated_samples(self, n_classes, solver, reg_method, alpha):
+        # the rows of the targets need not sum to one, as the transition posteriors
+        Y = np.random.dirichlet(np.ones(n_classes), self.X.shape[0]) * \
+            np.random.rand(self.X.shape[0], 1)
+        model = CrossEntropyMNL(solver=solver, reg_method=reg_method, alpha=alpha,
+                                tol=1e-8, max_iter=1000)
+        model.fit(self.X, Y, sample_weight=self.sample_weight)
+        X_repeated, Y_repeated, sample_weight_repeated = CrossEntropyMNL._label_encoder(
+            model._transform_X(self.X), Y, self.sample_weight)
+        expected = LogisticRegression(
+            fit_intercept=False, penalty=reg_method, C=1. / alpha, solver=solver,
+            tol=1e-8, max_iter=1000, multi_class='auto' if n_classes == 2 else 'multinomial')
+        expected.fit(X_repeated, Y_repeated, sample_weight=sample_weight_repeated)
+        self.assertEqual(model.coef.shape, (1 if n_classes == 2 else n_classes, 3))
+        np.testing.assert_array_almost_equal(model.coef, expected.coef_, decimal=4)
+        np.testing.assert_array_almost_equal(
+            model.predict_log_proba(self.X), expected.predict_log_proba(X_repeated[::n_classes]),
+            decimal=4)
+
+    def test_lr_binary(self):
+        self._test_same_as_repeated_samples(2, 'lbfgs', 'l2', 0.1)
+
+    def test_lr_multinomial(self):
+        self._test_same_as_repeated_samples(3, 'lbfgs', 'l2', 0.1)
+
+    def test_lr_binary_newton_cg(self):
+        self._test_same_as_repeated_samples(2, 'newton-cg', 'l2', 1.)
+
+    def test_lr_multinomial_newton_cg(self):
+        self._test_same_as_repeated_samples(4, 'newton-cg', 'l2', 1.)
+
+    def test_lr_fit_batch(self):
+        for n_classes, solver in [(2, 'lbfgs'), (3, 'lbfgs')]:
+            Y = np.random.dirichlet(np.ones(n_classes), (4, self.X.shape[0]))
+            sample_weights = np.random.rand(4, self.X.shape[0])
+            models = [CrossEntropyMNL(solver=solver, alpha=0.1, tol=1e-8, max_iter=1000)
+                      for _ in range(4)]
+            self.assertTrue(CrossEntropyMNL.can_fit_batch(models))
+            CrossEntropyMNL.fit_batch(models, self.X, Y, sample_weights)
+            for model, model_Y, sample_weight in zip(models, Y, sample_weights):
+                expected = CrossEntropyMNL(solver=solver, alpha=0.1, tol=1e-8, max_iter=1000)
+                expected.fit(self.X, model_Y, sample_weight=sample_weight)
+                self.assertEqual(model.n_classes, n_classes)
+                np.testing.assert_array_almost_equal(model.coef, expected.coef, decimal=4)
+                np.testing.assert_array_almost_equal(
+                    model.predict_log_proba(self.X), expected.predict_log_proba(self.X),
+                    decimal=4)
+
+    def test_lr_can_fit_batch(self):
+        self.assertFalse(CrossEntropyMNL.can_fit_batch(
+            [CrossEntropyMNL(), CrossEntropyMNL(solver='saga', reg_method='l1')]))
+        self.assertFalse(CrossEntropyMNL.can_fit_batch(
+            [CrossEntropyMNL(alpha=1), CrossEntropyMNL(alpha=2)]))
+        self.assertFalse(CrossEntropyMNL.can_fit_batch([CrossEntropyMNL(), DiscreteMNL()]))
+        self.assertFalse(CrossEntropyMNL.can_fit_batch([CrossEntropyMNL(solver='newton-cg')]))
+
+    def test_lr_warm_start(self):
+        Y = np.random.dirichlet(np.ones(3), self.X.shape[0])
+        for solver in ['lbfgs', 'newton-cg']:
+            model = CrossEntropyMNL(solver=solver, alpha=0.1, warm_start=True)
+            model.fit(self.X, Y, sample_weight=self.sample_weight)
+            coef, n_iter = model.coef, model.n_iter
+            # starts from the coefficients of the previous fit
+            model.fit(self.X, Y, sample_weight=self.sample_weight)
+            self.assertLess(model.n_iter, n_iter)
+            np.testing.assert_array_almost_equal(model.coef, coef, decimal=3)
+        models = [CrossEntropyMNL(alpha=0.1, warm_start=True) for _ in range(2)]
+        CrossEntropyMNL.fit_batch(models, self.X, np.stack([Y, Y]))
+        n_iter = models[0].n_iter
+        CrossEntropyMNL.fit_batch(models, self.X, np.stack([Y, Y]))
+        self.assertLess(models[0].n_iter, n_iter)
+
+    def test_lr_l1_regularized(self):
+        # falls back to sklearn on the repeated samples
+        self._test_same_as_repeated_samples(3, 'saga', 'l1', 0.1)
+
+    def test_lr_l2_other_solver(self):
+        # the requested solver is used, by sklearn on the repeated samples
+        self._test_same_as_repeated_samples(3, 'sag', 'l2', 0.1)
+        self.assertFalse(CrossEntropyMNL.can_fit_batch([CrossEntropyMNL(solver='sag')]))
@@ -411,3 +411,13 @@ class DiscreteMNLMultinomialTests(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             self.model_col.predict(X),
             self.model.predict(self.data_anes96.exog[:, 0:1]), decimal=3)
+
+    def test_lr_warm_start(self):
+        self.model = DiscreteMNL(solver='lbfgs', reg_method='l2', alpha=1, max_iter=1000,
+                                 warm_start=True)
+        self.model.fit(self.data_anes96.exog, self.data_anes96.endog)
+        coef, n_iter = self.model.coef, self.model.n_iter
+        # starts from the coefficients of the previous fit
+        self.model.fit(self.data_anes96.exog, self.data_anes96.endog)
+        self.assertLess(self.model.n_iter, n_iter)
+        np.testing.assert_array_almost_equal(self.model.coef, coef, decimal=3)
@@ -358,6 +358,15 @@ class GammaTests(unittest.TestCase):
                       67.37947398,  60.49162862,  73.82609217,  69.61515621]),
             decimal=3)
 
+    def test_glm_warm_start(self):
+        self.model = GLM(family=sm.families.Gamma(), warm_start=True)
+        self.model.fit(self.X, self.Y)
+        coef, n_iter = self.model.coef, self.model.n_iter
+        # starts from the coefficients of the previous fit
+        self.model.fit(self.X, self.Y)
+        self.assertLess(self.model.n_iter, n_iter)
+        np.testing.assert_array_almost_equal(self.model.coef, coef)
+
     def test_glm_regularized(self):
         pass
 
@@ -1449,3 +1458,86 @@ class NegativeBinomialTests(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             self.model_col.predict(X),
             self.model.predict(self.X[:, 0:1]), decimal=3)
+
+
+class IRLSBatchTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = sm.datasets.scotland.load()
+        cls.X = cls.data.exog
+        cls.Y = cls.data.endog
+        cls.sample_weights = np.random.RandomState(0).rand(3, cls.X.shape[0])
+
+    def _statsmodels_fit(self, family, X, Y, sample_weight):
+        model = sm.GLM(Y, sm.add_constant(X, prepend=True), family=family,
+                       freq_weights=sample_weight)
+        model.df_resid = np.sum(sample_weight)
+        return model, model.fit(tol=1e-4, maxiter=100, method='IRLS', wls_method='pinv')
+
+    def test_glm_IRLS_statsmodels(self):
+        for family, Y in [(sm.families.Gamma(), self.Y),
+                          (sm.families.Poisson(), np.round(self.Y)),
+                          (sm.families.Binomial(), np.column_stack([self.Y, 100 - self.Y]))]:
+            self.model = GLM(family=family, est_stderr=True)
+            self.model.fit(self.X, Y, sample_weight=self.sample_weights[0])
+            model, results = self._statsmodels_fit(family, self.X, Y, self.sample_weights[0])
+            np.testing.assert_array_almost_equal(self.model.coef, results.params, decimal=8)
+            self.assertEqual(self.model.n_iter, results.fit_history['iteration'])
+            dispersion = model.scale if isinstance(family, sm.families.Gamma) else 1.
+            self.assertAlmostEqual(self.model.dispersion, dispersion)
+            np.testing.assert_array_almost_equal(
+                self.model.stderr, results.bse * np.sqrt(dispersion / model.scale), decimal=8)
+            np.testing.assert_array_almost_equal(
+                self.model.predict(self.X), results.predict(sm.add_constant(self.X)))
+
+    def test_glm_fit_batch(self):
+        models = [GLM(family=sm.families.Gamma(), est_stderr=True) for _ in range(3)]
+        self.assertTrue(GLM.can_fit_batch(models))
+        GLM.fit_batch(models, self.X, self.Y, self.sample_weights)
+        for model, sample_weight in zip(models, self.sample_weights):
+            self.model = GLM(family=sm.families.Gamma(), est_stderr=True)
+            self.model.fit(self.X, self.Y, sample_weight=sample_weight)
+            np.testing.assert_array_almost_equal(model.coef, self.model.coef, decimal=10)
+            np.testing.assert_array_almost_equal(model.stderr, self.model.stderr, decimal=10)
+            self.assertAlmostEqual(model.dispersion, self.model.dispersion)
+            self.assertEqual(model.n_iter, self.model.n_iter)
+
+    def test_glm_IRLS_not_converged(self):
+        # the IRLS of this module does not converge in a single iteration,
+        # the models fall back to statsmodels
+        models = [GLM(family=sm.families.Gamma(), max_iter=1) for _ in range(2)]
+        GLM.fit_batch(models, self.X, self.Y, self.sample_weights[:2])
+        for model, sample_weight in zip(models, self.sample_weights):
+            self.assertTrue(hasattr(model, '_model'))
+            model_sm = sm.GLM(self.Y, sm.add_constant(self.X, prepend=True),
+                              family=sm.families.Gamma(), freq_weights=sample_weight)
+            model_sm.df_resid = np.sum(sample_weight)
+            results = model_sm.fit(tol=1e-4, maxiter=1, method='IRLS', wls_method='pinv')
+            np.testing.assert_array_almost_equal(model.coef, results.params)
+            self.assertEqual(model.n_iter, results.fit_history['iteration'])
+        # a converged fit does not build a statsmodels model
+        self.model = GLM(family=sm.families.Gamma())
+        self.model.fit(self.X, self.Y, sample_weight=self.sample_weights[0])
+        self.assertFalse(hasattr(self.model, '_model'))
+
+    def test_glm_can_fit_batch(self):
+        self.assertFalse(GLM.can_fit_batch(
+            [GLM(family=sm.families.Gamma()), GLM(family=sm.families.Gaussian())]))
+        self.assertFalse(GLM.can_fit_batch(
+            [GLM(family=sm.families.Gamma()), GLM(family=sm.families.Gamma(), solver='bfgs')]))
+        self.assertFalse(GLM.can_fit_batch(
+            [GLM(family=sm.families.Poisson()),
+             GLM(family=sm.families.Poisson(), reg_method='elastic_net', alpha=0.1)]))
+        self.assertTrue(GLM.can_fit_batch(
+            [GLM(family=sm.families.Gamma()), GLM(family=sm.families.Gamma(), solver='irls')]))
+
+    def test_glm_predict_loaded(self):
+        self.model = GLM(family=sm.families.Gamma())
+        self.model.fit(self.X, self.Y)
+        loaded = GLM(family=sm.families.Gamma(), coef=self.model.coef,
+                     dispersion=self.model.dispersion)
+        np.testing.assert_array_almost_equal(loaded.predict(self.X), self.model.predict(self.X))
+        np.testing.assert_array_almost_equal(
+            loaded.loglike_per_sample(self.X, self.Y),
+            self.model.loglike_per_sample(self.X, self.Y))
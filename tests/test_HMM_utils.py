@@ -1,8 +1,13 @@
+import itertools
 import unittest
 
 import numpy as np
 
-from IOHMM import (forward, backward, forward_backward)
+from IOHMM import (forward, backward, forward_backward, forward_backward_batch,
+                   forward_backward_scaled, forward_backward_scaled_batch,
+                   forward_backward_scan, forward_scan, backward_scan,
+                   forward_backward_checkpoint, viterbi, viterbi_batch,
+                   sample_states, sample_states_batch, Workspace)
 
 
 class HMMUtilsTests(unittest.TestCase):
@@ -65,6 +70,14 @@ class HMMUtilsTests(unittest.TestCase):
                       [1.00000000e+00, 1.00000000e+00, 1.00000000e+00]]),
             decimal=2)
 
+    def test_cal_alpha_beta_scan(self):
+        np.testing.assert_array_almost_equal(
+            forward_scan(self.log_prob_initial, self.log_prob_transition, self.log_Ey),
+            forward(self.log_prob_initial, self.log_prob_transition, self.log_Ey, {}))
+        np.testing.assert_array_almost_equal(
+            backward_scan(self.log_prob_transition, self.log_Ey, n_jobs=2),
+            backward(self.log_prob_transition, self.log_Ey, {}))
+
     def test_forward_backward(self):
         log_gamma, log_epsilon, log_likelihood = forward_backward(
             self.log_prob_initial, self.log_prob_transition, self.log_Ey, {})
@@ -135,3 +148,256 @@ class HMMUtilsTests(unittest.TestCase):
                        [0.02292348, 0.13372032, 0.05730871],
                        [0.05130266, 0.07980414, 0.14250739]]]),
             decimal=6)
+
+
+class HMMBatchTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(0)
+        cls.lengths = np.array([7, 1, 12, 4])
+        cls.num_states = 3
+        n, t, k = cls.lengths.shape[0], cls.lengths.max(), cls.num_states
+
+        def _log_normalize(x):
+            return np.log(x / x.sum(axis=-1, keepdims=True))
+        cls.log_prob_initial = _log_normalize(rng.rand(n, k))
+        cls.log_prob_transition = _log_normalize(rng.rand(n, t - 1, k, k))
+        cls.log_Ey = np.log(rng.rand(n, t, k))
+        cls.log_state = [{}, {}, {3: np.log([0, 1, 0]), 4: np.log([1, 0, 0]), 9: np.log([0, 0, 1])},
+                         {2: np.log([0, 1, 0])}]
+
+    def _dense_log_states(self):
+        log_states = np.zeros(self.log_Ey.shape)
+        known_states = np.zeros(self.log_Ey.shape[:2], dtype=bool)
+        for s, log_state in enumerate(self.log_state):
+            for i in log_state:
+                log_states[s, i] = log_state[i]
+                known_states[s, i] = True
+        return log_states, known_states
+
+    def test_forward_backward_batch(self):
+        log_states, known_states = self._dense_log_states()
+        log_gamma, log_epsilon, log_likelihood = forward_backward_batch(
+            self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+            log_states, known_states)
+        self.assertEqual(log_gamma.shape, self.log_Ey.shape)
+        self.assertEqual(log_epsilon.shape, self.log_prob_transition.shape)
+        for s, length in enumerate(self.lengths):
+            log_gamma_s, log_epsilon_s, log_likelihood_s = forward_backward(
+                self.log_prob_initial[s], self.log_prob_transition[s, :length - 1].copy(),
+                self.log_Ey[s, :length], self.log_state[s])
+            self.assertAlmostEqual(log_likelihood[s], log_likelihood_s)
+            np.testing.assert_array_almost_equal(
+                np.exp(log_gamma[s, :length]), np.exp(log_gamma_s))
+            np.testing.assert_array_almost_equal(
+                np.exp(log_epsilon[s, :length - 1]), np.exp(log_epsilon_s))
+            # padded timestamps have no probability
+            self.assertTrue(np.all(np.isneginf(log_gamma[s, length:])))
+            self.assertTrue(np.all(np.isneginf(log_epsilon[s, length - 1:])))
+
+    def test_forward_backward_known_state_arrays(self):
+        for s, length in enumerate(self.lengths):
+            ids = -np.ones(length, dtype=int)
+            for i in self.log_state[s]:
+                ids[i] = np.argmax(self.log_state[s][i])
+            mask = ids[:, np.newaxis] == np.arange(self.num_states)
+            args = (self.log_prob_initial[s], self.log_prob_transition[s, :length - 1],
+                    self.log_Ey[s, :length])
+            expected = forward_backward(*[a.copy() for a in args], log_state=self.log_state[s])
+            for log_state in [ids, mask]:
+                result = forward_backward(*[a.copy() for a in args], log_state=log_state)
+                for r, e in zip(result, expected):
+                    np.testing.assert_array_almost_equal(np.exp(r), np.exp(e))
+                log_likelihood = forward_backward_checkpoint(
+                    *args, callback=lambda *_: None, log_state=log_state)
+                self.assertAlmostEqual(log_likelihood, expected[2])
+
+    def test_forward_backward_epsilon_out(self):
+        length = self.lengths[2]
+        log_prob_transition = self.log_prob_transition[2, :length - 1]
+        log_prob_transition_before = log_prob_transition.copy()
+        expected = forward_backward(
+            self.log_prob_initial[2], log_prob_transition_before.copy(),
+            self.log_Ey[2, :length], self.log_state[2])
+        out = np.empty(log_prob_transition.shape)
+        result = forward_backward(
+            self.log_prob_initial[2], log_prob_transition, self.log_Ey[2, :length],
+            self.log_state[2], log_epsilon_out=out)
+        self.assertIs(result[1], out)
+        np.testing.assert_array_almost_equal(np.exp(out), np.exp(expected[1]))
+        # the known states do not leak into the transition probabilities
+        np.testing.assert_array_equal(log_prob_transition, log_prob_transition_before)
+
+    def test_forward_backward_beam(self):
+        length = self.lengths[2]
+        args = (self.log_prob_initial[2], self.log_prob_transition[2, :length - 1],
+                self.log_Ey[2, :length], self.log_state[2])
+        expected = forward_backward(*args)
+        # a beam as wide as the number of states is exact
+        result = forward_backward(*args, beam_width=self.num_states)
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[3], 0)
+        self.assertAlmostEqual(result[2], expected[2])
+        np.testing.assert_array_almost_equal(np.exp(result[0]), np.exp(expected[0]))
+        np.testing.assert_array_almost_equal(np.exp(result[1]), np.exp(expected[1]))
+        # a narrow beam keeps the posteriors normalized and reports the mass it dropped
+        for kwargs in [{'beam_width': 1}, {'beam_threshold': 0.5}]:
+            log_gamma, log_epsilon, log_likelihood, pruned_mass = forward_backward(
+                *args, **kwargs)
+            self.assertLessEqual(log_likelihood, expected[2])
+            self.assertTrue(0 < pruned_mass < 1)
+            np.testing.assert_array_almost_equal(np.exp(log_gamma).sum(axis=1), np.ones(length))
+            np.testing.assert_array_almost_equal(np.exp(log_epsilon).sum(axis=(1, 2)),
+                                                 np.ones(length - 1))
+            for i in self.log_state[2]:
+                np.testing.assert_array_equal(log_gamma[i], self.log_state[2][i])
+
+    def test_forward_backward_batch_workspace(self):
+        log_states, known_states = self._dense_log_states()
+        for engine in [forward_backward_batch, forward_backward_scaled_batch]:
+            expected = engine(
+                self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+                log_states, known_states)
+            # with a workspace the known states are folded into the inputs in place
+            log_prob_initial = self.log_prob_initial.copy()
+            log_prob_transition = self.log_prob_transition.copy()
+            result = engine(
+                log_prob_initial, log_prob_transition, self.log_Ey, self.lengths,
+                log_states, known_states, workspace=Workspace())
+            for r, e in zip(result, expected):
+                np.testing.assert_array_almost_equal(r, e)
+            np.testing.assert_array_equal(log_prob_initial[2], self.log_prob_initial[2])
+            np.testing.assert_array_equal(log_prob_transition[2, 2], [np.log([0, 1, 0])] * 3)
+            np.testing.assert_array_equal(log_prob_transition[2, 0], self.log_prob_transition[2, 0])
+
+    def test_forward_backward_scaled_batch(self):
+        log_states, known_states = self._dense_log_states()
+        expected = forward_backward_batch(
+            self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+            log_states, known_states)
+        result = forward_backward_scaled_batch(
+            self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+            log_states, known_states)
+        np.testing.assert_array_almost_equal(result[2], expected[2])
+        np.testing.assert_array_almost_equal(np.exp(result[0]), np.exp(expected[0]))
+        np.testing.assert_array_almost_equal(np.exp(result[1]), np.exp(expected[1]))
+
+    def test_forward_backward_scaled_long_sequence(self):
+        # emissions far below the smallest float would underflow without shifting
+        log_Ey = self.log_Ey[2, :12] - 1000
+        expected = forward_backward(
+            self.log_prob_initial[2], self.log_prob_transition[2, :11].copy(), log_Ey)
+        result = forward_backward_scaled(
+            self.log_prob_initial[2], self.log_prob_transition[2, :11], log_Ey)
+        self.assertAlmostEqual(result[2], expected[2])
+        np.testing.assert_array_almost_equal(np.exp(result[0]), np.exp(expected[0]))
+        np.testing.assert_array_almost_equal(np.exp(result[1]), np.exp(expected[1]))
+
+    def test_forward_backward_scan(self):
+        for s, length in enumerate(self.lengths):
+            expected = forward_backward(
+                self.log_prob_initial[s], self.log_prob_transition[s, :length - 1].copy(),
+                self.log_Ey[s, :length], self.log_state[s])
+            for n_jobs in [1, 3]:
+                result = forward_backward_scan(
+                    self.log_prob_initial[s], self.log_prob_transition[s, :length - 1],
+                    self.log_Ey[s, :length], self.log_state[s], n_jobs=n_jobs)
+                self.assertAlmostEqual(result[2], expected[2])
+                np.testing.assert_array_almost_equal(np.exp(result[0]), np.exp(expected[0]))
+                np.testing.assert_array_almost_equal(np.exp(result[1]), np.exp(expected[1]))
+
+    def test_forward_backward_checkpoint(self):
+        log_states, known_states = self._dense_log_states()
+        log_gamma, log_epsilon, log_likelihood = forward_backward_batch(
+            self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+            log_states, known_states)
+        for s, length in enumerate(self.lengths):
+            for max_memory in [None, 1, 800]:
+                result_gamma = np.zeros((length, self.num_states))
+                result_epsilon = np.zeros((length - 1, self.num_states, self.num_states))
+                starts = []
+
+                def _collect(start, log_gamma_chunk, log_epsilon_chunk):
+                    starts.append(start)
+                    result_gamma[start:start + log_gamma_chunk.shape[0]] = log_gamma_chunk
+                    result_epsilon[start:start + log_epsilon_chunk.shape[0]] = log_epsilon_chunk
+                if max_memory == 1:
+                    with self.assertRaises(ValueError):
+                        forward_backward_checkpoint(
+                            self.log_prob_initial[s], self.log_prob_transition[s, :length - 1],
+                            self.log_Ey[s, :length], _collect, self.log_state[s], max_memory)
+                    continue
+                result_likelihood = forward_backward_checkpoint(
+                    self.log_prob_initial[s], self.log_prob_transition[s, :length - 1],
+                    self.log_Ey[s, :length], _collect, self.log_state[s], max_memory)
+                self.assertEqual(starts, sorted(starts, reverse=True))
+                self.assertAlmostEqual(result_likelihood, log_likelihood[s])
+                np.testing.assert_array_almost_equal(
+                    np.exp(result_gamma), np.exp(log_gamma[s, :length]))
+                np.testing.assert_array_almost_equal(
+                    np.exp(result_epsilon), np.exp(log_epsilon[s, :length - 1]))
+
+    def test_sample_states(self):
+        length = self.lengths[2]
+        args = (self.log_prob_initial[2], self.log_prob_transition[2, :length - 1],
+                self.log_Ey[2, :length])
+        log_gamma, log_epsilon, _ = forward_backward(*args, log_state=self.log_state[2])
+        states = sample_states(*args, n_samples=20000, log_state=self.log_state[2],
+                               random_state=np.random.default_rng(0))
+        self.assertEqual(states.shape, (20000, length))
+        # the empirical marginals and pairs match the posteriors
+        frequency = (states[:, :, np.newaxis] == np.arange(self.num_states)).mean(axis=0)
+        np.testing.assert_allclose(frequency, np.exp(log_gamma), atol=0.02)
+        pairs = (states[:, :-1, np.newaxis, np.newaxis] == np.arange(self.num_states)[
+            :, np.newaxis]) & (states[:, 1:, np.newaxis, np.newaxis] == np.arange(
+                self.num_states))
+        np.testing.assert_allclose(pairs.mean(axis=0), np.exp(log_epsilon), atol=0.02)
+        for i in self.log_state[2]:
+            np.testing.assert_array_equal(states[:, i], np.argmax(self.log_state[2][i]))
+        # reproducible given the seed
+        np.testing.assert_array_equal(
+            sample_states(*args, n_samples=5, random_state=1),
+            sample_states(*args, n_samples=5, random_state=1))
+
+    def test_sample_states_batch(self):
+        log_states, known_states = self._dense_log_states()
+        states = sample_states_batch(
+            self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+            n_samples=3, log_states=log_states, known_states=known_states, random_state=0)
+        self.assertEqual(states.shape, (4, 3, self.lengths.max()))
+        for s, length in enumerate(self.lengths):
+            self.assertTrue(np.all(states[s, :, length:] == -1))
+            self.assertTrue(np.all((states[s, :, :length] >= 0) &
+                                   (states[s, :, :length] < self.num_states)))
+
+    def test_viterbi(self):
+        log_states, known_states = self._dense_log_states()
+        states, log_prob = viterbi_batch(
+            self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+            log_states, known_states)
+        self.assertEqual(states.shape, self.log_Ey.shape[:2])
+        for s, length in enumerate(self.lengths):
+            states_s, log_prob_s = viterbi(
+                self.log_prob_initial[s], self.log_prob_transition[s, :length - 1],
+                self.log_Ey[s, :length], self.log_state[s])
+            np.testing.assert_array_equal(states[s, :length], states_s)
+            self.assertAlmostEqual(log_prob[s], log_prob_s)
+            self.assertTrue(np.all(states[s, length:] == -1))
+            for i in self.log_state[s]:
+                self.assertEqual(states_s[i], np.argmax(self.log_state[s][i]))
+
+    def test_viterbi_brute_force(self):
+        length = 7
+        log_prob_initial = self.log_prob_initial[0]
+        log_prob_transition = self.log_prob_transition[0, :length - 1]
+        log_Ey = self.log_Ey[0, :length]
+        best_path, best_log_prob = None, -np.Infinity
+        for path in itertools.product(range(self.num_states), repeat=length):
+            log_prob = log_prob_initial[path[0]] + log_Ey[0, path[0]] + sum(
+                log_prob_transition[i - 1, path[i - 1], path[i]] + log_Ey[i, path[i]]
+                for i in range(1, length))
+            if log_prob > best_log_prob:
+                best_path, best_log_prob = path, log_prob
+        states, log_prob = viterbi(log_prob_initial, log_prob_transition, log_Ey)
+        np.testing.assert_array_equal(states, best_path)
+        self.assertAlmostEqual(log_prob, best_log_prob)
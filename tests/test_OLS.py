@@ -378,6 +378,19 @@ class IndependentMultivariateOLSTests(unittest.TestCase):
             -2758.5438737,
             places=3)
 
+    def test_ols_warm_start(self):
+        self.model = OLS(reg_method='l1', alpha=0.01, tol=1e-8, max_iter=1000, warm_start=True)
+        self.model.fit(self.X, self.Y)
+        coef, n_iter = self.model.coef, self.model.n_iter
+        # starts from the coefficients of the previous fit
+        self.model.fit(self.X, self.Y)
+        self.assertLess(self.model.n_iter, n_iter)
+        np.testing.assert_array_almost_equal(self.model.coef, coef)
+        # direct solvers
+        self.model = OLS(warm_start=True)
+        self.model.fit(self.X, self.Y)
+        self.assertIsNone(self.model.n_iter)
+
     def test_ols_l1_regularized(self):
         # sklearn l1 and elstic net does not support sample weight
         pass
@@ -763,3 +776,47 @@ class PerfectCorrelationMultivariateOLSTests(unittest.TestCase):
         np.testing.assert_array_almost_equal(
             self.model_col.predict(X),
             self.model.predict(self.X[:, 0:1]), decimal=3)
+
+
+class BatchOLSTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(0)
+        cls.X = np.random.normal(size=(1000, 2))
+        cls.Y = cls.X.dot(np.random.normal(size=(2, 2))) + np.random.normal(size=(1000, 2))
+        cls.sample_weights = np.random.rand(3, cls.X.shape[0])
+
+    def test_ols_fit_batch(self):
+        models = [OLS(est_stderr=True) for _ in range(3)]
+        self.assertTrue(OLS.can_fit_batch(models))
+        OLS.fit_batch(models, self.X, self.Y, self.sample_weights)
+        for model, sample_weight in zip(models, self.sample_weights):
+            expected = OLS(est_stderr=True)
+            expected.fit(self.X, self.Y, sample_weight=sample_weight)
+            np.testing.assert_array_almost_equal(model.coef, expected.coef)
+            np.testing.assert_array_almost_equal(model.dispersion, expected.dispersion)
+            np.testing.assert_array_almost_equal(model.stderr, expected.stderr)
+            np.testing.assert_array_almost_equal(model.predict(self.X), expected.predict(self.X))
+
+    def test_ols_fit_batch_multicolinearty(self):
+        models = [OLS(fit_intercept=False, est_stderr=True) for _ in range(3)]
+        X = np.hstack([self.X[:, 0:1], self.X[:, 0:1]])
+        OLS.fit_batch(models, X, self.Y[:, 0], self.sample_weights)
+        for model, sample_weight in zip(models, self.sample_weights):
+            expected = OLS(fit_intercept=False)
+            expected.fit(self.X[:, 0:1], self.Y[:, 0], sample_weight=sample_weight)
+            # the minimum norm solution
+            np.testing.assert_array_almost_equal(model.coef, np.repeat(expected.coef / 2, 2, 1))
+            self.assertEqual(model.stderr, None)
+            np.testing.assert_array_almost_equal(model.dispersion, expected.dispersion)
+
+    def test_ols_can_fit_batch(self):
+        self.assertFalse(OLS.can_fit_batch([OLS(), OLS(reg_method='l2', alpha=1)]))
+        self.assertFalse(OLS.can_fit_batch([OLS(), OLS(fit_intercept=False)]))
+        self.assertTrue(OLS.can_fit_batch([OLS(), OLS(reg_method='l2', alpha=0)]))
+
+    def test_ols_fit_batch_sample_weight_all_zero(self):
+        models = [OLS(), OLS()]
+        sample_weights = np.vstack([self.sample_weights[0], np.zeros(self.X.shape[0])])
+        self.assertRaises(ValueError, OLS.fit_batch, models, self.X, self.Y, sample_weights)
@@ -98,6 +98,26 @@ class SemiSupervisedIOHMMTests(unittest.TestCase):
         with open('tests/IOHMM_models/SemiSupervisedIOHMM/model.json', 'w') as outfile:
             json.dump(json_dict, outfile, indent=4, sort_keys=True)
 
+    def test_train_state_array(self):
+        states = -np.ones(self.data_speed.shape[0], dtype=int)
+        for i in self.states:
+            states[i] = np.argmax(self.states[i])
+        log_likelihoods = []
+        for data_states in [self.states, states]:
+            np.random.seed(0)
+            self.model = SemiSupervisedIOHMM(num_states=4, max_EM_iter=5, EM_tol=1e-10)
+            self.model.set_models(
+                model_initial=CrossEntropyMNL(solver='newton-cg', reg_method='l2'),
+                model_transition=CrossEntropyMNL(solver='newton-cg', reg_method='l2'),
+                model_emissions=[OLS()])
+            self.model.set_inputs(covariates_initial=[], covariates_transition=[],
+                                  covariates_emissions=[[]])
+            self.model.set_outputs([['rt']])
+            self.model.set_data([[self.data_speed, data_states]])
+            self.model.train()
+            log_likelihoods.append(self.model.log_likelihood)
+        self.assertAlmostEqual(log_likelihoods[0], log_likelihoods[1])
+
     def test_from_json(self):
         with open('tests/IOHMM_models/SemiSupervisedIOHMM/model.json') as json_data:
             json_dict = json.load(json_data)
@@ -4,9 +4,11 @@ import unittest
 
 import numpy as np
 import pandas as pd
+import statsmodels.api as sm
 
 from IOHMM import UnSupervisedIOHMM
-from IOHMM import OLS, DiscreteMNL, CrossEntropyMNL
+from IOHMM import GLM, OLS, DiscreteMNL, CrossEntropyMNL
+from IOHMM import EStepPool, TransitionStructure
 
 
 class UnSupervisedIOHMMTests(unittest.TestCase):
@@ -60,6 +62,421 @@ class UnSupervisedIOHMMTests(unittest.TestCase):
             np.exp(self.model.model_transition[0].predict_log_proba(np.array([[]]))),
             np.array([[0.88, 0.12]]), decimal=2)
 
+    def test_train_scaled_engine(self):
+        self.model = UnSupervisedIOHMM(num_states=2, max_EM_iter=100, EM_tol=1e-6)
+        self.model.set_models(
+            model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_emissions=[OLS()])
+        self.model.set_inputs(
+            covariates_initial=[],
+            covariates_transition=['Pacc'],
+            covariates_emissions=[[]])
+        self.model.set_outputs([['rt']])
+        self.model.set_engine('scaled')
+        self.model.set_data([self.data_speed])
+        self.model.train()
+
+        # emission coefficients
+        np.testing.assert_array_almost_equal(
+            self.model.model_emissions[0][0].coef,
+            np.array([[5.5]]), decimal=1)
+        np.testing.assert_array_almost_equal(
+            self.model.model_emissions[1][0].coef,
+            np.array([[6.4]]), decimal=1)
+
+        # posteriors are the same as the log engine
+        log_gammas = [lg.copy() for lg in self.model.log_gammas]
+        log_epsilons = [le.copy() for le in self.model.log_epsilons]
+        log_likelihood = self.model.log_likelihood
+        self.model.set_engine('log')
+        self.model.E_step()
+        self.assertAlmostEqual(self.model.log_likelihood, log_likelihood, places=6)
+        np.testing.assert_array_almost_equal(
+            np.exp(self.model.log_gammas[0]), np.exp(log_gammas[0]))
+        np.testing.assert_array_almost_equal(
+            np.exp(self.model.log_epsilons[0]), np.exp(log_epsilons[0]))
+
+        with self.assertRaises(ValueError):
+            self.model.set_engine('linear')
+
+    def test_train_float32(self):
+        results = {}
+        for dtype in ['float64', 'float32']:
+            np.random.seed(0)
+            self.model = UnSupervisedIOHMM(num_states=2, max_EM_iter=100, EM_tol=1e-6)
+            self.model.set_models(
+                model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_emissions=[OLS()])
+            self.model.set_inputs(
+                covariates_initial=[],
+                covariates_transition=['Pacc'],
+                covariates_emissions=[[]])
+            self.model.set_outputs([['rt']])
+            self.model.set_dtype(dtype)
+            self.model.set_data([self.data_speed])
+            self.model.train()
+            results[dtype] = self.model
+        model_32, model_64 = results['float32'], results['float64']
+        self.assertEqual(model_32.log_gammas[0].dtype, np.float32)
+        self.assertEqual(model_32.log_epsilons[0].dtype, np.float32)
+        self.assertEqual(model_32.inp_transitions_all_sequences.dtype, np.float32)
+        self.assertAlmostEqual(model_32.log_likelihood, model_64.log_likelihood, places=3)
+        np.testing.assert_array_almost_equal(
+            np.exp(model_32.log_gammas[0]), np.exp(model_64.log_gammas[0]), decimal=3)
+        for st in range(2):
+            np.testing.assert_array_almost_equal(
+                model_32.model_emissions[st][0].coef,
+                model_64.model_emissions[st][0].coef, decimal=3)
+
+        with self.assertRaises(ValueError):
+            self.model.set_dtype('float16')
+
+    def _train_with_structure(self, num_states, structure, joint_transition=False):
+        np.random.seed(0)
+        model = UnSupervisedIOHMM(num_states=num_states, max_EM_iter=100, EM_tol=1e-6)
+        model.set_models(
+            model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_emissions=[OLS()])
+        model.set_inputs(
+            covariates_initial=[],
+            covariates_transition=['Pacc'],
+            covariates_emissions=[[]])
+        model.set_outputs([['rt']])
+        model.set_transition_structure(structure)
+        model.set_joint_transition(joint_transition)
+        model.set_data([self.data_speed])
+        model.train()
+        return model
+
+    def test_train_full_transition_structure(self):
+        model_dense = self._train_with_structure(2, None)
+        model_sparse = self._train_with_structure(2, np.ones((2, 2), dtype=bool))
+        self.assertEqual(model_sparse.log_epsilons[0].shape, (self.data_speed.shape[0] - 1, 4))
+        self.assertAlmostEqual(model_sparse.log_likelihood, model_dense.log_likelihood, places=4)
+        np.testing.assert_array_almost_equal(
+            np.exp(model_sparse.transition_structure.to_dense(model_sparse.log_epsilons[0])),
+            np.exp(model_dense.log_epsilons[0]))
+
+    def test_train_joint_transition(self):
+        model = self._train_with_structure(2, None)
+        for structure in [None, np.ones((2, 2), dtype=bool)]:
+            model_joint = self._train_with_structure(2, structure, joint_transition=True)
+            self.assertIn(('transitions', ), model_joint.fit_times)
+            self.assertAlmostEqual(model_joint.log_likelihood, model.log_likelihood, places=3)
+            for st in range(2):
+                np.testing.assert_array_almost_equal(model_joint.model_transition[st].coef,
+                                                     model.model_transition[st].coef, decimal=2)
+        # the states have different numbers of successors, fitted one by one
+        model_joint = self._train_with_structure(
+            3, TransitionStructure.left_right(3), joint_transition=True)
+        self.assertIn(('transition', 2), model_joint.fit_times)
+
+    def test_train_left_right_transition_structure(self):
+        self.model = self._train_with_structure(
+            3, TransitionStructure.left_right(3))
+        self.assertEqual(self.model.log_epsilons[0].shape, (self.data_speed.shape[0] - 1, 5))
+        self.assertEqual(self.model.model_transition[2].n_classes, 1)
+        log_prob_transition = self.model._cal_log_prob_transition(
+            self.model.inp_transitions[0])
+        self.assertTrue(np.all(np.isneginf(log_prob_transition[:, 1, 0])))
+        self.assertTrue(np.all(np.isneginf(log_prob_transition[:, 2, :2])))
+        np.testing.assert_array_almost_equal(
+            np.exp(log_prob_transition).sum(axis=2), np.ones((self.data_speed.shape[0] - 1, 3)))
+        states = self.model.decode([self.data_speed])[0]
+        self.assertTrue(np.all(np.diff(states) >= 0))
+
+        json_dict = self.model.to_json('tests/IOHMM_models/UnSupervisedIOHMMLeftRight/')
+        self.assertEqual(json_dict['properties']['transition_structure'], [[0, 1], [1, 2], [2]])
+        model = UnSupervisedIOHMM.from_json(json_dict)
+        self.assertEqual(model.transition_structure.to_list(), [[0, 1], [1, 2], [2]])
+        np.testing.assert_array_almost_equal(
+            model._cal_log_prob_transition(self.model.inp_transitions[0]), log_prob_transition)
+
+        with self.assertRaises(ValueError):
+            self.model.set_transition_structure(TransitionStructure.left_right(2))
+
+    def test_train_beam(self):
+        models = []
+        for beam_width in [None, 2]:
+            np.random.seed(0)
+            model = UnSupervisedIOHMM(num_states=2, max_EM_iter=100, EM_tol=1e-6)
+            model.set_models(
+                model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_emissions=[OLS()])
+            model.set_inputs(covariates_initial=[], covariates_transition=['Pacc'],
+                             covariates_emissions=[[]])
+            model.set_outputs([['rt']])
+            model.set_beam(beam_width=beam_width)
+            model.set_data([self.data_speed])
+            model.train()
+            models.append(model)
+        model_exact, self.model = models
+        self.assertEqual(self.model.pruned_masses, [0.])
+        self.assertAlmostEqual(self.model.log_likelihood, model_exact.log_likelihood, places=4)
+        np.testing.assert_array_almost_equal(
+            np.exp(self.model.log_gammas[0]), np.exp(model_exact.log_gammas[0]), decimal=4)
+
+        self.model.set_beam(beam_width=1)
+        self.model.E_step()
+        self.assertGreater(self.model.pruned_masses[0], 0)
+        self.assertLess(self.model.log_likelihood, model_exact.log_likelihood)
+        np.testing.assert_array_equal((self.model.log_gammas[0] > -np.Infinity).sum(axis=1), 1)
+
+        with self.assertRaises(ValueError):
+            self.model.set_beam(beam_width=0)
+        with self.assertRaises(ValueError):
+            self.model.set_beam(beam_threshold=-1.)
+
+    def test_sample_states(self):
+        self.model = UnSupervisedIOHMM(num_states=2, max_EM_iter=100, EM_tol=1e-6)
+        self.model.set_models(
+            model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_emissions=[OLS()])
+        self.model.set_inputs(
+            covariates_initial=[],
+            covariates_transition=['Pacc'],
+            covariates_emissions=[[]])
+        self.model.set_outputs([['rt']])
+        self.model.set_data([self.data_speed])
+        self.model.train()
+        states = self.model.sample_states([self.data_speed, self.data_speed.iloc[:10]],
+                                          n_samples=500, random_state=0)
+        self.assertEqual(states[0].shape, (500, self.data_speed.shape[0]))
+        self.assertEqual(states[1].shape, (500, 10))
+        frequency = (states[0] == 1).mean(axis=0)
+        np.testing.assert_allclose(frequency, np.exp(self.model.log_gammas[0][:, 1]), atol=0.1)
+        np.testing.assert_array_equal(
+            self.model.sample_states([self.data_speed], random_state=1)[0],
+            self.model.sample_states([self.data_speed], random_state=1)[0])
+        # a sequence of a single record has no transition
+        states = self.model.sample_states([self.data_speed.iloc[:1], self.data_speed.iloc[:5]],
+                                          n_samples=3, random_state=0)
+        self.assertEqual(states[0].shape, (3, 1))
+        self.assertEqual(states[1].shape, (3, 5))
+
+    def test_train_n_jobs(self):
+        dfs = [self.data_speed.iloc[:200], self.data_speed.iloc[200:260],
+               self.data_speed.iloc[260:], self.data_speed.iloc[100:110]]
+        # the first shard is a single sequence of a single record, without any transition
+        dfs_short = [self.data_speed.iloc[:1], self.data_speed.iloc[1:40]]
+        models, models_short = [], []
+        for data, trained in [(dfs, models), (dfs_short, models_short)]:
+            for n_jobs in [1, 2]:
+                np.random.seed(0)
+                model = UnSupervisedIOHMM(num_states=2, max_EM_iter=10, EM_tol=1e-6)
+                model.set_models(
+                    model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                    model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                    model_emissions=[OLS()])
+                model.set_inputs(covariates_initial=[], covariates_transition=['Pacc'],
+                                 covariates_emissions=[[]])
+                model.set_outputs([['rt']])
+                model.set_data(data)
+                model.train(n_jobs=n_jobs)
+                trained.append(model)
+        self.assertAlmostEqual(models_short[1].log_likelihood, models_short[0].log_likelihood)
+        self.assertAlmostEqual(models[1].log_likelihood, models[0].log_likelihood, places=8)
+        for seq in range(len(dfs)):
+            self.assertAlmostEqual(models[1].log_likelihoods[seq], models[0].log_likelihoods[seq])
+            np.testing.assert_array_almost_equal(models[1].log_gammas[seq],
+                                                 models[0].log_gammas[seq])
+            np.testing.assert_array_almost_equal(np.exp(models[1].log_epsilons[seq]),
+                                                 np.exp(models[0].log_epsilons[seq]))
+        # a single parallel E step
+        models[1].E_step(n_jobs=3)
+        self.assertAlmostEqual(models[1].log_likelihood, models[0].log_likelihood, places=4)
+        # the posteriors are back in the arrays of the model when the pool is closed
+        log_gammas = models[1].log_gammas
+        models[1].log_gammas_all_sequences[...] = 0
+        with EStepPool(models[1], n_jobs=2, backend='memmap') as pool:
+            self.assertIsNot(models[1].log_gammas, log_gammas)
+            pool.E_step()
+        self.assertIs(models[1].log_gammas, log_gammas)
+        np.testing.assert_array_almost_equal(models[1].log_gammas_all_sequences,
+                                             models[0].log_gammas_all_sequences)
+
+    def test_E_step_pool_worker_error(self):
+        self.model = UnSupervisedIOHMM(num_states=2, max_EM_iter=100, EM_tol=1e-6)
+        self.model.set_models(
+            model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_emissions=[OLS()])
+        self.model.set_inputs(covariates_initial=[], covariates_transition=['Pacc'],
+                              covariates_emissions=[[]])
+        self.model.set_outputs([['rt']])
+        self.model.set_data([self.data_speed.iloc[:200], self.data_speed.iloc[200:]])
+        log_gammas = self.model.log_gammas
+        pool = EStepPool(self.model, n_jobs=2)
+        # the linear models are not trained, the E step of the workers raises
+        with self.assertRaisesRegex(ValueError, 'not trained'):
+            with pool:
+                pool.E_step()
+        self.assertEqual(pool.shared, {})
+        self.assertEqual(pool.workers, [])
+        self.assertIs(self.model.log_gammas, log_gammas)
+        # a worker process that exited
+        self.model.M_step()
+        with EStepPool(self.model, n_jobs=2) as pool:
+            pool.E_step()
+            pool.workers[0].terminate()
+            pool.workers[0].join()
+            with self.assertRaisesRegex(RuntimeError, 'exited'):
+                pool.E_step()
+        self.assertEqual(pool.shared, {})
+
+    def test_train_warm_start(self):
+        models = []
+        for warm_start, measure_warm_start in [(False, True), (True, False), (True, True)]:
+            np.random.seed(0)
+            model = UnSupervisedIOHMM(num_states=3, max_EM_iter=100, EM_tol=1e-6)
+            model.set_models(
+                model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_emissions=[OLS(), DiscreteMNL(solver='lbfgs', reg_method='l2')])
+            model.set_inputs(covariates_initial=[], covariates_transition=['Pacc'],
+                             covariates_emissions=[['Pacc'], ['Pacc']])
+            model.set_outputs([['rt'], ['corr']])
+            model.set_data([self.data_speed])
+            model.train(warm_start=warm_start, measure_warm_start=measure_warm_start)
+            models.append(model)
+        self.assertAlmostEqual(models[1].log_likelihood, models[0].log_likelihood, places=3)
+        self.assertIsNone(models[0].solver_iterations_saved)
+        self.assertIsNone(models[1].solver_iterations_saved)
+        self.assertLess(sum(models[1].solver_iterations), sum(models[0].solver_iterations))
+        # the refits from scratch do not change the training
+        self.assertEqual(models[2].solver_iterations, models[1].solver_iterations)
+        self.assertEqual(models[2].log_likelihood, models[1].log_likelihood)
+        self.assertGreater(models[2].solver_iterations_saved, 0)
+        self.assertIsNone(models[1].n_iters[('emissions', 0)])
+        self.assertTrue(all(model.warm_start for model in models[1]._linear_models()))
+
+    def test_train_glm_emissions(self):
+        models = []
+        for model_emission in [OLS(), GLM(family=sm.families.Gaussian())]:
+            np.random.seed(0)
+            model = UnSupervisedIOHMM(num_states=2, max_EM_iter=10, EM_tol=1e-6)
+            model.set_models(
+                model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_emissions=[model_emission])
+            model.set_inputs(covariates_initial=[], covariates_transition=[],
+                             covariates_emissions=[['Pacc']])
+            model.set_outputs([['rt']])
+            model.set_data([self.data_speed])
+            model.train()
+            models.append(model)
+        # the Gaussian GLM of all the states are fitted at once, as the OLS
+        self.assertIn(('emissions', 0), models[1].fit_times)
+        self.assertIsNotNone(models[1].n_iters[('emissions', 0)])
+        self.assertAlmostEqual(models[1].log_likelihood, models[0].log_likelihood, places=6)
+        for st in range(2):
+            np.testing.assert_array_almost_equal(
+                models[1].model_emissions[st][0].coef, models[0].model_emissions[st][0].coef[0])
+
+    def test_M_step_n_jobs(self):
+        models = []
+        for n_jobs in [1, 4]:
+            np.random.seed(0)
+            model = UnSupervisedIOHMM(num_states=3, max_EM_iter=3, EM_tol=1e-6)
+            model.set_models(
+                model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+                model_emissions=[OLS(), DiscreteMNL(solver='lbfgs', reg_method='l2')])
+            model.set_inputs(covariates_initial=[], covariates_transition=['Pacc'],
+                             covariates_emissions=[['Pacc'], []])
+            model.set_outputs([['rt'], ['corr']])
+            model.set_data([self.data_speed])
+            model.train(n_jobs=n_jobs)
+            models.append(model)
+        self.assertEqual(models[1].log_likelihood, models[0].log_likelihood)
+        for st in range(3):
+            np.testing.assert_array_equal(models[1].model_transition[st].coef,
+                                          models[0].model_transition[st].coef)
+            for emis in range(2):
+                np.testing.assert_array_equal(models[1].model_emissions[st][emis].coef,
+                                              models[0].model_emissions[st][emis].coef)
+        self.assertEqual(sorted(models[1].fit_times), sorted(
+            [('initial', )] + [('transition', st) for st in range(3)] +
+            [('emissions', 0)] + [('emission', st, 1) for st in range(3)]))
+        self.assertTrue(all(seconds >= 0 for seconds in models[1].fit_times.values()))
+
+    def test_E_step_reuses_buffers(self):
+        self.model = UnSupervisedIOHMM(num_states=2, max_EM_iter=3, EM_tol=1e-6)
+        self.model.set_models(
+            model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_emissions=[OLS()])
+        self.model.set_inputs(
+            covariates_initial=[],
+            covariates_transition=['Pacc'],
+            covariates_emissions=[[]])
+        self.model.set_outputs([['rt']])
+        self.model.set_data([self.data_speed, self.data_speed.iloc[:50]])
+        log_gammas, log_epsilons = list(self.model.log_gammas), list(self.model.log_epsilons)
+        nbytes = self.model.workspace.nbytes
+        self.model.train()
+        self.assertEqual(self.model.workspace.nbytes, nbytes)
+        # the log probabilities of all sequences are views of the workspace
+        log_probs = self.model._cal_log_probs_all_sequences(sparse=True)
+        for log_prob, name in zip(log_probs[0][1:], ['log_prob_transition_all_sequences',
+                                                     'log_Ey_all_sequences']):
+            self.assertTrue(np.shares_memory(
+                log_prob, self.model.workspace.get(name, (1, ), self.model.dtype)))
+        self.assertEqual(self.model.workspace.nbytes, nbytes)
+        for seq in range(2):
+            self.assertIs(self.model.log_gammas[seq], log_gammas[seq])
+            self.assertIs(self.model.log_epsilons[seq], log_epsilons[seq])
+            # the arrays of each sequence are views of the arrays of all sequences
+            self.assertTrue(np.shares_memory(self.model.log_gammas[seq],
+                                             self.model.log_gammas_all_sequences))
+            self.assertTrue(np.shares_memory(self.model.log_epsilons[seq],
+                                             self.model.log_epsilons_all_sequences))
+            self.assertTrue(np.shares_memory(self.model.inp_transitions[seq],
+                                             self.model.inp_transitions_all_sequences))
+            self.assertTrue(np.shares_memory(self.model.out_emissions[seq][0],
+                                             self.model.out_emissions_all_sequences[0]))
+        np.testing.assert_array_equal(
+            self.model.log_gammas_all_sequences[self.data_speed.shape[0]:],
+            self.model.log_gammas[1])
+        np.testing.assert_array_almost_equal(
+            np.exp(self.model.log_gammas[0]).sum(axis=1), np.ones(self.data_speed.shape[0]))
+
+    def test_decode(self):
+        self.model = UnSupervisedIOHMM(num_states=2, max_EM_iter=100, EM_tol=1e-6)
+        self.model.set_models(
+            model_initial=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_transition=CrossEntropyMNL(solver='lbfgs', reg_method='l2'),
+            model_emissions=[OLS()])
+        self.model.set_inputs(
+            covariates_initial=[],
+            covariates_transition=[],
+            covariates_emissions=[[]])
+        self.model.set_outputs([['rt']])
+        self.model.set_data([self.data_speed])
+        self.model.train()
+        states = self.model.decode([self.data_speed, self.data_speed.iloc[:10]])
+        self.assertEqual(len(states), 2)
+        self.assertEqual(states[0].shape, (self.data_speed.shape[0], ))
+        self.assertEqual(states[1].shape, (10, ))
+        # a sequence of a single record has no transition
+        states_short = self.model.decode([self.data_speed.iloc[:1], self.data_speed.iloc[:5]])
+        self.assertEqual(states_short[0].shape, (1, ))
+        self.assertEqual(states_short[1].shape, (5, ))
+        log_prob_initial, _, log_Ey = self.model._cal_log_probs(
+            *self.model._get_inputs_outputs(self.data_speed.iloc[:1]))
+        self.assertEqual(states_short[0][0], np.argmax(log_prob_initial + log_Ey[0]))
+        # the most likely path mostly agrees with the most likely state of each timestamp
+        self.assertGreater(
+            np.mean(states[0] == np.argmax(self.model.log_gammas[0], axis=1)), 0.9)
+        # state 1 has the larger response time
+        self.assertGreater(self.data_speed['rt'][states[0] == 1].mean(),
+                           self.data_speed['rt'][states[0] == 0].mean())
+
     def test_train_covariates_for_transition(self):
         self.model = UnSupervisedIOHMM(num_states=2, max_EM_iter=100, EM_tol=1e-6)
         self.model.set_models(
@@ -0,0 +1,89 @@
+import json
+import unittest
+
+
+import numpy as np
+import pandas as pd
+
+from IOHMM import UnSupervisedIOHMM
+from IOHMM import OnlineFilter, FixedLagSmoother
+from IOHMM import forward, forward_backward
+
+
+class OnlineFilterTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data_speed = pd.read_csv('examples/data/speed.csv')
+        with open('tests/IOHMM_models/UnSupervisedIOHMM/model.json') as json_data:
+            json_dict = json.load(json_data)
+        cls.model = UnSupervisedIOHMM.from_json(json_dict)
+        cls.model.set_data([cls.data_speed])
+        cls.model.E_step()
+        cls.log_alpha = forward(*cls.model._cal_log_probs(
+            *cls.model._get_inputs_outputs(cls.data_speed)))
+
+    def test_untrained_model(self):
+        with self.assertRaises(ValueError):
+            OnlineFilter(UnSupervisedIOHMM(num_states=2))
+
+    def test_update(self):
+        online_filter = OnlineFilter(self.model)
+        self.assertIsNone(online_filter.state_probabilities)
+        for i, (_, row) in enumerate(self.data_speed.iterrows()):
+            state_probabilities = online_filter.update(row)
+            np.testing.assert_array_almost_equal(
+                state_probabilities,
+                np.exp(self.log_alpha[i] - np.logaddexp.reduce(self.log_alpha[i])))
+        self.assertEqual(online_filter.n_records, self.data_speed.shape[0])
+        self.assertAlmostEqual(online_filter.log_likelihood, self.model.log_likelihood)
+
+        # a new sequence
+        online_filter.reset()
+        online_filter.update(self.data_speed.iloc[0].to_dict())
+        np.testing.assert_array_almost_equal(
+            online_filter.state_probabilities,
+            np.exp(self.log_alpha[0] - np.logaddexp.reduce(self.log_alpha[0])))
+
+
+class FixedLagSmootherTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data_speed = pd.read_csv('examples/data/speed.csv').iloc[:50]
+        with open('tests/IOHMM_models/UnSupervisedIOHMM/model.json') as json_data:
+            json_dict = json.load(json_data)
+        cls.model = UnSupervisedIOHMM.from_json(json_dict)
+
+    def _log_gamma_prefix(self, length):
+        log_gamma, _, _ = forward_backward(*self.model._cal_log_probs(
+            *self.model._get_inputs_outputs(self.data_speed.iloc[:length])))
+        return log_gamma
+
+    def test_update(self):
+        lag = 5
+        smoother = FixedLagSmoother(self.model, lag=lag)
+        for i, (_, row) in enumerate(self.data_speed.iterrows()):
+            log_gamma = smoother.update(row)
+            if i < lag:
+                self.assertIsNone(log_gamma)
+            elif i % 10 == 0:
+                np.testing.assert_array_almost_equal(
+                    np.exp(log_gamma), np.exp(self._log_gamma_prefix(i + 1)[i - lag]))
+        self.assertEqual(len(smoother._buffer), lag + 1)
+        np.testing.assert_array_almost_equal(
+            np.exp(smoother.flush()), np.exp(self._log_gamma_prefix(50)[-lag:]))
+
+    def test_flush_short_sequence(self):
+        smoother = FixedLagSmoother(self.model, lag=100)
+        for _, row in self.data_speed.iterrows():
+            self.assertIsNone(smoother.update(row))
+        np.testing.assert_array_almost_equal(
+            np.exp(smoother.flush()), np.exp(self._log_gamma_prefix(50)))
+
+    def test_zero_lag(self):
+        smoother = FixedLagSmoother(self.model, lag=0)
+        for _, row in self.data_speed.iloc[:5].iterrows():
+            np.testing.assert_array_almost_equal(
+                np.exp(smoother.update(row)), smoother.state_probabilities)
+        self.assertEqual(smoother.flush().shape, (0, 2))
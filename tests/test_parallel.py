@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+
+from IOHMM.parallel import SharedArray, _balance_shards
+
+
+class BalanceShardsTests(unittest.TestCase):
+    def test_balance_shards(self):
+        lengths = np.array([10, 3, 7, 2, 8, 1])
+        shards = _balance_shards(lengths, 3)
+        self.assertEqual(shards, [(0, 1), (1, 3), (3, 6)])
+        self.assertEqual([lengths[start:stop].sum() for start, stop in shards], [10, 10, 11])
+
+    def test_balance_shards_more_shards_than_sequences(self):
+        self.assertEqual(_balance_shards(np.array([5, 4]), 4), [(0, 1), (1, 2)])
+        self.assertEqual(_balance_shards(np.array([100, 1, 1]), 3), [(0, 1), (1, 3)])
+
+
+class SharedArrayTests(unittest.TestCase):
+    def _test_backend(self, backend):
+        array = np.arange(12, dtype=np.float32).reshape(4, 3)
+        shared = SharedArray(array, backend)
+        try:
+            self.assertEqual(shared.backend, backend)
+            attached, buffer = SharedArray.attach(shared.descriptor)
+            np.testing.assert_array_equal(attached, array)
+            self.assertEqual(attached.dtype, np.float32)
+            # writes are seen through the other attachment
+            attached[1, 2] = -1
+            self.assertEqual(shared.array[1, 2], -1)
+            del attached
+            if backend == 'shared_memory':
+                buffer.close()
+        finally:
+            shared.close()
+
+    def test_shared_memory(self):
+        self._test_backend('shared_memory')
+
+    def test_memmap(self):
+        self._test_backend('memmap')
+
+    def test_object_array(self):
+        array = np.array(['a', 'b'], dtype=object)
+        shared = SharedArray(array)
+        self.assertEqual(shared.backend, 'inline')
+        np.testing.assert_array_equal(SharedArray.attach(shared.descriptor)[0], array)
+        shared.close()
+
+    def test_empty_array(self):
+        shared = SharedArray(np.zeros((5, 0)))
+        self.assertEqual(SharedArray.attach(shared.descriptor)[0].shape, (5, 0))
+        shared.close()
@@ -0,0 +1,83 @@
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from IOHMM import (TransitionStructure, forward_backward, forward_backward_batch,
+                   forward_backward_sparse, forward_backward_sparse_batch)
+
+
+class TransitionStructureTests(unittest.TestCase):
+    def test_banded(self):
+        structure = TransitionStructure.banded(4, lower=1, upper=1)
+        self.assertEqual(structure.to_list(), [[0, 1], [0, 1, 2], [1, 2, 3], [2, 3]])
+        self.assertEqual(structure.nnz, 10)
+
+    def test_left_right(self):
+        structure = TransitionStructure.left_right(4, max_jump=2)
+        self.assertEqual(structure.to_list(), [[0, 1, 2], [1, 2, 3], [2, 3], [3]])
+        np.testing.assert_array_equal(structure.to_mask(), np.triu(np.tril(np.ones((4, 4)), 2)))
+
+    def test_from_mask(self):
+        mask = np.array([[1, 0, 1], [0, 1, 0], [1, 1, 1]], dtype=bool)
+        structure = TransitionStructure.from_mask(mask)
+        np.testing.assert_array_equal(structure.to_mask(), mask)
+        np.testing.assert_array_equal(structure.successors(0), [0, 2])
+        np.testing.assert_array_equal(
+            TransitionStructure.from_mask(sparse.csr_matrix(mask)).indices, structure.indices)
+        self.assertEqual(TransitionStructure.from_list(structure.to_list()).to_list(),
+                         structure.to_list())
+
+    def test_no_successor(self):
+        with self.assertRaises(ValueError):
+            TransitionStructure.from_mask(np.array([[1, 1], [0, 0]], dtype=bool))
+
+
+class ForwardBackwardSparseTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.RandomState(0)
+        cls.lengths = np.array([7, 1, 12, 4])
+        cls.num_states = 5
+        n, t, k = cls.lengths.shape[0], cls.lengths.max(), cls.num_states
+        cls.structure = TransitionStructure.from_mask(
+            (rng.rand(k, k) < 0.4) | np.eye(k, dtype=bool))
+        prob = rng.rand(n, t - 1, cls.structure.nnz)
+        prob_sum = np.stack([prob[..., cls.structure.edges(st)].sum(axis=-1)
+                             for st in range(k)], axis=-1)
+        cls.log_prob_transition = np.log(prob / prob_sum[..., cls.structure.rows])
+        cls.log_prob_initial = np.log(rng.dirichlet(np.ones(k), n))
+        cls.log_Ey = np.log(rng.rand(n, t, k))
+
+    def test_forward_backward_sparse_batch(self):
+        log_gamma, log_epsilon, log_likelihood = forward_backward_sparse_batch(
+            self.log_prob_initial, self.log_prob_transition, self.log_Ey, self.lengths,
+            self.structure)
+        self.assertEqual(log_epsilon.shape, self.log_prob_transition.shape)
+        expected = forward_backward_batch(
+            self.log_prob_initial, self.structure.to_dense(self.log_prob_transition),
+            self.log_Ey, self.lengths)
+        np.testing.assert_array_almost_equal(log_likelihood, expected[2])
+        np.testing.assert_array_almost_equal(np.exp(log_gamma), np.exp(expected[0]))
+        np.testing.assert_array_almost_equal(
+            np.exp(self.structure.to_dense(log_epsilon)), np.exp(expected[1]))
+
+    def test_forward_backward_sparse_known_states(self):
+        length = self.lengths[2]
+        states = -np.ones(length, dtype=int)
+        states[[0, 3, 4]] = [0, 0, 0]
+        log_gamma, log_epsilon, log_likelihood = forward_backward_sparse(
+            self.log_prob_initial[2], self.log_prob_transition[2, :length - 1],
+            self.log_Ey[2, :length], self.structure, states)
+        # the known states replace the allowed transitions into them
+        log_prob_transition = self.log_prob_transition[2, :length - 1].copy()
+        log_prob_transition[2] = np.where(self.structure.indices == 0, 0, -np.Infinity)
+        log_prob_transition[3] = log_prob_transition[2]
+        log_prob_initial = np.where(np.arange(self.num_states) == 0, 0, -np.Infinity)
+        expected = forward_backward(
+            log_prob_initial, self.structure.to_dense(log_prob_transition),
+            self.log_Ey[2, :length])
+        self.assertAlmostEqual(log_likelihood, expected[2])
+        np.testing.assert_array_almost_equal(np.exp(log_gamma), np.exp(expected[0]))
+        np.testing.assert_array_almost_equal(
+            np.exp(self.structure.to_dense(log_epsilon)), np.exp(expected[1]))